@@ -1,21 +1,38 @@
+"""
+Violin admittances (mobility, velocity / force) from the analyser's .mat files.
+
+Measurements may come from several acquisition grids (sample rate, FFT size).
+Every measurement is mapped onto the analysis grid (SR, N_FFT) of the root group
+by linear interpolation of the magnitude, NaN above the Nyquist frequency of its
+grid, with interpolation weights computed once per pair of grids. Measurements
+of other grids are also kept at their native resolution, one group of the
+netCDF file per grid ("grid-<sr>-<n_fft>"), without padding to the largest grid.
+Their interpolated copies in the root group are flagged by the `interpolated`
+coordinate: leave them out when combining the root group with the grid groups,
+or when only measured values are wanted.
+"""
+
 import argparse
+import functools
 import pathlib
 import warnings
-from typing import Optional, Tuple
+from typing import Dict, Iterator, Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io
 import xarray as xr
-import seaborn as sns
 import pandas as pd
 
+import compact as compact_storage
+import plotting
+import profiling
+import streaming
 from config import colors, ci, linear_mean, VIOLIN_MAP
 
 # Constants
 RAW_DATA_DIR = pathlib.Path("data/raw/")
 PROCESSED_DATA_PATH = pathlib.Path("data/processed/admittances.nc")
+# Analysis grid
 SR = 51200
 N_FFT = 32768
 CALIBRATION_X = 1 / (20.41 / 1000)  # mv/N
@@ -24,8 +41,48 @@ CALIBRATION_Y = 125 / 1000  # mm/S / V
 PHASES = [1, 2]
 VIOLINS = ["klimke", "levaggi", "stoppani"]
 
+# (sample rate, FFT size)
+Grid = Tuple[int, int]
+
+
+def grid_name(grid: Grid) -> str:
+    return f"grid-{grid[0]}-{grid[1]}"
+
+
+def grid_frequencies(grid: Grid) -> np.ndarray:
+    sr, n_fft = grid
+    return np.linspace(0, sr // 2, n_fft // 2 + 1).astype(np.float32)
 
-def process_file(filepath: pathlib.Path) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+
+@functools.lru_cache(maxsize=None)
+def interpolation(source: Grid, target: Grid) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Linear interpolation from one grid onto another, computed once per pair.
+
+    Returns:
+        For every target bin: index of the lower source bin, weight of the upper
+        one, and whether the bin is within the source's frequency range.
+    """
+    f_source = grid_frequencies(source).astype(np.float64)
+    f_target = grid_frequencies(target).astype(np.float64)
+    valid = f_target <= f_source[-1]
+    lower = np.clip(np.searchsorted(f_source, f_target, side="right") - 1, 0, len(f_source) - 2)
+    weight = (f_target - f_source[lower]) / (f_source[lower + 1] - f_source[lower])
+    return lower, np.clip(weight, 0, 1), valid
+
+
+def to_grid(H: np.ndarray, source: Grid, target: Grid = (SR, N_FFT)) -> np.ndarray:
+    """
+    Map spectra of shape (..., frequency) from one grid onto another.
+    """
+    if source == target:
+        return H
+    lower, weight, valid = interpolation(source, target)
+    mapped = H[..., lower] * (1 - weight) + H[..., lower + 1] * weight
+    return np.where(valid, mapped, np.nan).astype(H.dtype)
+
+
+def process_file(filepath: pathlib.Path) -> Optional[Tuple[Grid, np.ndarray]]:
     """
     Load and process a single .mat file.
 
@@ -33,7 +90,7 @@ def process_file(filepath: pathlib.Path) -> Optional[Tuple[np.ndarray, np.ndarra
         filepath: Path to the .mat file.
 
     Returns:
-        Tuple of (frequency_vector, magnitude_response) or None if validation fails.
+        Tuple of (grid, magnitude_response) or None if validation fails.
     """
     try:
         mat = scipy.io.loadmat(filepath)
@@ -45,11 +102,9 @@ def process_file(filepath: pathlib.Path) -> Optional[Tuple[np.ndarray, np.ndarra
         warnings.warn(f"Missing keys in {filepath}")
         return None
 
-    sr = mat["freq"][0, 0]
-    n_fft = mat["npts"][0, 0]
-
-    if n_fft != N_FFT or sr != SR:
-        warnings.warn(f"Invalid SR or N_FFT in {filepath}: sr={sr}, n_fft={n_fft}")
+    grid = (int(mat["freq"][0, 0]), int(mat["npts"][0, 0]))
+    if mat["yspec"].shape[0] != grid[1] // 2 + 1:
+        warnings.warn(f"Spectrum length does not match n_fft in {filepath}: {grid}")
         return None
 
     X_raw = mat["yspec"][:, 1]
@@ -58,20 +113,19 @@ def process_file(filepath: pathlib.Path) -> Optional[Tuple[np.ndarray, np.ndarra
     X_cal = X_raw * CALIBRATION_X
     Y_cal = Y_raw * CALIBRATION_Y
 
-    f = np.linspace(0, sr // 2, n_fft // 2 + 1).astype(np.float32)
-
     # Calculate Admittance (Mobility) H = Y/X (Velocity / Force)
     H_linear = np.abs(Y_cal / X_cal).astype(np.float32)
 
-    return f, H_linear
+    return grid, H_linear
 
 
-def build_dataset() -> xr.Dataset:
-    """
-    Iterate over raw files and build an xarray Dataset.
+def list_files() -> Iterator[Tuple[pathlib.Path, str, int, int]]:
     """
-    datasets = []
+    Raw files in processing order.
 
+    Yields:
+        Tuple of (file_path, violin, phase, measurement_id).
+    """
     for phase in PHASES:
         for violin in VIOLINS:
             source_dir = RAW_DATA_DIR / f"phase_{phase}" / violin / "admittances"
@@ -87,45 +141,207 @@ def build_dataset() -> xr.Dataset:
                 continue
 
             for i, file_path in enumerate(file_paths):
+                yield file_path, violin, phase, i + 1
+
+
+def build_dataset() -> Tuple[xr.Dataset, Dict[str, xr.Dataset]]:
+    """
+    Iterate over raw files and build xarray Datasets.
+
+    Returns:
+        The dataset on the analysis grid, and the native-resolution dataset of
+        every other acquisition grid, by group name.
+    """
+    records = []
+
+    for file_path, violin, phase, measurement_id in list_files():
+        with profiling.stage("process_file", file=file_path):
+            result = process_file(file_path)
+        if result:
+            grid, H = result
+            records.append((grid, H, violin, phase, measurement_id))
+
+    if not records:
+        raise ValueError("No data found or processed.")
+
+    # --- One dense block per grid, mapped onto the analysis grid at once ---
+    analysis = (SR, N_FFT)
+    H_analysis = np.empty((len(records), N_FFT // 2 + 1), dtype=np.float32)
+    grids = {}
+    for grid in sorted({r[0] for r in records}):
+        index = np.array([n for n, r in enumerate(records) if r[0] == grid])
+        H = np.stack([records[n][1] for n in index])
+        with profiling.stage("to_grid", grid=grid_name(grid)):
+            H_analysis[index] = to_grid(H, grid, analysis)
+        if grid == analysis:
+            continue
+        warnings.warn(f"{len(index)} measurements on {grid_name(grid)} interpolated")
+        grids[grid_name(grid)] = xr.Dataset(
+            data_vars={"H": (["measurement", "frequency"], H)},
+            coords={
+                "measurement": index,
+                "frequency": grid_frequencies(grid),
+            },
+            attrs={"sr": grid[0], "n_fft": grid[1]},
+        )
+
+    coords = list(zip(*(r[2:] for r in records)))
+    combined = xr.Dataset(
+        data_vars={"H": (["measurement", "frequency"], H_analysis)},
+        coords={
+            "frequency": grid_frequencies(analysis),
+            "violin": ("measurement", list(coords[0])),
+            "phase": ("measurement", np.array(coords[1])),
+            "measurement_id": ("measurement", np.array(coords[2])),
+            "grid": ("measurement", [grid_name(r[0]) for r in records]),
+            "interpolated": ("measurement", np.array([r[0] != analysis for r in records])),
+        },
+        attrs={"sr": SR, "n_fft": N_FFT},
+    )
+    return combined, grids
+
+
+def build_dataset_streaming(
+    output_path: pathlib.Path,
+    resume: bool = False,
+    batch_size: int = streaming.BATCH_SIZE,
+) -> int:
+    """
+    Process the raw files and write them as they come, batch by batch.
+
+    Same layout as build_dataset + save_dataset, in constant memory: the root
+    and the grid groups grow along an unlimited measurement dimension and
+    each record keeps its source file.
+
+    Args:
+        output_path: Dataset path.
+        resume: Continue an interrupted run, skipping the files already written.
+        batch_size: Records per write.
+
+    Returns:
+        Number of measurements in the dataset.
+    """
+    analysis = (SR, N_FFT)
+    with streaming.AppendWriter(output_path, resume=resume, batch_size=batch_size) as writer:
+        writer.define(
+            None,
+            {"H": ("frequency",)},
+            {"frequency": grid_frequencies(analysis)},
+            {"sr": SR, "n_fft": N_FFT},
+        )
+        done = set(writer.written(None, "source"))
+        if done:
+            print(f"Resuming after {len(done)} measurements")
+
+        for file_path, violin, phase, measurement_id in list_files():
+            if str(file_path) in done:
+                continue
+            with profiling.stage("process_file", file=file_path):
                 result = process_file(file_path)
-                if result:
-                    f, H = result
-                    ds = xr.Dataset(
-                        data_vars={
-                            "H": (["frequency"], H),
-                        },
-                        coords={
-                            "frequency": f,
-                            "violin": violin,
-                            "phase": phase,
-                            "measurement_id": i + 1,
-                        },
-                    ).expand_dims("measurement")
-
-                    datasets.append(ds)
-
-    if not datasets:
+            if not result:
+                continue
+            grid, H = result
+            # Computed before any append, so that a failure leaves no part of
+            # the measurement in the buffers
+            H_analysis = to_grid(H, grid, analysis)
+            if grid != analysis:
+                if grid_name(grid) not in writer.layouts:
+                    writer.define(
+                        grid_name(grid),
+                        {"H": ("frequency",)},
+                        {"frequency": grid_frequencies(grid)},
+                        {"sr": grid[0], "n_fft": grid[1]},
+                    )
+                warnings.warn(f"{file_path} on {grid_name(grid)} interpolated")
+                writer.append(grid_name(grid), H=H, measurement=writer.n_records(None))
+            # Last, as it closes the measurement (see streaming.AppendWriter)
+            writer.append(
+                None,
+                H=H_analysis,
+                violin=violin,
+                phase=phase,
+                measurement_id=measurement_id,
+                grid=grid_name(grid),
+                interpolated=grid != analysis,
+                source=str(file_path),
+            )
+        n_records = writer.n_records(None)
+
+    if n_records == 0:
         raise ValueError("No data found or processed.")
+    print(f"Dataset saved to {output_path}")
+    return n_records
 
-    combined = xr.concat(datasets, dim="measurement")
-    return combined
 
+def save_dataset(
+    dataset: xr.Dataset,
+    output_path: pathlib.Path,
+    grids: Dict[str, xr.Dataset] = {},
+    compact: bool = False,
+):
+    """
+    Write the analysis grid to the root group and the other grids to groups.
 
-def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path):
+    Args:
+        compact: Store H as int16 dB (H_db, see compact.py) instead of float32.
+    """
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    dataset.to_netcdf(output_path)
+    for n, (group, ds) in enumerate([(None, dataset)] + list(grids.items())):
+        encoding = {}
+        if compact:
+            ds = ds.assign(H_db=compact_storage.to_db(ds["H"])).drop_vars("H")
+            encoding["H_db"] = compact_storage.db_encoding(ds["H_db"])
+            error = compact_storage.max_error(encoding["H_db"])
+            print(f"{group or 'H'}: int16 dB, error <= {error:.4f} dB")
+        ds.to_netcdf(output_path, group=group, mode="a" if n else "w", encoding=encoding)
     print(f"Dataset saved to {output_path}")
 
 
+def load_dataset(
+    dataset_path: pathlib.Path = PROCESSED_DATA_PATH, group: Optional[str] = None
+) -> xr.Dataset:
+    """
+    Open the admittances, decoding the compact storage (H_db) to linear H and
+    dropping a batch left incomplete by an interrupted streaming run.
+    """
+    ds = streaming.trim(xr.open_dataset(dataset_path, group=group))
+    if group is None and "interpolated" not in ds.coords and "grid" in ds.coords:
+        # Files written before the flag
+        ds = ds.assign_coords(interpolated=ds["grid"] != grid_name((SR, N_FFT)))
+    if "H" not in ds and "H_db" in ds:
+        ds["H"] = compact_storage.from_db(ds["H_db"])
+    return ds
+
+
+def load_grid(grid: Grid, dataset_path: pathlib.Path = PROCESSED_DATA_PATH) -> xr.Dataset:
+    """
+    Native-resolution measurements of one acquisition grid.
+
+    Returns:
+        Dataset whose measurement coordinate indexes the root dataset.
+    """
+    if grid == (SR, N_FFT):
+        ds = load_dataset(dataset_path)
+        ds = ds.assign_coords(measurement=np.arange(ds.sizes["measurement"]))
+        return ds.isel(measurement=(ds["grid"] == grid_name(grid)).values)
+    return load_dataset(dataset_path, group=grid_name(grid))
+
+
 def plot_admittances(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+    import matplotlib as mpl
+    import seaborn as sns
+
     # --- 1. Load data ---
-    ds = xr.open_dataset(dataset_path)
+    ds = load_dataset(dataset_path)
     ds = ds.sel(frequency=slice(180, 5000))
 
-    ds["H_db"] = 20 * np.log10(np.abs(ds["H"]))
+    if "H_db" not in ds:
+        ds["H_db"] = 20 * np.log10(np.abs(ds["H"]))
 
     # --- 2. Prepare data for plotting ---
-    df = ds["H_db"].to_dataframe("amplitude")
+    with profiling.stage("to_dataframe"):
+        df = ds["H_db"].to_dataframe("amplitude")
     df_diff = pd.merge(
         df[df["phase"] == 2],
         df[df["phase"] == 1],
@@ -145,18 +361,19 @@ def plot_admittances(dataset_path: pathlib.Path):
     for i, violin in enumerate(VIOLINS):
         ax = axes[i]
 
-        sns.lineplot(
-            data=df[(df["violin"] == violin)],
-            x="frequency",
-            y="amplitude",
-            hue="phase",
-            # errorbar=ci,
-            errorbar=("pi", 100),
-            estimator=linear_mean,
-            palette=[colors[1], colors[2]],
-            ax=ax,
-            err_kws={"linewidth": 0},
-        )
+        with profiling.stage("lineplot"):
+            sns.lineplot(
+                data=df[(df["violin"] == violin)],
+                x="frequency",
+                y="amplitude",
+                hue="phase",
+                # errorbar=ci,
+                errorbar=("pi", 100),
+                estimator=linear_mean,
+                palette=[colors[1], colors[2]],
+                ax=ax,
+                err_kws={"linewidth": 0},
+            )
 
         # Tweak axis
         ax.set_ylabel(f"{VIOLIN_MAP[violin]}\nAmplitude (dB)")
@@ -164,16 +381,17 @@ def plot_admittances(dataset_path: pathlib.Path):
         ax.sharey(axes[0])
 
     # --- 3.2 Row 4 : Differences ---
-    sns.lineplot(
-        data=df_diff,
-        x="frequency",
-        y="difference",
-        hue="violin",
-        errorbar=ci,
-        estimator="mean",
-        ax=axes[-1],
-        err_kws={"linewidth": 0},
-    )
+    with profiling.stage("lineplot"):
+        sns.lineplot(
+            data=df_diff,
+            x="frequency",
+            y="difference",
+            hue="violin",
+            errorbar=ci,
+            estimator="mean",
+            ax=axes[-1],
+            err_kws={"linewidth": 0},
+        )
     axes[-1].set_ylim([-20, 25])
     axes[-1].set_xlabel("Frequency (Hz)")
     axes[-1].set_ylabel("Diff (P2 - P1) (dB)")
@@ -215,8 +433,10 @@ def plot_admittances(dataset_path: pathlib.Path):
     output_png = pathlib.Path("reports/figures/admittances.png")
     output_svg = pathlib.Path("reports/figures/admittances.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    plotting.lean(fig)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
@@ -224,8 +444,26 @@ def main():
     parser = argparse.ArgumentParser(description="Process and plot violin admittances.")
     parser.add_argument("--process", action="store_true", help="Process raw .mat files")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument(
+        "--compact", action="store_true", help="Store the spectra as int16 dB"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write the measurements in batches as they are processed",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue an interrupted --stream run"
+    )
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
+    if args.resume:
+        args.stream = True
+    if args.stream and args.compact:
+        # The int16 scaling needs the range of the whole dataset
+        parser.error("--compact cannot be used with --stream")
 
     # If no args provided, run both
     if not args.process and not args.plot:
@@ -233,11 +471,16 @@ def main():
         args.plot = True
 
     if args.process:
-        ds = build_dataset()
-        save_dataset(ds, PROCESSED_DATA_PATH)
+        with profiling.stage("process"):
+            if args.stream:
+                build_dataset_streaming(PROCESSED_DATA_PATH, args.resume)
+            else:
+                ds, grids = build_dataset()
+                save_dataset(ds, PROCESSED_DATA_PATH, grids, args.compact)
 
     if args.plot:
-        plot_admittances(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot_admittances(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":
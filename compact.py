@@ -0,0 +1,64 @@
+"""
+Compact storage of processed spectra: int16 dB with a scale and an offset.
+
+A dB variable x is stored as round((x - offset) / step) in int16, with the CF
+attributes scale_factor = step and add_offset = offset, so netCDF readers
+(xarray.open_dataset included) decode it back to float32 transparently. The
+offset is the middle of the variable's range and the step is DB_STEP, or the
+range / 65534 if wider, hence, up to the float32 rounding of the decoded values:
+
+    |decoded - x| <= step / 2 = 0.005 dB for any range below 655 dB
+
+NaNs are stored as the int16 fill value. Each variable is also compressed with
+its own filter (shuffle + zlib at COMPLEVEL).
+"""
+
+from typing import Dict
+
+import numpy as np
+import xarray as xr
+
+DB_STEP = 0.01
+COMPLEVEL = 4
+FILL_VALUE = np.int16(-32768)
+
+
+def db_encoding(da: xr.DataArray, step: float = DB_STEP, complevel: int = COMPLEVEL) -> Dict:
+    """
+    netCDF encoding of a dB variable as scaled int16.
+
+    Args:
+        da: Values in dB.
+        step: Quantisation step in dB (the maximum error is step / 2).
+        complevel: zlib compression level of the variable.
+    """
+    low, high = float(da.min()), float(da.max())
+    if not np.isfinite([low, high]).all():
+        raise ValueError(f"{da.name} has no finite values to quantise")
+    # Codes -32767..32767, -32768 being the fill value
+    step = max(step, (high - low) / 65534)
+    return {
+        "dtype": "int16",
+        "scale_factor": np.float32(step),
+        "add_offset": np.float32((low + high) / 2),
+        "_FillValue": FILL_VALUE,
+        "zlib": True,
+        "complevel": complevel,
+        "shuffle": True,
+    }
+
+
+def max_error(encoding: Dict) -> float:
+    """Quantisation error bound of an encoding, in dB."""
+    return float(encoding["scale_factor"]) / 2
+
+
+def to_db(magnitude: xr.DataArray) -> xr.DataArray:
+    with np.errstate(divide="ignore"):
+        db = 20 * np.log10(magnitude)
+    # Zero magnitudes cannot be quantised
+    return db.where(np.isfinite(db)).astype(np.float32)
+
+
+def from_db(db: xr.DataArray) -> xr.DataArray:
+    return (10 ** (db / 20)).astype(np.float32)
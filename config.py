@@ -1,21 +1,12 @@
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 
-# --- Custom styles ---
-mpl.style.use(
-    [
-        "/home/hugo/Thèse/common/styles.mplstyle",
-        "/home/hugo/Thèse/playing-in/acta-acustica.mplstyle",
-    ]
-)
+# Styles and figure size are applied by plotting.setup(), on the first plot
 
 # --- Width and Height ---
 mm = 1 / (2.54 * 10)
 WIDTH = 190 * mm
 RATIO = 4 / 3
 HEIGHT = WIDTH / RATIO
-plt.rcParams["figure.figsize"] = (WIDTH, HEIGHT)
 
 
 # --- Confidence interval function to use instead of seaborn's ---
@@ -25,9 +16,17 @@ def ci(a):
     return m - s, m + s
 
 
-def linear_mean(a):
+def mean_ci(a, axis=-1):
+    """Vectorised version of `ci` along `axis`, ignoring NaNs. Returns (mean, low, high)."""
+    n = np.sum(~np.isnan(a), axis=axis)
+    m = np.nanmean(a, axis=axis)
+    s = 1.96 * np.nanstd(a, axis=axis) / np.sqrt(n)
+    return m, m - s, m + s
+
+
+def linear_mean(a, axis=None):
     lin = 10 ** (a / 20)
-    m = np.sqrt(np.mean(lin**2))
+    m = np.sqrt(np.mean(lin**2, axis=axis))
     m_db = 20 * np.log10(m)
     return m_db
 
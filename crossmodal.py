@@ -0,0 +1,404 @@
+"""
+Do structural changes show up in the radiated sound?
+
+The P2 - P1 change of the admittances (51.2 kHz, 32768-point FFT) and of the
+long-term average spectra of the recordings (16 kHz LTAS) are compared on a
+common grid of third-octave bands, where each band level is the mean power of
+the bins it contains.
+
+- admittance change: per violin, mean phase-2 minus mean phase-1 band levels
+- LTAS change: per (violin, player), the same on the takes, each take being
+  normalised by its mean band level (as in recordings.py) so that playing
+  dynamics cancel out
+- r: per band, correlation across (violin, player) of the two changes
+- coherence: per band, squared uncentred correlation, i.e. how much of the
+  LTAS change energy follows the admittance change, sign included
+- profile_r: per violin, correlation across bands of the admittance change and
+  the mean LTAS change of its players
+
+Confidence intervals come from a bootstrap on admittance measurements (within
+violin and phase) and on players (within violin). All resamples are drawn and
+evaluated as (resample, unit, band) arrays.
+"""
+
+import argparse
+import pathlib
+import warnings
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import loaders
+import plotting
+import profiling
+from config import colors, VIOLIN_MAP
+
+ADMITTANCES_PATH = pathlib.Path("data/processed/admittances.nc")
+RECORDINGS_PATH = pathlib.Path("data/processed/recordings.nc")
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/crossmodal.nc")
+OUTPUT_PATH = pathlib.Path("reports/crossmodal.csv")
+
+# Third-octave bands, within the range of both datasets
+F_MIN = 200
+F_MAX = 5000
+N_RESAMPLES = 2_000
+LEVEL = 0.95
+
+
+# --- 1. Band grid ---
+
+
+def third_octave_bands(f_min: float = F_MIN, f_max: float = F_MAX) -> pd.DataFrame:
+    """
+    Third-octave bands (base 2, around 1 kHz) whose centre is in [f_min, f_max].
+
+    Returns:
+        DataFrame with centre, lower and upper frequencies.
+    """
+    k = np.arange(np.ceil(3 * np.log2(f_min / 1000)), np.floor(3 * np.log2(f_max / 1000)) + 1)
+    centre = 1000 * 2 ** (k / 3)
+    return pd.DataFrame(
+        {"centre": centre, "lower": centre * 2 ** (-1 / 6), "upper": centre * 2 ** (1 / 6)}
+    )
+
+
+def band_matrix(frequency: np.ndarray, bands: pd.DataFrame) -> np.ndarray:
+    """
+    Averaging weights of the frequency bins in every band.
+
+    Returns:
+        Array of shape (band, frequency) whose rows sum to 1.
+
+    Raises:
+        ValueError: If a band contains no bin of this grid.
+    """
+    inside = (frequency >= bands["lower"].to_numpy()[:, None]) & (
+        frequency < bands["upper"].to_numpy()[:, None]
+    )
+    counts = inside.sum(axis=1)
+    if not counts.all():
+        empty = bands["centre"][counts == 0].round(1).tolist()
+        raise ValueError(f"No frequency bin in the bands centred at {empty} Hz")
+    return inside / counts[:, None]
+
+
+def band_levels(magnitude: xr.DataArray, bands: pd.DataFrame) -> np.ndarray:
+    """
+    Band levels (dB) of linear magnitude spectra.
+
+    Returns:
+        Array of shape (measurement, band).
+    """
+    weights = band_matrix(magnitude["frequency"].to_numpy(), bands)
+    power = magnitude.transpose("measurement", "frequency").to_numpy().astype(np.float64) ** 2
+    return 10 * np.log10(power @ weights.T)
+
+
+# --- 2. Changes ---
+
+
+def groups(keys: pd.DataFrame) -> Dict[Tuple, np.ndarray]:
+    """Row indices of every combination of keys."""
+    grouped = keys.reset_index(drop=True).groupby(list(keys.columns))
+    return {k: v.to_numpy() for k, v in grouped.groups.items()}
+
+
+def admittance_levels(path: pathlib.Path, bands: pd.DataFrame) -> Tuple[np.ndarray, pd.DataFrame]:
+    ds = loaders.admittances(path)
+    levels = band_levels(ds["H"], bands)
+    keys = pd.DataFrame({"violin": ds["violin"].values, "phase": ds["phase"].values})
+    return levels, keys
+
+
+def ltas_levels(path: pathlib.Path, bands: pd.DataFrame) -> Tuple[np.ndarray, pd.DataFrame]:
+    ds = loaders.recordings(path)
+    levels = band_levels(10 ** (ds["features"] / 20), bands)
+    # Normalise each take by its own mean level
+    levels -= levels.mean(axis=1, keepdims=True)
+    keys = pd.DataFrame(
+        {
+            "violin": ds["violin"].values,
+            "player": ds["violinist"].values,
+            "phase": ds["phase"].values,
+        }
+    )
+    return levels, keys
+
+
+def resample_means(
+    levels: np.ndarray, rows: np.ndarray, n_resamples: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Mean of the rows, then of n_resamples bootstrap draws of the rows.
+
+    Returns:
+        Array of shape (1 + n_resamples, band).
+    """
+    draws = rng.integers(len(rows), size=(n_resamples, len(rows)))
+    return np.concatenate(
+        [levels[rows].mean(axis=0)[None], levels[rows[draws]].mean(axis=1)]
+    )
+
+
+def changes(
+    admittances: Tuple[np.ndarray, pd.DataFrame],
+    ltas: Tuple[np.ndarray, pd.DataFrame],
+    n_resamples: int = N_RESAMPLES,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    P2 - P1 band changes, observed (resample 0) and bootstrapped.
+
+    Returns:
+        - admittance changes, shape (1 + n_resamples, violin, band)
+        - LTAS changes, shape (1 + n_resamples, unit, band), units being
+          resampled players within their violin
+        - units: violin and player of every unit (players recorded in both phases)
+    """
+    rng = np.random.default_rng(seed)
+    levels, keys = admittances
+    rows = groups(keys)
+    violins = sorted(keys["violin"].unique())
+    delta_admittance = np.stack(
+        [
+            resample_means(levels, rows[(v, 2)], n_resamples, rng)
+            - resample_means(levels, rows[(v, 1)], n_resamples, rng)
+            for v in violins
+        ],
+        axis=1,
+    )
+
+    levels, keys = ltas
+    rows = groups(keys)
+    units = pd.DataFrame(
+        [(v, p) for v, p, phase in rows if phase == 1 and (v, p, 2) in rows and v in violins],
+        columns=["violin", "player"],
+    )
+    if units.empty:
+        raise ValueError("No player recorded in both phases.")
+    # Mean change of every unit, then players resampled within violins
+    unit_change = np.stack(
+        [
+            levels[rows[(v, p, 2)]].mean(axis=0) - levels[rows[(v, p, 1)]].mean(axis=0)
+            for v, p in units.itertuples(index=False)
+        ]
+    )
+    draws = np.empty((n_resamples, len(units)), dtype=int)
+    for index in units.groupby("violin").indices.values():
+        draws[:, index] = index[rng.integers(len(index), size=(n_resamples, len(index)))]
+    draws = np.concatenate([np.arange(len(units))[None], draws])
+    delta_ltas = unit_change[draws]
+
+    units["violin_index"] = [violins.index(v) for v in units["violin"]]
+    return delta_admittance, delta_ltas, units
+
+
+# --- 3. Statistics ---
+
+
+def correlation(x: np.ndarray, y: np.ndarray, axis: int, centred: bool = True) -> np.ndarray:
+    if centred:
+        x = x - x.mean(axis=axis, keepdims=True)
+        y = y - y.mean(axis=axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (x * y).sum(axis=axis) / np.sqrt((x**2).sum(axis=axis) * (y**2).sum(axis=axis))
+
+
+def bootstrap_limits(boot: np.ndarray, level: float = LEVEL) -> np.ndarray:
+    """
+    Percentile limits of the resamples (all but the first, observed, one).
+
+    Returns:
+        Array of the statistic's shape plus a last (low, high) axis.
+    """
+    alpha = (1 - level) / 2
+    with warnings.catch_warnings():
+        # Resamples where a statistic is undefined
+        warnings.simplefilter("ignore", RuntimeWarning)
+        limits = np.nanquantile(boot[1:], [alpha, 1 - alpha], axis=0)
+    return np.moveaxis(limits, 0, -1)
+
+
+def build_dataset(
+    admittances_path: pathlib.Path = ADMITTANCES_PATH,
+    recordings_path: pathlib.Path = RECORDINGS_PATH,
+    n_resamples: int = N_RESAMPLES,
+    level: float = LEVEL,
+    seed: int = 0,
+) -> xr.Dataset:
+    """
+    Band changes of both modalities and their correlations.
+
+    Returns:
+        Dataset with delta_admittance and delta_ltas (violin, band), r and
+        coherence (band), profile_r (violin), and the bootstrap limits of the
+        statistics along a bound dimension (low, high).
+    """
+    bands = third_octave_bands()
+    with profiling.stage("band_levels"):
+        admittances = admittance_levels(admittances_path, bands)
+        ltas = ltas_levels(recordings_path, bands)
+
+    with profiling.stage("bootstrap"):
+        delta_admittance, delta_ltas, units = changes(admittances, ltas, n_resamples, seed)
+
+        # (resample, unit, band)
+        x = delta_admittance[:, units["violin_index"].to_numpy()]
+        y = delta_ltas
+        r = correlation(x, y, axis=1)
+        coherence = correlation(x, y, axis=1, centred=False) ** 2
+
+        # Mean LTAS change of each violin's (resampled) players
+        n_violins = delta_admittance.shape[1]
+        member = np.eye(n_violins)[units["violin_index"]]
+        mean_ltas = np.einsum("uv,rub->rvb", member / member.sum(axis=0), y)
+        profile_r = correlation(delta_admittance, mean_ltas, axis=2)
+
+    def limits(boot):
+        return bootstrap_limits(boot, level)
+
+    violins = sorted(admittances[1]["violin"].unique())
+    return xr.Dataset(
+        data_vars={
+            "delta_admittance": (["violin", "band"], delta_admittance[0]),
+            "delta_admittance_ci": (["violin", "band", "bound"], limits(delta_admittance)),
+            "delta_ltas": (["violin", "band"], mean_ltas[0]),
+            "delta_ltas_ci": (["violin", "band", "bound"], limits(mean_ltas)),
+            "r": (["band"], r[0]),
+            "r_ci": (["band", "bound"], limits(r)),
+            "coherence": (["band"], coherence[0]),
+            "coherence_ci": (["band", "bound"], limits(coherence)),
+            "profile_r": (["violin"], profile_r[0]),
+            "profile_r_ci": (["violin", "bound"], limits(profile_r)),
+            "n_players": (["violin"], member.sum(axis=0).astype(int)),
+        },
+        coords={
+            "violin": violins,
+            "band": bands["centre"].to_numpy(),
+            "lower": ("band", bands["lower"].to_numpy()),
+            "upper": ("band", bands["upper"].to_numpy()),
+            "bound": ["low", "high"],
+        },
+        attrs={"n_resamples": n_resamples, "level": level},
+    )
+
+
+def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path, table_path: pathlib.Path):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    dataset.to_netcdf(output_path)
+    print(f"Dataset saved to {output_path}")
+
+    table = pd.DataFrame(
+        {
+            "band": dataset["band"].values,
+            "r": dataset["r"].values,
+            "r_low": dataset["r_ci"].sel(bound="low").values,
+            "r_high": dataset["r_ci"].sel(bound="high").values,
+            "coherence": dataset["coherence"].values,
+            "coherence_low": dataset["coherence_ci"].sel(bound="low").values,
+            "coherence_high": dataset["coherence_ci"].sel(bound="high").values,
+        }
+    )
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(table_path, index=False)
+    print(table.round(3).to_string(index=False))
+    print(f"Results saved to {table_path}")
+
+
+def plot(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+    import matplotlib as mpl
+
+    # --- 1. Load data ---
+    ds = xr.open_dataset(dataset_path)
+    band = ds["band"].values
+
+    # --- 2. Plotting ---
+    fig, axes = plt.subplots(nrows=len(ds["violin"]) + 1, ncols=1, sharex=True)
+
+    # --- 2.1 One row per violin: both changes ---
+    for ax, violin in zip(axes, ds["violin"].values):
+        for name, style, label in [
+            ("delta_admittance", "-", "Admittance"),
+            ("delta_ltas", "--", "LTAS"),
+        ]:
+            da = ds[name].sel(violin=violin)
+            ci = ds[f"{name}_ci"].sel(violin=violin)
+            ax.plot(band, da, style, color=colors[violin], label=label)
+            ax.fill_between(
+                band, ci.sel(bound="low"), ci.sel(bound="high"),
+                color=colors[violin], alpha=0.2, linewidth=0,
+            )
+        r = ds["profile_r"].sel(violin=violin).item()
+        ax.axhline(0, color="black", linewidth=0.5)
+        ax.set_ylabel(f"{VIOLIN_MAP[violin]}\nP2 - P1 (dB)")
+        ax.set_title(f"Profile r = {r:.2f}", fontsize="small", loc="right")
+
+    # --- 2.2 Last row: correlation per band ---
+    ax = axes[-1]
+    for name, color, label in [("r", "black", "r"), ("coherence", "darkgrey", "Coherence")]:
+        ax.plot(band, ds[name], "o-", color=color, label=label)
+        ax.fill_between(
+            band, ds[f"{name}_ci"].sel(bound="low"), ds[f"{name}_ci"].sel(bound="high"),
+            color=color, alpha=0.2, linewidth=0,
+        )
+    ax.axhline(0, color="black", linewidth=0.5)
+    ax.set_ylim([-1, 1])
+    ax.set_ylabel("Correlation")
+    ax.set_xlabel("Third-octave band (Hz)")
+
+    # Styling
+    for ax in axes:
+        ax.set_xscale("log")
+        ax.grid(True, which="both", alpha=0.3)
+        ax.xaxis.set_ticks([200, 500, 1000, 2000, 5000])
+        ax.get_xaxis().set_major_formatter(mpl.ticker.ScalarFormatter())
+        ax.get_xaxis().set_minor_formatter(mpl.ticker.NullFormatter())
+
+    # --- 2.3 Legends ---
+    for ax in [axes[0], axes[-1]]:
+        ax.legend(loc="center left", bbox_to_anchor=(1.02, 0.5), borderaxespad=0)
+
+    plt.tight_layout()
+
+    # --- 3. Saving Figure ---
+    output_png = pathlib.Path("reports/figures/crossmodal.png")
+    output_svg = pathlib.Path("reports/figures/crossmodal.svg")
+    output_png.parent.mkdir(parents=True, exist_ok=True)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
+    print(f"Figures saved to {output_png} and {output_svg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admittance vs radiated sound changes.")
+    parser.add_argument("--process", action="store_true", help="Compute the statistics")
+    parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, default=OUTPUT_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # If no args provided, run both
+    if not args.process and not args.plot:
+        args.process = True
+        args.plot = True
+
+    if args.process:
+        with profiling.stage("process"):
+            ds = build_dataset(n_resamples=args.resamples, seed=args.seed)
+            save_dataset(ds, PROCESSED_DATA_PATH, args.output)
+
+    if args.plot:
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Local interactive explorer of the processed datasets.
+
+`python explorer.py` serves explorer.html on http://127.0.0.1:8050, where the
+violin, descriptor, excerpt or criterion is picked from menus instead of
+constants, and the plots pan (drag) and zoom (wheel, double click to reset)
+over the full resolution of the data.
+
+The browser never receives a whole dataset. On every request the server:
+
+1. aggregates the selection at full resolution: energy mean and CI of every
+   phase, mean and CI of the phase 2 - phase 1 differences (as in the scripts'
+   figures). Aggregates are memoised on disk with loaders.memoize, so they are
+   computed once per dataset version, and kept in memory for the session.
+2. cuts the visible x range and decimates every line and CI edge to the width
+   of the plot with plotting.m4_indices (first, last, min and max of every
+   pixel column), so a zoomed-out admittance (16k bins) or mocap take sends a
+   few thousand points and renders identically.
+
+API (JSON): /api/options lists the views and their choices, /api/series?view=
+...&x0=...&x1=...&width=... returns the decimated series of a selection.
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import pathlib
+import urllib.parse
+import warnings
+import webbrowser
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import loaders
+import plotting
+from config import ci, colors, linear_mean, mean_ci, VIOLIN_MAP
+
+HOST = "127.0.0.1"
+PORT = 8050
+PAGE_PATH = pathlib.Path(__file__).resolve().parent / "explorer.html"
+
+ADMITTANCES_PATH = pathlib.Path("data/processed/admittances.nc")
+RECORDINGS_PATH = pathlib.Path("data/processed/recordings.nc")
+MOCAP_PATH = pathlib.Path("data/processed/mocap.nc")
+RATINGS_PATH = pathlib.Path("data/processed/ratings.parquet")
+
+# Frequency range of the LTAS normalisation, as recordings.py
+LTAS_BAND = (200, 5000)
+# Aggregates kept in memory
+MEMORY_CACHE = 32
+
+CODE = ["explorer.py", "config.py"]
+
+
+def color(key) -> str:
+    import matplotlib.colors
+
+    return matplotlib.colors.to_hex(colors[key])
+
+
+# --- 1. Aggregation ---
+
+
+def line(panel: str, label: str, key, x: np.ndarray, stats) -> Dict:
+    """One mean line with its CI band, at full resolution."""
+    mean, low, high = (np.asarray(s, dtype=np.float64) for s in stats)
+    return {
+        "panel": panel,
+        "label": label,
+        "color": color(key),
+        "x": np.asarray(x, dtype=np.float64),
+        "mean": mean,
+        "low": low,
+        "high": high,
+    }
+
+
+def spectrum_lines(
+    db: np.ndarray,
+    phases: np.ndarray,
+    x: np.ndarray,
+    label: str,
+    key,
+    groups: Optional[np.ndarray] = None,
+    linear: bool = False,
+) -> List[Dict]:
+    """
+    Mean of every phase with its band, mean and CI of the phase 2 - phase 1
+    differences. Phases without measurements are left out.
+
+    Args:
+        db: (measurement, frequency) levels in dB.
+        phases: Phase of every measurement.
+        groups: Violinist of every measurement. The takes of a violinist are
+            averaged per phase and differenced within violinist, as
+            recordings.py. Without groups, every phase 2 - phase 1 pair is a
+            difference, as admittances.py.
+        linear: Energy mean (linear_mean) within the range of the
+            measurements, as admittances.py, instead of the dB mean and its CI.
+    """
+    lines = []
+    for phase in [1, 2]:
+        values = db[phases == phase]
+        if len(values) == 0:
+            continue
+        if linear:
+            stats = (linear_mean(values, axis=0), values.min(axis=0), values.max(axis=0))
+        else:
+            stats = mean_ci(values, axis=0)
+        lines.append(line("Phase", f"{label}, phase {phase}", phase, x, stats))
+
+    if groups is None:
+        pairs = (db[phases == 2][:, None] - db[phases == 1][None]).reshape(-1, db.shape[1])
+    else:
+        pairs = np.array(
+            [
+                db[(groups == group) & (phases == 2)].mean(axis=0)
+                - db[(groups == group) & (phases == 1)].mean(axis=0)
+                for group in np.unique(groups)
+                if np.any((groups == group) & (phases == 1))
+                and np.any((groups == group) & (phases == 2))
+            ]
+        ).reshape(-1, db.shape[1])
+    if len(pairs):
+        lines.append(line("Difference", label, key, x, mean_ci(pairs, axis=0)))
+    return lines
+
+
+@loaders.memoize(code=CODE + ["admittances.py", "compact.py", "streaming.py"])
+def admittance_series(path: pathlib.Path, violin: str) -> Dict:
+    ds = loaders.admittances(path)
+    ds = ds.isel(measurement=(ds["violin"] == violin).values)
+    with np.errstate(divide="ignore"):
+        db = 20 * np.log10(ds["H"].values)
+    lines = spectrum_lines(
+        db, ds["phase"].values, ds["frequency"].values, VIOLIN_MAP[violin], violin, linear=True
+    )
+    return {
+        "xlabel": "Frequency (Hz)",
+        "ylabel": "Amplitude (dB)",
+        "xscale": "log",
+        "lines": lines,
+    }
+
+
+@loaders.memoize(code=CODE + ["streaming.py"])
+def ltas_series(path: pathlib.Path, violin: str, violinist: str) -> Dict:
+    ds = loaders.recordings(path)
+    mask = ds["violin"] == violin
+    if violinist != "all":
+        mask &= ds["violinist"] == violinist
+    ds = ds.isel(measurement=mask.values).sel(frequency=slice(*LTAS_BAND))
+    if ds.sizes["measurement"] == 0:
+        raise ValueError(f"No recording of {violin} by {violinist}")
+    # Each take normalised by its own mean, as recordings.py
+    lin = 10 ** (ds["features"].values / 20)
+    db = 20 * np.log10(lin / lin.mean(axis=1, keepdims=True))
+    lines = spectrum_lines(
+        db,
+        ds["phase"].values,
+        ds["frequency"].values,
+        VIOLIN_MAP[violin],
+        violin,
+        groups=ds["violinist"].values,
+    )
+    return {
+        "xlabel": "Frequency (Hz)",
+        "ylabel": "Normalised LTAS (dB)",
+        "xscale": "log",
+        "lines": lines,
+    }
+
+
+@loaders.memoize(code=CODE + ["mocap.py"])
+def mocap_series(path: pathlib.Path, descriptor: str, excerpt: str, violin: str) -> Dict:
+    import xarray as xr
+
+    from mocap import UNITS, phase_difference
+
+    with xr.open_dataset(loaders.resolve(path)) as ds:
+        if descriptor not in ds:
+            raise ValueError(f"Unknown descriptor: {descriptor}")
+        da = ds[descriptor].sel(excerpt=excerpt, violin=violin).drop_vars("filename").load()
+        time = ds["time"].values
+
+    with warnings.catch_warnings():
+        # Padded (all-NaN) time steps
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lines = [
+            line(
+                "Phase",
+                f"{VIOLIN_MAP[violin]}, phase {phase}",
+                phase,
+                time,
+                mean_ci(da.sel(phase=phase).transpose("take", "time").values, axis=0),
+            )
+            for phase in [1, 2]
+        ]
+        diff = [x.transpose("time").values for x in phase_difference(da)]
+        lines.append(line("Difference", VIOLIN_MAP[violin], violin, time, diff))
+    # Units of the engine that computed the descriptor
+    units = da.attrs.get("units", UNITS.get(descriptor))
+    unit = f" ({units})" if units else ""
+    return {
+        "xlabel": "Time (s)",
+        "ylabel": f"{descriptor}{unit}",
+        "xscale": "linear",
+        "lines": lines,
+    }
+
+
+@loaders.memoize(code=CODE + ["ratings_data.py"])
+def ratings_series(path: pathlib.Path, criterion: str, scope: str) -> Dict:
+    df = loaders.ratings(path)
+    df = df[(df["criterion"] == criterion) & (df["condition"] == "blind")]
+    if scope != "all":
+        df = df[df["scope"] == scope]
+    lines = []
+    for violin, ratings in df.groupby("violin", observed=True):
+        stats = np.array(
+            [
+                [np.mean(r), *ci(r)] if len(r) else [np.nan] * 3
+                for r in (
+                    ratings.loc[ratings["phase"] == phase, "rating"].to_numpy()
+                    for phase in [1, 2]
+                )
+            ]
+        ).T
+        key = str(violin).lower()
+        lines.append(line("Phase", VIOLIN_MAP.get(key, str(violin)), key, [1, 2], stats))
+    return {
+        "xlabel": "Phase",
+        "ylabel": f"Rating ({criterion})",
+        "xscale": "linear",
+        "lines": lines,
+    }
+
+
+# Dataset, series function and its query parameters of every view
+VIEWS = {
+    "admittances": (ADMITTANCES_PATH, admittance_series, ["violin"]),
+    "recordings": (RECORDINGS_PATH, ltas_series, ["violin", "violinist"]),
+    "mocap": (MOCAP_PATH, mocap_series, ["descriptor", "excerpt", "violin"]),
+    "ratings": (RATINGS_PATH, ratings_series, ["criterion", "scope"]),
+}
+
+
+@functools.lru_cache(maxsize=MEMORY_CACHE)
+def _aggregate(view: str, params: tuple, version: int) -> Dict:
+    path, series, _ = VIEWS[view]
+    return series(path, *params)
+
+
+def aggregate(view: str, query: Dict[str, str]) -> Dict:
+    """
+    Full-resolution series of a selection: from memory, from the disk cache,
+    or computed.
+    """
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view: {view}")
+    path, _, names = VIEWS[view]
+    missing = [name for name in names if name not in query]
+    if missing:
+        raise ValueError(f"Missing parameters: {', '.join(missing)}")
+    # Kept in memory until the dataset is rewritten
+    version = loaders.resolve(path).stat().st_mtime_ns
+    return _aggregate(view, tuple(query[name] for name in names), version)
+
+
+def options() -> Dict:
+    """Views whose dataset exists, with the choices of every parameter."""
+    import xarray as xr
+
+    views = {}
+    if loaders.resolve(ADMITTANCES_PATH).exists():
+        violins = np.unique(loaders.admittances(ADMITTANCES_PATH)["violin"].values)
+        views["admittances"] = {"violin": [str(v) for v in violins]}
+    if loaders.resolve(RECORDINGS_PATH).exists():
+        ds = loaders.recordings(RECORDINGS_PATH)
+        views["recordings"] = {
+            "violin": [str(v) for v in np.unique(ds["violin"].values)],
+            "violinist": ["all"] + [str(v) for v in np.unique(ds["violinist"].values)],
+        }
+    if loaders.resolve(MOCAP_PATH).exists():
+        with xr.open_dataset(loaders.resolve(MOCAP_PATH)) as ds:
+            views["mocap"] = {
+                "descriptor": [n for n, v in ds.data_vars.items() if "time" in v.dims],
+                "excerpt": [str(e) for e in ds["excerpt"].values],
+                "violin": [str(v) for v in ds["violin"].values],
+            }
+    if loaders.resolve(RATINGS_PATH).exists():
+        df = loaders.ratings(RATINGS_PATH)
+        views["ratings"] = {
+            "criterion": [str(c) for c in df["criterion"].cat.categories],
+            "scope": ["all"] + [str(s) for s in df["scope"].cat.categories],
+        }
+    return views
+
+
+# --- 2. Decimation ---
+
+
+def columns(x: np.ndarray, x0: float, x1: float, width: int, log: bool) -> np.ndarray:
+    """Pixel column of every x in a plot of `width` pixels over [x0, x1]."""
+    if log:
+        x, x0, x1 = np.log(np.maximum(x, 1e-12)), np.log(max(x0, 1e-12)), np.log(max(x1, 1e-12))
+    return np.floor((x - x0) / max(x1 - x0, 1e-12) * width)
+
+
+def _json(values: np.ndarray) -> List[Optional[float]]:
+    return [round(float(v), 6) if np.isfinite(v) else None for v in values]
+
+
+def window(data: Dict, x0: Optional[float], x1: Optional[float], width: int) -> Dict:
+    """
+    Visible part of every line, decimated to `width` pixel columns.
+
+    Args:
+        data: Full-resolution series (aggregate).
+        x0, x1: Visible x range, None for everything.
+        width: Width of the plot in pixels.
+
+    Returns:
+        Series with, for every line, the decimated mean, low and high edges as
+        [x, y] lists, and the full x range.
+    """
+    log = data["xscale"] == "log"
+    xs = np.concatenate([l["x"] for l in data["lines"]]) if data["lines"] else np.zeros(1)
+    finite = xs[xs > 0] if log else xs
+    extent = [float(finite.min()), float(finite.max())] if len(finite) else [0.0, 1.0]
+    x0 = extent[0] if x0 is None else x0
+    x1 = extent[1] if x1 is None else x1
+
+    lines = []
+    for l in data["lines"]:
+        x = l["x"]
+        # One point beyond each edge so lines reach the borders
+        start = max(np.searchsorted(x, x0, side="left") - 1, 0)
+        stop = min(np.searchsorted(x, x1, side="right") + 1, len(x))
+        if log:
+            start = max(start, int(np.searchsorted(x, 0, side="right")))
+        visible = slice(start, stop)
+        cols = columns(x[visible], x0, x1, width, log)
+        edges = {}
+        for name in ["mean", "low", "high"]:
+            y = l[name][visible]
+            keep = plotting.m4_indices(cols, y) if len(y) > 4 * width else np.arange(len(y))
+            edges[name] = {"x": _json(x[visible][keep]), "y": _json(y[keep])}
+        lines.append({"panel": l["panel"], "label": l["label"], "color": l["color"], **edges})
+
+    return {
+        "xlabel": data["xlabel"],
+        "ylabel": data["ylabel"],
+        "xscale": data["xscale"],
+        "extent": extent,
+        "lines": lines,
+    }
+
+
+# --- 3. Server ---
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, data: Dict):
+        self.send(status, json.dumps(data).encode(), "application/json")
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        try:
+            if url.path == "/":
+                self.send(200, PAGE_PATH.read_bytes(), "text/html; charset=utf-8")
+            elif url.path == "/api/options":
+                self.send_json(200, options())
+            elif url.path == "/api/series":
+                x0 = float(query["x0"]) if "x0" in query else None
+                x1 = float(query["x1"]) if "x1" in query else None
+                width = min(max(int(query.get("width", 800)), 10), 10000)
+                data = aggregate(query.get("view", ""), query)
+                self.send_json(200, window(data, x0, x1, width))
+            else:
+                self.send_json(404, {"error": f"Not found: {url.path}"})
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+
+    def log_request(self, code="-", size="-"):
+        # Only the errors
+        if isinstance(code, int) and code >= 400:
+            super().log_request(code, size)
+
+
+def serve(host: str = HOST, port: int = PORT, open_browser: bool = False):
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    url = f"http://{host}:{server.server_port}/"
+    print(f"Explorer served on {url} (Ctrl+C to stop)")
+    if open_browser:
+        webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interactive explorer of the processed datasets.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--open", action="store_true", help="Open the explorer in a browser")
+
+    args = parser.parse_args()
+    serve(args.host, args.port, args.open)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Content hashes of input files, shared by the pipeline runner (pipeline.py), the
+memoised loaders (loaders.py) and the ratings ingestion (ratings_data.py).
+"""
+
+import glob
+import hashlib
+import pathlib
+from typing import Dict, List
+
+
+def expand(pattern: str) -> List[pathlib.Path]:
+    """Files matched by a pattern, recursively for directories."""
+    files = []
+    for match in sorted(glob.glob(pattern)):
+        path = pathlib.Path(match)
+        files += sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    return files
+
+
+def file_hash(path: pathlib.Path, cache: Dict) -> str:
+    """
+    SHA-1 of a file's content, cached by (size, mtime).
+    """
+    stat = path.stat()
+    key = str(path)
+    if key in cache and cache[key][:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cache[key][2]
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    cache[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return cache[key][2]
@@ -0,0 +1,364 @@
+"""
+Perceptual space of the listening test stimuli.
+
+Every listener judged a fixed set of stimulus pairs (data/raw/test.json). The
+judgements are stacked into a (listener, stimulus, stimulus) dissimilarity
+tensor, NaN for pairs that were not judged. Missing entries are completed with
+shortest paths through the judged pairs, for all listeners at once, and the
+embeddings are computed on the whole stack:
+
+- individual: classical MDS of each listener (one batched eigendecomposition)
+- pooled: classical MDS of the mean dissimilarities
+- indscal: common stimulus space with per-listener dimension weights (INDSCAL,
+  fitted by alternating least squares on the double-centred tensor)
+
+The phase shift of a (violin, player) is the distance between its session-3
+stimulus and the centroid of its phase-1 stimuli, relative to the distance
+between the two phase-1 stimuli.
+"""
+
+import argparse
+import pathlib
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import plotting
+import profiling
+from config import colors
+from listening_test import PHASE_SESSIONS, RAW_DATA_DIR, load_trials
+
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/listening_mds.nc")
+N_COMPONENTS = 2
+MAX_ITER = 500
+TOL = 1e-8
+
+
+STIMULUS = ["violin", "player", "session", "non_blind"]
+
+
+def stimulus_names(stimuli: pd.DataFrame) -> pd.Series:
+    """Stimulus names as in the listening test, e.g. "A-SMD-1na"."""
+    return (
+        stimuli["violin"].astype(str).str[0]
+        + "-"
+        + stimuli["player"].astype(str)
+        + "-"
+        + stimuli["session"].astype(str)
+        + np.where(stimuli["non_blind"], "na", "")
+    )
+
+
+def stimuli_table(trials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Unique stimuli of the trials, sorted by player, violin, session and condition.
+    """
+    stimuli = pd.concat(
+        [trials[[f"{c}_{s}" for c in STIMULUS]].set_axis(STIMULUS, axis=1) for s in ["a", "b"]]
+    ).drop_duplicates()
+    stimuli = stimuli.sort_values(["player", "violin", "session", "non_blind"])
+    stimuli.index = pd.Index(stimulus_names(stimuli), name="stimulus")
+    return stimuli
+
+
+def dissimilarity_tensor(trials: pd.DataFrame) -> xr.DataArray:
+    """
+    Stack the judgements of all listeners.
+
+    Repeated judgements of a pair are averaged. Judgements of a stimulus against
+    itself are kept on the diagonal, which is otherwise 0.
+
+    Returns:
+        Array of shape (listener, stimulus, stimulus_b), NaN for pairs that were
+        not judged.
+    """
+    stimuli = stimuli_table(trials)
+    codes = {
+        s: stimuli.index.get_indexer(
+            stimulus_names(trials[[f"{c}_{s}" for c in STIMULUS]].set_axis(STIMULUS, axis=1))
+        )
+        for s in ["a", "b"]
+    }
+    listener = trials["listener"].cat.codes.to_numpy()
+    n_listeners, n_stimuli = len(trials["listener"].cat.categories), len(stimuli)
+
+    # Symmetric accumulation of every judgement
+    shape = (n_listeners, n_stimuli, n_stimuli)
+    index = np.concatenate(
+        [
+            np.ravel_multi_index((listener, codes["a"], codes["b"]), shape),
+            np.ravel_multi_index((listener, codes["b"], codes["a"]), shape),
+        ]
+    )
+    distance = np.tile(trials["distance"].to_numpy(np.float64), 2)
+    size = int(np.prod(shape))
+    total = np.bincount(index, weights=distance, minlength=size)
+    count = np.bincount(index, minlength=size)
+    with np.errstate(invalid="ignore"):
+        D = (total / count).reshape(shape)
+
+    diagonal = np.arange(n_stimuli)
+    D[:, diagonal, diagonal] = np.nan_to_num(D[:, diagonal, diagonal])
+
+    return xr.DataArray(
+        D,
+        dims=["listener", "stimulus", "stimulus_b"],
+        coords={
+            "listener": trials["listener"].cat.categories.to_numpy(),
+            "stimulus": stimuli.index.to_numpy(),
+            "stimulus_b": stimuli.index.to_numpy(),
+            **{c: ("stimulus", stimuli[c].astype(str).to_numpy()) for c in ["violin", "player"]},
+            "session": ("stimulus", stimuli["session"].to_numpy()),
+            "non_blind": ("stimulus", stimuli["non_blind"].to_numpy()),
+        },
+    )
+
+
+def complete(D: np.ndarray) -> np.ndarray:
+    """
+    Fill unjudged pairs with shortest-path dissimilarities (Floyd-Warshall).
+
+    The relaxation runs over stimuli, each step on all listeners at once.
+
+    Args:
+        D: (..., stimulus, stimulus) dissimilarities, NaN for missing pairs.
+
+    Returns:
+        Completed dissimilarities, inf for stimuli that are not connected.
+    """
+    D = np.where(np.isnan(D), np.inf, D)
+    n = D.shape[-1]
+    diagonal = np.arange(n)
+    D[..., diagonal, diagonal] = 0
+    for k in range(n):
+        D = np.minimum(D, D[..., :, k, None] + D[..., None, k, :])
+    return D
+
+
+def double_centre(D: np.ndarray) -> np.ndarray:
+    """B = -1/2 J D^2 J, on the last two axes."""
+    D2 = D**2
+    return -0.5 * (
+        D2
+        - D2.mean(axis=-1, keepdims=True)
+        - D2.mean(axis=-2, keepdims=True)
+        + D2.mean(axis=(-2, -1), keepdims=True)
+    )
+
+
+def classical_mds(D: np.ndarray, n_components: int = N_COMPONENTS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Classical (Torgerson) MDS of a stack of dissimilarity matrices.
+
+    Args:
+        D: (..., stimulus, stimulus) complete dissimilarities.
+        n_components: Dimension of the embedding.
+
+    Returns:
+        Tuple of (coordinates (..., stimulus, component), eigenvalues
+        (..., component)). Negative eigenvalues are clipped to 0.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(double_centre(D))
+    eigenvalues = np.clip(eigenvalues[..., ::-1][..., :n_components], 0, None)
+    eigenvectors = eigenvectors[..., ::-1][..., :n_components]
+    # Fix the sign of each axis so that embeddings are comparable
+    sign = np.sign(np.take_along_axis(
+        eigenvectors, np.abs(eigenvectors).argmax(axis=-2)[..., None, :], axis=-2
+    ))
+    return eigenvectors * sign * np.sqrt(eigenvalues)[..., None, :], eigenvalues
+
+
+def indscal(
+    D: np.ndarray,
+    n_components: int = N_COMPONENTS,
+    max_iter: int = MAX_ITER,
+    tol: float = TOL,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    INDSCAL: B_l ~ X diag(w_l) X^T for every listener l.
+
+    The two stimulus modes are updated separately (CANDECOMP) and averaged at
+    the end. Every update is a contraction of the whole tensor.
+
+    Args:
+        D: (listener, stimulus, stimulus) complete dissimilarities.
+        n_components: Dimension of the common space.
+        max_iter: Maximum number of ALS sweeps.
+        tol: Relative decrease of the residual to stop at.
+
+    Returns:
+        Tuple of (coordinates (stimulus, component), weights (listener, component)).
+    """
+    B = double_centre(D)
+    # Listeners on a common scale
+    B = B / np.linalg.norm(B, axis=(-2, -1), keepdims=True)
+
+    X, _ = classical_mds(D.mean(axis=0), n_components)
+    X = X / np.linalg.norm(X, axis=0)
+    Y = X.copy()
+    W = np.ones((len(B), n_components))
+
+    previous = np.inf
+    for _ in range(max_iter):
+        X = np.einsum("lij,jr,lr->ir", B, Y, W) @ np.linalg.pinv((Y.T @ Y) * (W.T @ W))
+        Y = np.einsum("lij,ir,lr->jr", B, X, W) @ np.linalg.pinv((X.T @ X) * (W.T @ W))
+        W = np.einsum("lij,ir,jr->lr", B, X, Y) @ np.linalg.pinv((X.T @ X) * (Y.T @ Y))
+        residual = np.sum((B - np.einsum("ir,lr,jr->lij", X, W, Y)) ** 2)
+        if previous - residual < tol * previous:
+            break
+        previous = residual
+
+    # Symmetric solution, unit-norm axes with the scale in the weights
+    X = (X + Y) / 2
+    norm = np.linalg.norm(X, axis=0)
+    return X / norm, W * norm**2
+
+
+def phase_shift(coordinates: xr.DataArray) -> xr.Dataset:
+    """
+    Movement of the phase-2 stimulus, against the spread of phase 1.
+
+    Args:
+        coordinates: Array with a "stimulus" dimension (with violin, player,
+            session and non_blind coordinates) and a "component" dimension.
+
+    Returns:
+        Dataset over (violin, player) and any other dimension of `coordinates`:
+            - shift: |x3 - mean(x1, x2)|
+            - spread: |x2 - x1|
+    """
+    blind = coordinates.where(~coordinates["non_blind"], drop=True).drop_vars("non_blind")
+    keyed = blind.set_index(stimulus=["violin", "player", "session"]).unstack("stimulus")
+    phase_1 = keyed.sel(session=PHASE_SESSIONS[1])
+    phase_2 = keyed.sel(session=PHASE_SESSIONS[2]).mean("session")
+    return xr.Dataset(
+        {
+            "shift": np.sqrt(((phase_2 - phase_1.mean("session")) ** 2).sum("component")),
+            "spread": np.sqrt((phase_1.diff("session") ** 2).sum("component")).squeeze(
+                "session", drop=True
+            ),
+        }
+    )
+
+
+def build_dataset(
+    raw_data_dir: pathlib.Path = RAW_DATA_DIR, n_components: int = N_COMPONENTS
+) -> xr.Dataset:
+    """
+    Dissimilarities and embeddings of all listeners.
+    """
+    dissimilarity = dissimilarity_tensor(load_trials(raw_data_dir))
+    D = complete(dissimilarity.to_numpy())
+    if np.isinf(D).any():
+        raise ValueError("The judged pairs do not connect all stimuli")
+
+    individual, eigenvalues = classical_mds(D, n_components)
+    pooled, pooled_eigenvalues = classical_mds(D.mean(axis=0), n_components)
+    common, weights = indscal(D, n_components)
+
+    component = np.arange(1, n_components + 1)
+    coords = {k: v for k, v in dissimilarity.coords.items() if k != "stimulus_b"}
+    ds = xr.Dataset(
+        {
+            "dissimilarity": dissimilarity,
+            "completed": (dissimilarity.dims, D),
+            "individual": (["listener", "stimulus", "component"], individual),
+            "eigenvalues": (["listener", "component"], eigenvalues),
+            "pooled": (["stimulus", "component"], pooled),
+            "pooled_eigenvalues": (["component"], pooled_eigenvalues),
+            "indscal": (["stimulus", "component"], common),
+            "indscal_weights": (["listener", "component"], weights),
+        },
+        coords={**coords, "stimulus_b": dissimilarity["stimulus_b"], "component": component},
+    )
+    return ds
+
+
+def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    dataset.to_netcdf(output_path)
+    print(f"Dataset saved to {output_path}")
+
+
+def plot(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+
+    # --- 1. Load Data ---
+    ds = xr.load_dataset(dataset_path)
+
+    # --- 2. Phase shifts ---
+    scale = np.sqrt(ds["indscal_weights"].mean("listener"))
+    shifts = xr.concat(
+        [
+            phase_shift(ds["individual"]).mean("listener"),
+            phase_shift(ds["pooled"]),
+            phase_shift(ds["indscal"] * scale),
+        ],
+        dim=pd.Index(["individual", "pooled", "indscal"], name="embedding"),
+    )
+    print(shifts.to_dataframe().unstack("embedding").round(2))
+
+    # --- 3. Plotting ---
+    fig, axes = plt.subplots(ncols=2)
+    for ax, name in zip(axes, ["pooled", "indscal"]):
+        x = ds[name]
+        for violin in np.unique(ds["violin"]):
+            for player, marker in zip(np.unique(ds["player"]), ["o", "s"]):
+                cell = x.where((ds["violin"] == violin) & (ds["player"] == player), drop=True)
+                phase = np.where(cell["session"].isin(PHASE_SESSIONS[2]), 2, 1)
+                ax.plot(*cell.T, color=colors[violin.lower()], alpha=0.3)
+                for p in [1, 2]:
+                    ax.scatter(
+                        *cell[phase == p].T,
+                        color=colors[violin.lower()],
+                        marker=marker,
+                        facecolors="none" if p == 1 else colors[violin.lower()],
+                        label=f"{violin}, {player}" if p == 2 else None,
+                    )
+        ax.set_title(name.capitalize() if name == "pooled" else "INDSCAL")
+        ax.set_xlabel("Dimension 1")
+        ax.set_aspect("equal", adjustable="datalim")
+    axes[0].set_ylabel("Dimension 2")
+    axes[-1].legend(loc="center left", bbox_to_anchor=(1.02, 0.5), borderaxespad=0)
+
+    plt.tight_layout()
+
+    # --- 4. Saving Figure ---
+    output_png = pathlib.Path("reports/figures/listening-mds.png")
+    output_svg = pathlib.Path("reports/figures/listening-mds.svg")
+    output_png.parent.mkdir(parents=True, exist_ok=True)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
+    print(f"Figures saved to {output_png} and {output_svg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MDS of the listening test.")
+    parser.add_argument("--process", action="store_true", help="Process raw answers")
+    parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument("--components", type=int, default=N_COMPONENTS)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # If no args provided, run both
+    if not args.process and not args.plot:
+        args.process = True
+        args.plot = True
+
+    if args.process:
+        with profiling.stage("process"):
+            ds = build_dataset(n_components=args.components)
+            save_dataset(ds, PROCESSED_DATA_PATH)
+
+    if args.plot:
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
+
+
+if __name__ == "__main__":
+    main()
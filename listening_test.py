@@ -0,0 +1,199 @@
+"""
+Listening test ingestion: raw listener answers -> typed tables.
+
+Each data/raw/listening_test/<listener>.json holds the listener's answers as
+{"test": {"id", "a", "b"}, "result"}, where "a" and "b" are stimulus names such
+as "A-SMD-1na.wav" (violin - player - session, "na" for non-blind) and "result"
+is the rated distance. Answers of all listeners are parsed in one pass.
+
+- trials: one row per answer
+- phases: per (listener, violin, player), the mean distance between two
+  sessions of phase 1 ("11"), between phases 1 and 2 ("12"), and their
+  difference ("diff" = 12 - 11), as in notebooks/test.qmd
+"""
+
+import argparse
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+RAW_DATA_DIR = pathlib.Path("data/raw/listening_test")
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/listening_test.parquet")
+
+VIOLIN_NAMES = {"A": "Klimke", "B": "Levaggi", "C": "Stoppani"}
+VIOLINS = list(VIOLIN_NAMES.values())
+PHASE_SESSIONS = {1: [1, 2], 2: [3]}
+PAIRS = ["11", "12"]
+
+STIMULUS_PATTERN = (
+    r"^(?P<violin>[A-Z])-(?P<player>[^-]+)-(?P<session>\d+)(?P<non_blind>na)?\.wav$"
+)
+
+
+def parse_stimuli(names: pd.Series) -> pd.DataFrame:
+    """
+    Split stimulus names into violin, player, session and condition.
+
+    Returns:
+        DataFrame with violin, player, session and non_blind columns.
+    """
+    parts = names.str.extract(STIMULUS_PATTERN)
+    unparsed = parts["violin"].isna()
+    if unparsed.any():
+        raise ValueError(f"Unexpected stimulus names: {names[unparsed].unique()}")
+    return pd.DataFrame(
+        {
+            "violin": pd.Categorical(parts["violin"].map(VIOLIN_NAMES), categories=VIOLINS),
+            "player": pd.Categorical(parts["player"]),
+            "session": parts["session"].astype(np.int8),
+            "non_blind": parts["non_blind"].notna(),
+        }
+    )
+
+
+def load_trials(raw_data_dir: pathlib.Path = RAW_DATA_DIR) -> pd.DataFrame:
+    """
+    Load the answers of every listener.
+
+    Returns:
+        One row per answer, sorted by listener and test id: listener, test_id,
+        distance, and violin/player/session/non_blind of stimuli a and b.
+    """
+    listeners, entries = [], []
+    for filepath in sorted(raw_data_dir.glob("*.json")):
+        with open(filepath, "r") as file:
+            answers = json.load(file)
+        listeners.append(np.repeat(filepath.stem, len(answers)))
+        entries += answers
+    if not entries:
+        raise FileNotFoundError(f"No listener answers in {raw_data_dir}")
+
+    flat = pd.json_normalize(entries)
+    # Parse a and b together
+    stimuli = parse_stimuli(pd.concat([flat["test.a"], flat["test.b"]], ignore_index=True))
+    n = len(flat)
+
+    df = pd.DataFrame(
+        {
+            "listener": pd.Categorical(np.concatenate(listeners)),
+            "test_id": flat["test.id"].astype(np.int16),
+            "distance": flat["result"].astype(np.float32),
+        }
+    )
+    for suffix, rows in [("a", slice(None, n)), ("b", slice(n, None))]:
+        for column in stimuli.columns:
+            df[f"{column}_{suffix}"] = stimuli[column].iloc[rows].reset_index(drop=True)
+    return df.sort_values(["listener", "test_id"], ignore_index=True)
+
+
+def pivot_phases(trials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mean distances within phase 1 and across phases, per listener/violin/player.
+
+    Only pairs of two different sessions of the same violin and player are kept,
+    the non-blind stimuli counting as their session.
+
+    Returns:
+        DataFrame indexed by (listener, violin, player) with columns 11, 12 and
+        diff, without rows where both 11 and 12 are missing.
+    """
+    n_sessions = max(trials["session_a"].max(), trials["session_b"].max()) + 1
+    phase = np.zeros(n_sessions, dtype=np.int8)
+    for p, sessions in PHASE_SESSIONS.items():
+        phase[sessions] = p
+
+    keep = (
+        (trials["violin_a"] == trials["violin_b"])
+        & (trials["player_a"] == trials["player_b"])
+        & (trials["session_a"] != trials["session_b"])
+    ).to_numpy()
+    t = trials[keep]
+    # 0 for "11", 1 for "12"
+    pair = (phase[t["session_a"]] != phase[t["session_b"]]).astype(int)
+
+    listener = t["listener"].cat.codes.to_numpy()
+    violin = t["violin_a"].cat.codes.to_numpy()
+    player = t["player_a"].cat.codes.to_numpy()
+    shape = (
+        len(trials["listener"].cat.categories),
+        len(trials["violin_a"].cat.categories),
+        len(trials["player_a"].cat.categories),
+        len(PAIRS),
+    )
+    index = np.ravel_multi_index((listener, violin, player, pair), shape)
+    size = int(np.prod(shape))
+    total = np.bincount(index, weights=t["distance"], minlength=size)
+    count = np.bincount(index, minlength=size)
+    with np.errstate(invalid="ignore"):
+        mean = (total / count).reshape(-1, len(PAIRS)).astype(np.float32)
+
+    df = pd.DataFrame(
+        mean,
+        index=pd.MultiIndex.from_product(
+            [
+                trials["listener"].cat.categories,
+                trials["violin_a"].cat.categories,
+                trials["player_a"].cat.categories,
+            ],
+            names=["listener", "violin", "player"],
+        ),
+        columns=PAIRS,
+    )
+    df["diff"] = df["12"] - df["11"]
+    return df[~np.isnan(mean).all(axis=1)]
+
+
+def build_dataset(raw_data_dir: pathlib.Path = RAW_DATA_DIR) -> pd.DataFrame:
+    return pivot_phases(load_trials(raw_data_dir))
+
+
+def save_dataset(df: pd.DataFrame, output_path: pathlib.Path):
+    df = df.reset_index().astype(
+        {"listener": "category", "violin": "category", "player": "category"}
+    )
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(output_path, index=False)
+    print(f"Dataset saved to {output_path}")
+
+
+def load_dataset(dataset_path: pathlib.Path = PROCESSED_DATA_PATH) -> pd.DataFrame:
+    """
+    Load the phase table, from Parquet or from a CSV written by notebooks/test.qmd.
+    """
+    dataset_path = pathlib.Path(dataset_path)
+    if dataset_path.suffix == ".csv":
+        return pd.read_csv(dataset_path, dtype={"listener": str})
+    return pd.read_parquet(dataset_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process the listening test answers.")
+    parser.add_argument("--raw", type=pathlib.Path, default=RAW_DATA_DIR)
+    parser.add_argument("--output", type=pathlib.Path, default=PROCESSED_DATA_PATH)
+    parser.add_argument(
+        "--trials", type=pathlib.Path, help="Also write the answers to this path"
+    )
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    with profiling.stage("load_trials"):
+        trials = load_trials(args.raw)
+    print(f"{len(trials)} answers from {trials['listener'].nunique()} listeners")
+    with profiling.stage("pivot_phases"):
+        df = pivot_phases(trials)
+    with profiling.stage("save"):
+        save_dataset(df, args.output)
+    if args.trials:
+        args.trials.parent.mkdir(parents=True, exist_ok=True)
+        trials.to_parquet(args.trials, index=False)
+        print(f"Answers saved to {args.trials}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Shared data access of the scripts and the notebooks, memoised on disk.
+
+Relative paths are looked up in the working directory, then in the repository,
+so the scripts and the notebooks (run from notebooks/, after
+`sys.path.insert(0, "..")`) use the same default paths.
+
+Functions decorated with `memoize` keep their results in CACHE_DIR (pickles),
+keyed by:
+
+- the function: module, name and source, and the source of the repository
+  modules it relies on (`code`)
+- its arguments
+- the content of the files it reads: existing paths among its arguments and
+  the glob patterns of `inputs`, hashed as in pipeline.py (SHA-1 cached by
+  size and mtime)
+
+so a result is recomputed only when one of them changes. Entries are used in
+least recently used order, and the oldest are evicted when the cache is larger
+than CACHE_SIZE MB. The cache directory and size can be set with the
+PLAYING_IN_CACHE ("off" to disable) and PLAYING_IN_CACHE_SIZE environment
+variables.
+"""
+
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import pickle
+import warnings
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from hashing import expand, file_hash
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent
+CACHE_DIR = REPO_DIR / ".cache"
+CACHE_SIZE = 2048  # MB
+CACHE_ENV = "PLAYING_IN_CACHE"
+CACHE_SIZE_ENV = "PLAYING_IN_CACHE_SIZE"
+HASHES = "hashes.json"
+
+ADMITTANCES_PATH = pathlib.Path("data/processed/admittances.nc")
+RECORDINGS_PATH = pathlib.Path("data/processed/recordings.nc")
+RATINGS_PATH = pathlib.Path("data/processed/ratings.parquet")
+LISTENING_TEST_PATH = pathlib.Path("data/processed/listening_test.parquet")
+
+# File hashes, loaded from the cache directory on first use
+_hashes: Optional[Dict] = None
+
+
+def resolve(path) -> pathlib.Path:
+    """Path relative to the working directory if it exists, else to the repository."""
+    path = pathlib.Path(path)
+    return path if path.exists() else REPO_DIR / path
+
+
+# --- 1. Cache ---
+
+
+def cache_dir() -> Optional[pathlib.Path]:
+    value = os.environ.get(CACHE_ENV)
+    if value == "off":
+        return None
+    return pathlib.Path(value) if value else CACHE_DIR
+
+
+def _write(path: pathlib.Path, data: bytes):
+    """Write a file atomically, as worker processes share the cache."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def hash_files(patterns: Sequence, directory: pathlib.Path) -> str:
+    """
+    Content hash of the files matched by paths or glob patterns.
+    """
+    global _hashes
+    hashes_path = directory / HASHES
+    if _hashes is None:
+        _hashes = json.loads(hashes_path.read_text()) if hashes_path.exists() else {}
+    before = dict(_hashes)
+
+    digest = hashlib.sha1()
+    for pattern in patterns:
+        for path in expand(str(resolve(pattern))):
+            digest.update(f"{path}:{file_hash(path, _hashes)}".encode())
+
+    if _hashes != before:
+        _write(hashes_path, json.dumps(_hashes).encode())
+    return digest.hexdigest()
+
+
+def cache_key(
+    func,
+    args: Tuple,
+    kwargs: Dict,
+    inputs: Sequence[str],
+    code: Sequence[str],
+    directory: pathlib.Path,
+) -> str:
+    """
+    Hash of a call: function, arguments (defaults included) and files read.
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = bound.arguments.values()
+    files = [a for a in arguments if isinstance(a, (str, pathlib.Path)) and resolve(a).exists()]
+    call = [
+        func.__module__,
+        func.__qualname__,
+        inspect.getsource(func),
+        repr(sorted(bound.arguments.items())),
+    ]
+    digest = hashlib.sha1(json.dumps(call).encode())
+    digest.update(hash_files(files + list(inputs) + list(code), directory).encode())
+    return digest.hexdigest()
+
+
+def evict(directory: pathlib.Path, size_mb: float):
+    """Remove the least recently used entries above size_mb."""
+    entries = []
+    for path in directory.glob("*.pkl"):
+        with contextlib.suppress(FileNotFoundError):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= size_mb * 1e6:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def memoize(inputs: Sequence[str] = (), code: Sequence[str] = ()):
+    """
+    Cache the results of a function on disk.
+
+    Args:
+        inputs: Glob patterns of the files the function reads besides its
+            path arguments (relative to the repository).
+        code: Repository modules the function relies on, e.g. "admittances.py".
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            directory = cache_dir()
+            if directory is None:
+                return func(*args, **kwargs)
+            directory.mkdir(parents=True, exist_ok=True)
+            key = cache_key(func, args, kwargs, inputs, code, directory)
+            path = directory / f"{func.__name__}-{key}.pkl"
+
+            if path.exists():
+                try:
+                    value = pickle.loads(path.read_bytes())
+                    # Mark as recently used
+                    os.utime(path)
+                    return value
+                except Exception as e:
+                    warnings.warn(f"Unreadable cache entry {path}, recomputing: {e}")
+
+            value = func(*args, **kwargs)
+            _write(path, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            evict(directory, float(os.environ.get(CACHE_SIZE_ENV, CACHE_SIZE)))
+            return value
+
+        # The function itself, e.g. to bypass the cache
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def clear():
+    """Empty the cache."""
+    directory = cache_dir()
+    if directory is not None:
+        evict(directory, 0)
+
+
+# --- 2. Processed datasets ---
+
+
+def admittances(
+    path: pathlib.Path = ADMITTANCES_PATH, group: Optional[str] = None
+) -> xr.Dataset:
+    from admittances import load_dataset
+
+    with load_dataset(resolve(path), group) as ds:
+        return ds.load()
+
+
+def recordings(path: pathlib.Path = RECORDINGS_PATH) -> xr.Dataset:
+    import streaming
+
+    with xr.open_dataset(resolve(path)) as ds:
+        return streaming.trim(ds).load()
+
+
+def ratings(path: pathlib.Path = RATINGS_PATH) -> pd.DataFrame:
+    from ratings_data import load_ratings
+
+    return load_ratings(resolve(path))
+
+
+def listening_test(path: pathlib.Path = LISTENING_TEST_PATH) -> pd.DataFrame:
+    from listening_test import load_dataset
+
+    return load_dataset(resolve(path))
+
+
+# --- 3. Derived data ---
+
+
+@memoize(
+    inputs=["data/raw/phase_*/*/admittances/*.mat"],
+    code=["admittances.py", "compact.py", "streaming.py"],
+)
+def raw_admittances() -> Tuple[xr.Dataset, Dict[str, xr.Dataset]]:
+    """
+    Admittances processed from the raw .mat files, as admittances.py --process.
+    """
+    from admittances import build_dataset
+
+    with contextlib.chdir(REPO_DIR):
+        return build_dataset()
+
+
+@memoize(code=["admittances.py", "compact.py", "streaming.py"])
+def admittance_spectra(path: pathlib.Path = ADMITTANCES_PATH) -> xr.Dataset:
+    """
+    Admittance per violin and phase, in dB.
+
+    Returns:
+        Dataset of (violin, phase, frequency): mean (quadratic mean of the
+        measurements), std, min and max (of the measurements in dB).
+    """
+    ds = admittances(path)
+    H_db = 20 * np.log10(ds["H"])
+    groups = ["violin", "phase"]
+    return xr.Dataset(
+        {
+            "mean": 20 * np.log10((ds["H"] ** 2).groupby(groups).mean("measurement") ** 0.5),
+            "std": H_db.groupby(groups).std("measurement"),
+            "min": H_db.groupby(groups).min("measurement"),
+            "max": H_db.groupby(groups).max("measurement"),
+        }
+    )
+
+
+@memoize(code=["streaming.py"])
+def ltas_spectra(
+    path: pathlib.Path = RECORDINGS_PATH, violinist: Optional[str] = None
+) -> xr.Dataset:
+    """
+    LTAS per violin and phase, in dB, normalised by its mean over frequency.
+
+    Args:
+        path: recordings.nc.
+        violinist: Only the takes of a violinist, None for all.
+
+    Returns:
+        Dataset of (violin, phase, frequency): mean (of the linear LTAS) and
+        std (of the takes in dB).
+    """
+    ds = recordings(path)
+    if violinist is not None:
+        ds = ds.isel(measurement=(ds["violinist"] == violinist).values)
+    groups = ["violin", "phase"]
+    mean = 20 * np.log10((10 ** (ds["features"] / 20)).groupby(groups).mean("measurement"))
+    return xr.Dataset(
+        {
+            "mean": mean - mean.mean("frequency"),
+            "std": ds["features"].groupby(groups).std("measurement"),
+        }
+    )
+
+
+@memoize(code=["notes.py"])
+def note_analysis(flac: pathlib.Path) -> Dict:
+    """
+    Note envelopes and LTAS of one take (notes.analyse).
+    """
+    from notes import analyse
+
+    return analyse(resolve(flac))
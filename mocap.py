@@ -1,15 +1,25 @@
+import argparse
+import pathlib
 import sys
+import warnings
+from typing import Dict, List, Optional, Tuple
 
 sys.path.append("/home/hugo/Thèse/mocap/")
 
-from take import Take
-import matplotlib.pyplot as plt
-from pathlib import Path
-from config import mm, colors, ci, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
-import pandas as pd
-import seaborn as sns
-import pathlib
 import numpy as np
+import xarray as xr
+
+import mocap_io
+import plotting
+import profiling
+from config import colors, mean_ci, VIOLIN_MAP
+from mocap_descriptors import MARKER_NAMES, align, compute_descriptors, stack_takes
+from mocap_descriptors import UNITS as BATCHED_UNITS
+
+# Constants
+RAW_DATA_DIR = pathlib.Path("data/raw/mocap/")
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/mocap.nc")
+FRAME_RATE = 120
 
 bad = [
     "own_P1_open_strings_1.csv",
@@ -17,6 +27,7 @@ bad = [
     "stoppani_P1_tchaikovsky_3.csv",
 ]
 
+PHASES = [1, 2]
 VIOLINS = [
     "klimke",
     "own",
@@ -37,7 +48,12 @@ VALIDITY = {
     "glazounov": [170, 2600],
 }
 
+# Frames read on each side of a VALIDITY window, so that the alignment can match
+# a take played earlier or later than the reference
+ALIGN_PADDING = 2 * FRAME_RATE
+
 DESCRIPTORS = ["vs", "xs", "hairstring", "tilt", "skewness", "beta"]
+# Units of the Take descriptors, BATCHED_UNITS for the batched engine
 UNITS = {
     "vs": "mm/s",
     "xs": "mm",
@@ -46,152 +62,417 @@ UNITS = {
     "skewness": "",
     "beta": "mm",
 }
+# Tolerance of check_descriptors, relative to the range of each descriptor
+CHECK_TOLERANCE = 1e-3
 descriptor = "beta"
 
-base_path = Path("data/raw/mocap/")
 
+def list_takes(excerpt: str) -> List[Tuple[str, int, pathlib.Path]]:
+    """
+    List the (violin, phase, file) takes of an excerpt, skipping bad takes.
+    """
+    takes = []
+    for violin in VIOLINS:
+        for phase in PHASES:
+            path = RAW_DATA_DIR / f"phase_{phase}" / violin / excerpt
+            for file in sorted(path.glob("*.csv")):
+                if str(file.name) in bad:
+                    print(f"bad : {file.name}")
+                    continue
+                takes.append((violin, phase, file))
+    return takes
+
+
+def validity_mask(excerpt: str, frames: np.ndarray) -> np.ndarray:
+    if VALIDITY[excerpt]:
+        start, end = VALIDITY[excerpt]
+        return (frames > start) & (frames < end)
+    return frames > 0
+
+
+def read_window(excerpt: str) -> Optional[Tuple[int, int]]:
+    """Frames to read from the takes of an excerpt, None for the whole take."""
+    if not VALIDITY[excerpt]:
+        return None
+    start, end = VALIDITY[excerpt]
+    return max(start - ALIGN_PADDING, 0), end + ALIGN_PADDING
+
+
+def dense_dataset(
+    features: Dict, descriptors: List[str], units: Dict[str, str] = UNITS
+) -> xr.Dataset:
+    """
+    Store warped descriptors as a dense array.
+
+    The array has dimensions (excerpt, violin, phase, take, time), where time is
+    the 120 Hz frame grid of the excerpt's reference take cropped to its
+    VALIDITY window. Excerpts with fewer frames or cells with fewer takes are
+    padded with NaN.
+
+    Args:
+        features: (excerpt, violin, phase) -> list of (filename, values), with
+            values of shape (descriptor, time).
+        descriptors: Names of the descriptors, in the order of `values`.
+        units: Units of the descriptors, stored as their "units" attribute.
+
+    Returns:
+        Dataset holding one variable per descriptor and the file name of each take.
+    """
+    if not features:
+        raise ValueError("No data found or processed.")
+
+    n_takes = max(len(takes) for takes in features.values())
+    n_time = max(v.shape[-1] for takes in features.values() for _, v in takes)
+    shape = (len(EXCERPTS), len(VIOLINS), len(PHASES), n_takes)
+
+    data = np.full((len(descriptors),) + shape + (n_time,), np.nan, dtype=np.float32)
+    filenames = np.full(shape, "", dtype=object)
+    for (excerpt, violin, phase), takes in features.items():
+        i = EXCERPTS.index(excerpt)
+        j = VIOLINS.index(violin)
+        k = PHASES.index(phase)
+        for t, (filename, values) in enumerate(takes):
+            data[:, i, j, k, t, : values.shape[-1]] = values
+            filenames[i, j, k, t] = filename
+
+    dims = ["excerpt", "violin", "phase", "take"]
+    ds = xr.Dataset(
+        data_vars={d: (dims + ["time"], data[n]) for n, d in enumerate(descriptors)},
+        coords={
+            "excerpt": EXCERPTS,
+            "violin": VIOLINS,
+            "phase": PHASES,
+            "take": np.arange(n_takes) + 1,
+            "time": np.arange(n_time) / FRAME_RATE,
+            "filename": (dims, filenames.astype(str)),
+        },
+    )
+    for d in descriptors:
+        ds[d].attrs["units"] = units[d]
+    return ds
 
-def build_dataset():
-    data_frames = []
-    for i, excerpt in enumerate(EXCERPTS):
-        first_take = None
 
-        for j, violin in enumerate(VIOLINS):
-            for phase in [1, 2]:
-                path = base_path / f"phase_{phase}" / violin / excerpt
-                files = list(path.glob("*.csv"))
-                for file in files[:]:
-                    print(file)
-                    if str(file.name) in bad:
-                        print(f"bad : {file.name}")
-                        continue
+def build_dataset(descriptor: str = descriptor) -> xr.Dataset:
+    """
+    Load every take with Take, warp its descriptor onto the first take of the
+    excerpt and store everything as a dense array (see dense_dataset).
 
-                    take = Take(file)
+    Args:
+        descriptor: Name of the descriptor, i.e. the suffix of a Take.compute_* method.
+    """
+    # Only this path needs the external mocap library
+    from take import Take
 
-                    if first_take is None:
-                        first_take = take
-                    else:
-                        take.align(first_take)
-                        pass
+    features = {}
+    for excerpt in EXCERPTS:
+        first_take = None
 
-                    time = first_take.df_time["Frame"].to_numpy()
-                    if VALIDITY[excerpt]:
-                        start, end = VALIDITY[excerpt]
-                        valid = (time > start) & (time < end)
-                    else:
-                        valid = time > 0
+        for violin, phase, file in list_takes(excerpt):
+            print(file)
+            with profiling.stage("take", file=file):
+                take = Take(file)
+
+            if first_take is None:
+                first_take = take
+            else:
+                take.align(first_take)
+
+            time = first_take.df_time["Frame"].to_numpy()
+            valid = validity_mask(excerpt, time)
+
+            compute_func = getattr(take, f"compute_{descriptor}")
+            f_vals = take.warp(compute_func())[valid]
+
+            features.setdefault((excerpt, violin, phase), []).append(
+                (file.name, f_vals[None])
+            )
+
+    return dense_dataset(features, [descriptor])
+
+
+def build_dataset_batched(descriptors: List[str] = DESCRIPTORS) -> xr.Dataset:
+    """
+    Same as build_dataset, but computes every descriptor of an excerpt at once.
+
+    Only the markers used by the descriptors, and the frames of the VALIDITY
+    window padded by ALIGN_PADDING, are read from the CSV files. The takes are
+    stacked, the descriptors evaluated in a single call, and each take
+    is warped onto the first one by DTW on the bow velocity.
+
+    Args:
+        descriptors: Names of the descriptors to compute.
+    """
+    features = {}
+    for excerpt in EXCERPTS:
+        takes = list_takes(excerpt)
+        if not takes:
+            warnings.warn(f"No takes found for {excerpt}")
+            continue
+
+        # --- 1. Read and stack marker trajectories ---
+        window = read_window(excerpt)
+        with profiling.stage("read_markers", excerpt=excerpt):
+            frames, trajectories = zip(
+                *(
+                    mocap_io.read_markers(file, MARKER_NAMES, window)
+                    for _, _, file in takes
+                )
+            )
+        lengths = [len(t) for t in trajectories]
+        positions = stack_takes(trajectories)
+
+        # --- 2. Descriptors of every take in one call ---
+        with profiling.stage("compute_descriptors", excerpt=excerpt):
+            values = compute_descriptors(positions, FRAME_RATE, DESCRIPTORS)
+        velocity = values["vs"]
+        values = np.stack([values[d] for d in descriptors])
+
+        # --- 3. Warp onto the first take and crop ---
+        valid = validity_mask(excerpt, frames[0])
+        for t, (violin, phase, file) in enumerate(takes):
+            if t == 0:
+                index = np.arange(lengths[0])
+            else:
+                index = align(velocity[0, : lengths[0]], velocity[t, : lengths[t]])
+            features.setdefault((excerpt, violin, phase), []).append(
+                (file.name, values[:, t, index][:, valid])
+            )
+
+    return dense_dataset(features, list(descriptors), BATCHED_UNITS)
+
+
+def merge_dataset(dataset: xr.Dataset, output_path: pathlib.Path) -> xr.Dataset:
+    """
+    Add the descriptors already stored in output_path to a new dataset.
+
+    Descriptors of the new dataset replace the stored ones and the others are
+    kept, so processing one descriptor at a time builds up a single file. Takes
+    and time steps missing on either side are padded with NaN.
+    """
+    if not output_path.exists():
+        return dataset
+    with xr.open_dataset(output_path) as stored:
+        kept = [d for d in stored.data_vars if d not in dataset.data_vars]
+        stored = stored[kept].load()
+    if not kept:
+        return dataset
+    merged = dataset.drop_vars("filename").combine_first(stored.drop_vars("filename"))
+    new, old = xr.align(
+        dataset["filename"], stored["filename"], join="outer", fill_value=""
+    )
+    return merged.assign_coords(filename=new.where(new != "", old))
+
+
+def check_descriptors(descriptors: List[str] = DESCRIPTORS):
+    """
+    Check the batched descriptors against Take.compute_* on the first take of
+    every excerpt, over the whole take.
+
+    Raises:
+        ValueError: If a descriptor differs by more than CHECK_TOLERANCE times
+            its range, or has a different length.
+    """
+    from take import Take
+
+    for excerpt in EXCERPTS:
+        takes = list_takes(excerpt)
+        if not takes:
+            continue
+        file = takes[0][2]
+        take = Take(file)
+        _, trajectory = mocap_io.read_markers(file, MARKER_NAMES)
+        values = compute_descriptors(trajectory[None], FRAME_RATE, descriptors)
+
+        for d in descriptors:
+            expected = np.asarray(getattr(take, f"compute_{d}")(), dtype=np.float64)
+            actual = values[d][0].astype(np.float64)
+            if actual.shape != expected.shape:
+                raise ValueError(
+                    f"{d} of {file.name}: {actual.shape} frames batched, "
+                    f"{expected.shape} with Take"
+                )
+            error = np.nanmax(np.abs(actual - expected))
+            scale = np.nanmax(np.abs(expected))
+            if not error <= CHECK_TOLERANCE * scale:
+                raise ValueError(
+                    f"{d} of {file.name} differs from Take.compute_{d} by up to "
+                    f"{error:.3g} {BATCHED_UNITS[d]} (range {scale:.3g})"
+                )
+        print(f"{excerpt}: batched descriptors match Take on {file.name}")
+
+
+def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    dataset.to_netcdf(output_path)
+    print(f"Dataset saved to {output_path}")
+
+
+def phase_difference(da: xr.DataArray) -> Tuple[xr.DataArray, xr.DataArray, xr.DataArray]:
+    """
+    Difference between the mean phase-2 and phase-1 takes, with its 95% CI.
+
+    The standard error combines the spread and the number of takes of each
+    phase, so every take counts once. Padded (NaN) takes are left out.
+
+    Args:
+        da: Array with "phase" and "take" dimensions.
+
+    Returns:
+        Tuple of (mean, low, high) arrays, without the "phase" and "take"
+        dimensions.
+    """
+    n = da.notnull().sum("take")
+    mean = da.mean("take")
+    var = da.var("take") / n
+    diff = mean.sel(phase=2, drop=True) - mean.sel(phase=1, drop=True)
+    s = 1.96 * np.sqrt(var.sel(phase=2, drop=True) + var.sel(phase=1, drop=True))
+    return diff, diff - s, diff + s
+
+
+def plot(dataset_path: pathlib.Path, descriptor: str = descriptor):
+    plt = plotting.pyplot()
+
+    # --- 1. Load data ---
+    ds = xr.open_dataset(dataset_path)
+    if descriptor not in ds:
+        stored = ", ".join(map(str, ds.data_vars)) or "none"
+        raise ValueError(
+            f"{descriptor} is not in {dataset_path} (stored: {stored}), "
+            f"process it with: mocap.py --process --descriptor {descriptor}"
+        )
+    da = ds[descriptor].drop_vars("filename")
+    # Units of the engine that computed the descriptor
+    units = da.attrs.get("units", UNITS[descriptor])
+    time = ds["time"].to_numpy()
+
+    # --- 2. Mean and CI over takes ---
+    with warnings.catch_warnings():
+        # Padded (all-NaN) time steps
+        warnings.simplefilter("ignore", RuntimeWarning)
+        takes = mean_ci(da.to_numpy(), axis=da.get_axis_num("take"))
+        diffs = [
+            x.transpose("excerpt", "violin", "time").to_numpy() for x in phase_difference(da)
+        ]
+
+    # --- 3. Plotting ---
+    fig, axes = plt.subplots(
+        nrows=len(VIOLINS) + 1,
+        ncols=len(EXCERPTS),
+        sharex="col",
+        sharey="row",
+    )
 
-                    compute_func = getattr(take, f"compute_{descriptor}", None)
+    for i, violin in enumerate(VIOLINS):
+        for j, excerpt in enumerate(EXCERPTS):
+            ax = axes[i, j]
 
-                    t_vals = time[valid]
-                    t_vals = np.arange(len(t_vals)) / 120
-                    f_vals = take.warp(compute_func())[valid]
+            for k, phase in enumerate(PHASES):
+                t, m, low, high = plotting.decimate(fig, time, *(x[j, i, k] for x in takes))
+                ax.plot(t, m, color=colors[phase], label=str(phase))
+                ax.fill_between(t, low, high, color=colors[phase], alpha=0.2, linewidth=0)
 
-                    df_tmp = pd.DataFrame({"time": t_vals, "feature": f_vals})
+            if i == 0:
+                ax.set_title(excerpt.replace("_", " ").title())
 
-                    df_tmp["violin"] = violin
-                    df_tmp["excerpt"] = excerpt
-                    df_tmp["phase"] = phase
+            if j == 0:
+                ax.sharey(axes[0, 0])
+                ax.set_ylabel(
+                    f"{VIOLIN_MAP[violin]}\n{descriptor} ({units})"
+                )
 
-                    data_frames.append(df_tmp)
+    # --- 3.2 Row 4 : Differences ---
+    for j, excerpt in enumerate(EXCERPTS):
+        ax = axes[-1, j]
+        for i, violin in enumerate(VIOLINS):
+            t, m, low, high = plotting.decimate(fig, time, *(x[j, i] for x in diffs))
+            ax.plot(t, m, color=colors[violin], label=violin)
+            ax.fill_between(t, low, high, color=colors[violin], alpha=0.2, linewidth=0)
+        ax.set_xlabel("Time (s)")
+    axes[-1, 0].set_ylabel("Diff (P2 - P1)")
+
+    # Styling
+    for ax in axes.flat:
+        ax.grid(True, which="both", alpha=0.3)
+
+    # --- 3.4 Legends ---
+    target_ax = axes[1, -1]
+    handles_top, labels_top = target_ax.get_legend_handles_labels()
+    target_ax.legend(
+        handles_top[:2],
+        labels_top[:2],
+        title="Phase",
+        loc="center left",
+        bbox_to_anchor=(1.02, 0.5),
+        borderaxespad=0,
+    )
 
-    df = pd.concat(data_frames, ignore_index=True)
-    print(df)
-    df.to_csv("test.csv")
+    target_ax = axes[-1, -1]
+    handles_top, labels_top = target_ax.get_legend_handles_labels()
+    target_ax.legend(
+        handles_top[:3],
+        ["Klimke", "Test player's", "Stoppani"][: len(handles_top)],
+        title="Violin",
+        loc="center left",
+        bbox_to_anchor=(1.02, 0.5),
+        borderaxespad=0,
+    )
+
+    fig.tight_layout()
+    # --- 4. Saving Figure ---
+    output_png = pathlib.Path(f"reports/figures/mocap_{descriptor}.png")
+    output_svg = pathlib.Path(f"reports/figures/mocap_{descriptor}.svg")
+    output_png.parent.mkdir(parents=True, exist_ok=True)
+    plotting.lean(fig)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
+    print(f"Figures saved to {output_png} and {output_svg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process and plot bowing descriptors.")
+    parser.add_argument("--process", action="store_true", help="Process raw mocap takes")
+    parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument(
+        "--descriptor", choices=DESCRIPTORS, default=descriptor, help="Descriptor"
+    )
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Compute all descriptors with the in-repo batched engine instead of Take "
+        "(not yet checked against Take, see --check)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Check the batched descriptors against Take before processing",
+    )
+    profiling.add_argument(parser)
 
+    args = parser.parse_args()
+    profiling.enable(args.profile)
 
-build_dataset()
+    if args.check:
+        with profiling.stage("check"):
+            check_descriptors()
 
-df = pd.read_csv("test.csv")
-df_diff = pd.merge(
-    df[df["phase"] == 2],
-    df[df["phase"] == 1],
-    on=["violin", "excerpt", "time"],
-    suffixes=("_p2", "_p1"),
-)
-df_diff["difference"] = df_diff["feature_p2"] - df_diff["feature_p1"]
+    # If no args provided, run both
+    if not args.process and not args.plot and not args.check:
+        args.process = True
+        args.plot = True
 
+    if args.process:
+        with profiling.stage("process"):
+            if args.batched:
+                ds = build_dataset_batched()
+            else:
+                ds = build_dataset(args.descriptor)
+            save_dataset(merge_dataset(ds, PROCESSED_DATA_PATH), PROCESSED_DATA_PATH)
 
-fig, axes = plt.subplots(
-    nrows=len(VIOLINS) + 1,
-    ncols=len(EXCERPTS),
-    sharex="col",
-    sharey="row",
-)
+    if args.plot:
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH, args.descriptor)
 
-for i, violin in enumerate(VIOLINS):
-    for j, excerpt in enumerate(EXCERPTS):
-        ax = axes[i, j]
-
-        sns.lineplot(
-            data=df[(df["violin"] == violin) & (df["excerpt"] == excerpt)],
-            x="time",
-            y="feature",
-            hue="phase",
-            errorbar=ci,
-            estimator="mean",
-            palette=[colors[1], colors[2]],
-            ax=ax,
-            err_kws={"linewidth": 0},
-        )
 
-        if i == 0:
-            ax.set_title(excerpt.replace("_", " ").title())
-
-        if j == 0:
-            ax.sharey(axes[0, 0])
-            ax.set_ylabel(f"{VIOLIN_MAP[violin]}\n{descriptor} ({UNITS[descriptor]})")
-        ax.get_legend().remove()
-
-# --- 3.2 Row 4 : Differences ---
-for j, excerpt in enumerate(EXCERPTS):
-    ax = axes[-1, j]
-    sns.lineplot(
-        data=df_diff[df_diff["excerpt"] == excerpt],
-        x="time",
-        y="difference",
-        hue="violin",
-        errorbar=ci,
-        estimator="mean",
-        ax=ax,
-        err_kws={"linewidth": 0},
-    )
-    ax.set_xlabel("Time (s)")
-    ax.get_legend().remove()
-axes[-1, 0].set_ylabel("Diff (P2 - P1)")
-
-# Styling
-for ax in axes.flat:
-    ax.grid(True, which="both", alpha=0.3)
-
-# --- 3.4 Legends ---
-target_ax = axes[1, -1]
-handles_top, labels_top = target_ax.get_legend_handles_labels()
-target_ax.legend(
-    handles_top[:2],
-    labels_top[:2],
-    title="Phase",
-    loc="center left",
-    bbox_to_anchor=(1.02, 0.5),
-    borderaxespad=0,
-)
-
-target_ax = axes[-1, -1]
-handles_top, labels_top = target_ax.get_legend_handles_labels()
-target_ax.legend(
-    handles_top[:3],
-    ["Klimke", "Test player's", "Stoppani"],
-    title="Violin",
-    loc="center left",
-    bbox_to_anchor=(1.02, 0.5),
-    borderaxespad=0,
-)
-
-fig.tight_layout()
-# --- 4. Saving Figure ---
-output_png = pathlib.Path(f"reports/figures/mocap_{descriptor}.png")
-output_svg = pathlib.Path(f"reports/figures/mocap_{descriptor}.svg")
-output_png.parent.mkdir(parents=True, exist_ok=True)
-plt.savefig(output_png)
-plt.savefig(output_svg)
-print(f"Figures saved to {output_png} and {output_svg}")
+if __name__ == "__main__":
+    main()
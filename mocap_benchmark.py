@@ -0,0 +1,153 @@
+"""
+Scaling benchmark of the batched mocap pipeline on synthetic takes.
+
+For every (duration, takes, markers) configuration, synthetic takes are written
+to a temporary directory and the pipeline is run stage by stage. Wall time and
+peak traced memory are reported separately for parsing, descriptor computation,
+alignment/warping and plotting. Takes are read over the padded VALIDITY window of
+the first excerpt, as mocap.py does, and whole when they are longer than it, so
+that every duration is parsed in full.
+"""
+
+import argparse
+import contextlib
+import itertools
+import os
+import pathlib
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import mocap
+import mocap_io
+import plotting
+from mocap_descriptors import MARKER_NAMES, align, compute_descriptors, stack_takes
+from mocap_synthetic import generate
+
+# From the shortest VALIDITY window to several minutes
+DURATIONS = sorted(
+    {end / mocap.FRAME_RATE for _, end in filter(None, mocap.VALIDITY.values())}
+    | {60, 180, 300}
+)
+TAKES = [8, 32]
+MARKERS = [len(MARKER_NAMES), 40]
+
+
+@contextlib.contextmanager
+def stage(results: List[Dict], name: str, memory: bool = True, **params):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    peak = np.nan
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    results.append(
+        {**params, "stage": name, "time_s": elapsed, "peak_mb": peak / 1e6}
+    )
+
+
+def run(
+    duration: float,
+    n_takes: int,
+    n_markers: int,
+    tempo_deviation: float,
+    memory: bool = True,
+) -> List[Dict]:
+    results = []
+    params = dict(duration=duration, takes=n_takes, markers=n_markers)
+    excerpt = mocap.EXCERPTS[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        paths = generate(tmp / "takes", n_takes, duration, n_markers, tempo_deviation)
+
+        # Rows outside the excerpt's padded VALIDITY window are skipped, as in
+        # mocap.build_dataset_batched, unless the take extends beyond it: the
+        # takes then stand for a longer excerpt and are read whole
+        window = mocap.read_window(excerpt)
+        if window is not None and duration * mocap.FRAME_RATE > window[1]:
+            window = None
+        with stage(results, "parse", memory, **params):
+            trajectories = [
+                mocap_io.read_markers(p, MARKER_NAMES, window)[1] for p in paths
+            ]
+
+        with stage(results, "descriptors", memory, **params):
+            positions = stack_takes(trajectories)
+            values = compute_descriptors(positions, mocap.FRAME_RATE)
+
+        with stage(results, "align", memory, **params):
+            velocity = values["vs"]
+            values = np.stack([values[d] for d in mocap.DESCRIPTORS])
+            warped = [values[:, 0]]
+            for t in range(1, n_takes):
+                index = align(velocity[0], velocity[t])
+                warped.append(values[:, t, index])
+
+        # One excerpt, takes spread over violins and phases
+        features = {}
+        cells = itertools.cycle(itertools.product(mocap.VIOLINS, mocap.PHASES))
+        for path, w in zip(paths, warped):
+            violin, phase = next(cells)
+            key = (excerpt, violin, phase)
+            features.setdefault(key, []).append((path.name, w))
+        dataset_path = tmp / "mocap.nc"
+        mocap.save_dataset(mocap.dense_dataset(features, mocap.DESCRIPTORS, mocap.BATCHED_UNITS), dataset_path)
+
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            with stage(results, "plot", memory, **params):
+                mocap.plot(dataset_path, "vs")
+        finally:
+            os.chdir(cwd)
+            plotting.pyplot().close("all")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the mocap pipeline.")
+    parser.add_argument("--durations", type=float, nargs="+", default=DURATIONS)
+    parser.add_argument("--takes", type=int, nargs="+", default=TAKES)
+    parser.add_argument("--markers", type=int, nargs="+", default=MARKERS)
+    parser.add_argument("--tempo-deviation", type=float, default=0.05)
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip tracemalloc, which slows down Python-heavy stages",
+    )
+    parser.add_argument("--output", type=pathlib.Path, help="Write results as CSV")
+
+    args = parser.parse_args()
+
+    results = []
+    for duration, n_takes, n_markers in itertools.product(
+        args.durations, args.takes, args.markers
+    ):
+        results += run(
+            duration, n_takes, n_markers, args.tempo_deviation, not args.no_memory
+        )
+        print(pd.DataFrame(results[-4:]).to_string(index=False, header=len(results) == 4))
+
+    df = pd.DataFrame(results)
+    summary = df.pivot_table(
+        index=["duration", "takes", "markers"], columns="stage", values="time_s"
+    )
+    print(summary.round(3))
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(args.output, index=False)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Batched bowing descriptors.
+
+Marker trajectories of many takes are stacked into a (take, time, marker, xyz)
+array and every descriptor is evaluated with whole-array operations, instead of
+one Take.compute_* call per take. The marker map and the formulas are written
+from the descriptor definitions, not ported from Take: until `mocap.py --check`
+finds them equal to Take's on the first take of every excerpt, Take remains the
+default engine.
+"""
+
+from typing import Dict, Sequence
+
+import numpy as np
+
+# Role -> marker name in the Motive "Name" header row, checked against Take by
+# mocap.check_descriptors
+MARKERS = {
+    "frog": "bow:frog",
+    "tip": "bow:tip",
+    "hair": "bow:hair",
+    "bridge_g": "violin:bridge_g",
+    "bridge_e": "violin:bridge_e",
+    "neck": "violin:neck",
+}
+MARKER_NAMES = list(MARKERS.values())
+
+DESCRIPTORS = ["vs", "xs", "hairstring", "tilt", "skewness", "beta"]
+# Units of compute_descriptors, which may differ from Take's (mocap.UNITS)
+UNITS = {
+    "vs": "mm/s",
+    "xs": "mm",
+    "hairstring": "mm",
+    "tilt": "rad",
+    "skewness": "rad",
+    "beta": "rad",
+}
+
+
+def _dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.einsum("...i,...i->...", a, b)
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def stack_takes(trajectories: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Stack (time, marker, xyz) trajectories of different lengths.
+
+    Returns:
+        float32 array of shape (take, time, marker, xyz), NaN-padded in time.
+    """
+    n_time = max(len(t) for t in trajectories)
+    shape = (len(trajectories), n_time) + trajectories[0].shape[1:]
+    positions = np.full(shape, np.nan, dtype=np.float32)
+    for i, t in enumerate(trajectories):
+        positions[i, : len(t)] = t
+    return positions
+
+
+def compute_descriptors(
+    positions: np.ndarray,
+    frame_rate: float = 120,
+    descriptors: Sequence[str] = DESCRIPTORS,
+) -> Dict[str, np.ndarray]:
+    """
+    Evaluate bowing descriptors on stacked takes.
+
+    The contact point is the closest point between the bow line (frog -> tip)
+    and the string line (bridge middle -> neck).
+
+    - vs: bow velocity along the bow at the contact point (mm/s)
+    - xs: bow-bridge distance along the string (mm)
+    - hairstring: distance between the bow and string lines (mm)
+    - tilt: rotation of the hair around the bow axis, 0 when the hair faces the
+      violin (rad)
+    - skewness: angle between the bow and the bridge in the violin plane (rad)
+    - beta: inclination of the bow out of the violin plane (rad)
+
+    Args:
+        positions: Array of shape (..., time, marker, xyz), markers ordered as MARKERS.
+        frame_rate: Frame rate in Hz.
+        descriptors: Names of the descriptors to compute.
+
+    Returns:
+        Dict of descriptor name -> float32 array of shape (..., time).
+    """
+    frog, tip, hair, bridge_g, bridge_e, neck = (
+        positions[..., k, :].astype(np.float64) for k in range(len(MARKERS))
+    )
+
+    # --- Violin frame ---
+    bridge = (bridge_g + bridge_e) / 2
+    s = _unit(neck - bridge)
+    b = _unit(bridge_e - bridge_g)
+    n = _unit(np.cross(b, s))
+
+    # --- Contact point ---
+    u = _unit(tip - frog)
+    w0 = frog - bridge
+    us = _dot(u, s)
+    d = _dot(u, w0)
+    e = _dot(s, w0)
+    denom = 1 - us**2
+    position = (us * e - d) / denom  # along the bow, from the frog
+    distance = (e - us * d) / denom  # along the string, from the bridge
+
+    out = {}
+    if "vs" in descriptors:
+        out["vs"] = np.gradient(position, axis=-1) * frame_rate
+    if "xs" in descriptors:
+        out["xs"] = distance
+    if "hairstring" in descriptors:
+        gap = w0 + position[..., None] * u - distance[..., None] * s
+        out["hairstring"] = np.linalg.norm(gap, axis=-1)
+    if "tilt" in descriptors:
+        h = hair - frog
+        h = _unit(h - _dot(h, u)[..., None] * u)
+        n_perp = -_unit(n - _dot(n, u)[..., None] * u)
+        out["tilt"] = np.arctan2(_dot(np.cross(n_perp, h), u), _dot(n_perp, h))
+    if "skewness" in descriptors:
+        out["skewness"] = np.arctan2(_dot(u, s), _dot(u, b))
+    if "beta" in descriptors:
+        out["beta"] = np.arcsin(np.clip(_dot(u, n), -1, 1))
+
+    return {name: out[name].astype(np.float32) for name in descriptors}
+
+
+def align(reference: np.ndarray, signal: np.ndarray, step: int = 12) -> np.ndarray:
+    """
+    Dynamic time warping of a signal onto a reference.
+
+    Both signals are z-scored and averaged over blocks of `step` frames before
+    warping, the path is then interpolated back to the full frame rate. The
+    cumulative cost is filled one anti-diagonal at a time.
+
+    Args:
+        reference: 1D reference signal (e.g. bow velocity of the first take).
+        signal: 1D signal of the take to align.
+        step: Decimation factor used for the warping.
+
+    Returns:
+        For each reference frame, the index of the matching frame in `signal`.
+    """
+
+    def prepare(x):
+        x = np.nan_to_num((x - np.nanmean(x)) / np.nanstd(x))
+        n_blocks = -(-len(x) // step)
+        x = np.pad(x, (0, n_blocks * step - len(x)), mode="edge")
+        return x.reshape(n_blocks, step).mean(axis=1)
+
+    x, y = prepare(reference), prepare(signal)
+    n, m = len(x), len(y)
+    cost = np.abs(x[:, None] - y[None, :])
+
+    D = np.full((n + 1, m + 1), np.inf)
+    D[0, 0] = 0
+    for k in range(2, n + m + 1):
+        i = np.arange(max(1, k - m), min(n, k - 1) + 1)
+        j = k - i
+        D[i, j] = cost[i - 1, j - 1] + np.minimum(
+            np.minimum(D[i - 1, j - 1], D[i - 1, j]), D[i, j - 1]
+        )
+
+    # --- Backtracking ---
+    i, j = n, m
+    path = [(i - 1, j - 1)]
+    while i > 1 or j > 1:
+        moves = [D[i - 1, j - 1], D[i - 1, j], D[i, j - 1]]
+        move = int(np.argmin(moves))
+        i, j = (i - 1, j - 1) if move == 0 else (i - 1, j) if move == 1 else (i, j - 1)
+        path.append((i - 1, j - 1))
+    path_x, path_y = np.array(path).T
+
+    # Block path -> frame path
+    matched = np.bincount(path_x, weights=path_y) / np.bincount(path_x)
+    frames = np.arange(len(reference)) / step
+    index = np.interp(frames, np.arange(n), matched) * step
+    return np.clip(np.round(index).astype(int), 0, len(signal) - 1)
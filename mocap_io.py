@@ -0,0 +1,122 @@
+"""
+Fast reader for Motive motion-capture CSV exports.
+
+A take is laid out as a metadata line, a blank line, a few header rows
+(Type, Name, ID, Position/Rotation) and a "Frame,Time (Seconds),X,Y,Z,..." row,
+followed by one row per frame. Only the columns of the requested markers and
+the rows inside the requested frame window are converted to floats.
+"""
+
+import pathlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+AXES = ["X", "Y", "Z"]
+
+
+def read_header(filepath: pathlib.Path) -> Dict:
+    """
+    Parse the multi-row header of a take.
+
+    Args:
+        filepath: Path to the .csv file.
+
+    Returns:
+        Dict with "frame_rate" (Hz), "markers" (name -> (x, y, z) column indices),
+        "n_header" (number of lines before the first frame) and "first_frame".
+    """
+    rows = {}
+    with open(filepath, "r", encoding="utf-8-sig") as file:
+        metadata = file.readline().rstrip("\r\n").split(",")
+        n_header = 1
+        previous = None
+        for line in file:
+            n_header += 1
+            fields = line.rstrip("\r\n").split(",")
+            if fields[0] == "Frame":
+                axes = fields
+                kinds = previous
+                break
+            if len(fields) > 1 and fields[1] in ("Type", "Name", "ID"):
+                rows[fields[1]] = fields
+            previous = fields
+        else:
+            raise ValueError(f"No 'Frame' header row in {filepath}")
+        first_frame = int(file.readline().split(",", 1)[0])
+
+    meta = dict(zip(metadata[::2], metadata[1::2]))
+    frame_rate = float(meta.get("Export Frame Rate", meta.get("Capture Frame Rate", 120)))
+
+    names = rows["Name"]
+    types = rows.get("Type", [""] * len(names))
+    markers = {}
+    for col in range(2, len(axes) - 2):
+        if (
+            axes[col : col + 3] != AXES
+            or kinds[col] != "Position"
+            or types[col] == "Rigid Body"
+            or names[col] in markers
+        ):
+            continue
+        markers[names[col]] = (col, col + 1, col + 2)
+
+    return {
+        "frame_rate": frame_rate,
+        "markers": markers,
+        "n_header": n_header,
+        "first_frame": first_frame,
+    }
+
+
+def read_markers(
+    filepath: pathlib.Path,
+    markers: Sequence[str],
+    frames: Optional[Tuple[int, int]] = None,
+    header: Optional[Dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the trajectories of a few markers.
+
+    Args:
+        filepath: Path to the .csv file.
+        markers: Marker names, as in the header's Name row.
+        frames: Optional [start, end) frame window. Rows outside it are skipped
+            by the tokenizer and never converted.
+        header: Output of read_header, to avoid parsing it again.
+
+    Returns:
+        Tuple of (frame_numbers, positions) where positions is a contiguous
+        float32 array of shape (frame, marker, xyz). Gaps are NaN.
+    """
+    if header is None:
+        header = read_header(filepath)
+
+    missing = [m for m in markers if m not in header["markers"]]
+    if missing:
+        raise KeyError(f"Markers {missing} not found in {filepath}")
+
+    cols: List[int] = [c for m in markers for c in header["markers"][m]]
+
+    skip = 0
+    n_rows = None
+    if frames is not None:
+        start, end = frames
+        skip = max(start - header["first_frame"], 0)
+        n_rows = max(end - header["first_frame"] - skip, 0)
+
+    df = pd.read_csv(
+        filepath,
+        header=None,
+        skiprows=header["n_header"] + skip,
+        nrows=n_rows,
+        usecols=[0] + cols,
+        dtype={c: np.float32 for c in cols},
+        engine="c",
+    )
+
+    frame_numbers = df[0].to_numpy(dtype=np.int64)
+    positions = df[cols].to_numpy(dtype=np.float32)
+    positions = positions.reshape(len(df), len(markers), len(AXES))
+    return frame_numbers, np.ascontiguousarray(positions)
@@ -0,0 +1,187 @@
+"""
+Synthetic motion-capture takes in the Motive CSV layout read by Take and mocap_io.
+
+A take is a bow moving back and forth on a fixed violin, with strokes of random
+length, string crossings, and a smoothly varying tempo. Extra markers are rigid
+offsets of the bow or violin markers with measurement noise.
+"""
+
+import argparse
+import pathlib
+from typing import List
+
+import numpy as np
+
+from mocap_descriptors import MARKER_NAMES
+
+FRAME_RATE = 120
+STRING_LENGTH = 328  # mm
+BOW_LENGTH = 650  # mm
+
+
+def synthetic_take(
+    duration: float,
+    n_markers: int = len(MARKER_NAMES),
+    tempo_deviation: float = 0.05,
+    frame_rate: float = FRAME_RATE,
+    seed: int = 0,
+    take: int = 0,
+) -> np.ndarray:
+    """
+    Generate marker trajectories for one take.
+
+    Args:
+        duration: Duration in seconds.
+        n_markers: Total number of markers, at least len(MARKER_NAMES).
+        tempo_deviation: Standard deviation of the relative tempo around 1.
+        frame_rate: Frame rate in Hz.
+        seed: Seed of the excerpt: takes sharing a seed play the same strokes.
+        take: Index of the take, seeds the tempo curve and the noise.
+
+    Returns:
+        float32 array of shape (frame, marker, xyz) in mm.
+    """
+    if n_markers < len(MARKER_NAMES):
+        raise ValueError(f"At least {len(MARKER_NAMES)} markers are needed")
+
+    score = np.random.default_rng(seed)
+    rng = np.random.default_rng([seed, take])
+    n_frames = int(duration * frame_rate)
+
+    # --- Performance time -> score time, with a smooth random tempo ---
+    knots = rng.normal(1, tempo_deviation, size=int(duration) // 2 + 2)
+    tempo = np.interp(
+        np.linspace(0, len(knots) - 1, n_frames), np.arange(len(knots)), knots
+    )
+    t = np.cumsum(np.clip(tempo, 0.2, None)) / frame_rate
+
+    # --- Bow strokes between random turning points, near frog and tip in turn ---
+    n_strokes = int(2 * duration / 0.4) + 2
+    stroke_duration = score.uniform(0.4, 2.0, n_strokes)
+    turns = score.uniform(0.05, 0.45, n_strokes + 1) * BOW_LENGTH
+    turns[1::2] = BOW_LENGTH - turns[1::2]
+    onsets = np.concatenate([[0], np.cumsum(stroke_duration)])
+    stroke = np.clip(np.searchsorted(onsets, t, side="right") - 1, 0, n_strokes - 1)
+    phase = np.clip((t - onsets[stroke]) / stroke_duration[stroke], 0, 1)
+    bow_position = turns[stroke] + (turns[stroke + 1] - turns[stroke]) * (
+        0.5 - 0.5 * np.cos(np.pi * phase)
+    )  # contact point, from the frog
+
+    # --- String crossings rotate the bow around the string axis ---
+    string = score.integers(0, 4, n_strokes)
+    crossing = np.deg2rad(-15 + 10 * string[stroke])
+    skew = np.deg2rad(5) * np.sin(2 * np.pi * t / 7)
+    beta = 0.08 + 0.03 * np.sin(2 * np.pi * t / 11)
+
+    # --- Violin: x along the bridge, y along the strings, z normal ---
+    positions = np.zeros((n_frames, n_markers, 3))
+    positions[:, 3] = [-17, 0, 0]
+    positions[:, 4] = [17, 0, 0]
+    positions[:, 5] = [0, STRING_LENGTH, 0]
+
+    u = np.stack(
+        [np.cos(skew), np.sin(skew), np.zeros_like(skew)], axis=-1
+    )  # bow axis
+    normal = np.stack(
+        [np.zeros_like(crossing), -np.sin(crossing), np.cos(crossing)], axis=-1
+    )
+    contact = np.stack([np.zeros_like(beta), beta * STRING_LENGTH, 0 * beta], axis=-1)
+    frog = contact - bow_position[:, None] * u + 15 * normal
+    positions[:, 0] = frog
+    positions[:, 1] = frog + BOW_LENGTH * u
+    positions[:, 2] = frog - 10 * normal
+
+    # --- Extra markers and noise ---
+    for k in range(len(MARKER_NAMES), n_markers):
+        anchor = score.integers(0, len(MARKER_NAMES))
+        positions[:, k] = positions[:, anchor] + score.normal(0, 30, 3)
+    positions += rng.normal(0, 0.1, positions.shape)
+
+    return positions.astype(np.float32)
+
+
+def marker_names(n_markers: int) -> List[str]:
+    extra = [f"extra:{k}" for k in range(n_markers - len(MARKER_NAMES))]
+    return MARKER_NAMES + extra
+
+
+def write_take(
+    filepath: pathlib.Path, positions: np.ndarray, frame_rate: float = FRAME_RATE
+):
+    """
+    Write marker trajectories as a Motive CSV export.
+    """
+    n_frames, n_markers, _ = positions.shape
+    names = marker_names(n_markers)
+    n_cols = 3 * n_markers
+    header = [
+        f"Format Version,1.23,Take Name,{filepath.stem},"
+        f"Capture Frame Rate,{frame_rate:.6f},Export Frame Rate,{frame_rate:.6f},"
+        f"Total Exported Frames,{n_frames},Length Units,Millimeters",
+        "",
+        ",Type," + ",".join(["Marker"] * n_cols),
+        ",Name," + ",".join(name for name in names for _ in range(3)),
+        ",ID," + ",".join(str(k + 1) for k in range(n_markers) for _ in range(3)),
+        ",," + ",".join(["Position"] * n_cols),
+        "Frame,Time (Seconds)," + ",".join(["X", "Y", "Z"] * n_markers),
+    ]
+    frames = np.arange(n_frames)
+    table = np.column_stack(
+        [frames, frames / frame_rate, positions.reshape(n_frames, n_cols)]
+    )
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    np.savetxt(
+        filepath,
+        table,
+        fmt=["%d", "%.6f"] + ["%.4f"] * n_cols,
+        delimiter=",",
+        header="\n".join(header),
+        comments="",
+    )
+
+
+def generate(
+    directory: pathlib.Path,
+    n_takes: int,
+    duration: float,
+    n_markers: int = len(MARKER_NAMES),
+    tempo_deviation: float = 0.05,
+    seed: int = 0,
+) -> List[pathlib.Path]:
+    """
+    Write n_takes takes of the same synthetic excerpt.
+    """
+    paths = []
+    for i in range(n_takes):
+        positions = synthetic_take(
+            duration, n_markers, tempo_deviation, seed=seed, take=i
+        )
+        path = directory / f"take_{i + 1}.csv"
+        write_take(path, positions)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic mocap takes.")
+    parser.add_argument("directory", type=pathlib.Path, help="Output directory")
+    parser.add_argument("--takes", type=int, default=10, help="Number of takes")
+    parser.add_argument("--duration", type=float, default=25, help="Duration (s)")
+    parser.add_argument("--markers", type=int, default=len(MARKER_NAMES))
+    parser.add_argument("--tempo-deviation", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    paths = generate(
+        args.directory,
+        args.takes,
+        args.duration,
+        args.markers,
+        args.tempo_deviation,
+        args.seed,
+    )
+    print(f"{len(paths)} takes written to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Note-level analysis of the scale recordings.
+
+recordings.py reduces every take (gamme-N.flac) to one LTAS, which mixes the
+registers of the scale. Here every take is decoded once, resampled to SR and
+cut into frames of FRAME_SIZE every HOP samples, and the same frames give:
+
+- the pitch of every frame: YIN (cumulative mean normalised difference, first
+  dip under YIN_THRESHOLD, parabolic interpolation) computed with FFTs over
+  batches of frames
+- the power spectrum of every frame (Hann window), as for the LTAS
+
+Voiced frames are rounded to the nearest semitone (MIDI number) and median
+filtered; runs of at least MIN_NOTE seconds on the same semitone are notes,
+the rest (transitions, onsets, silences) is discarded. The spectral envelope of
+a note is the mean power spectrum of its frames, in dB, and the notes of a take
+played on the same semitone (the scale goes up and down) are averaged, so
+data/processed/notes.nc holds an envelope (take, note, frequency) with the note
+as a MIDI number, NaN where the take does not play it, and the LTAS of the same
+frames (take, frequency).
+
+Takes are matched with the measurements of recordings.nc as in stimuli.py and
+processed in a process pool, one take per task.
+"""
+
+import argparse
+import os
+import pathlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.ndimage
+import scipy.signal
+import soundfile as sf
+import xarray as xr
+
+import compact as compact_storage
+import loaders
+import plotting
+import profiling
+from config import colors, mean_ci, VIOLIN_MAP
+from stimuli import list_sources, RAW_DATA_DIR, RECORDINGS_PATH
+
+# Constants
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/notes.nc")
+SR = 16000
+FRAME_SIZE = 2048
+HOP = 512
+
+# Pitch tracking
+FMIN = 180.0  # Hz, below the open G string
+FMAX = 2500.0  # Hz
+YIN_WINDOW = 512  # samples, integration window of the difference function
+YIN_THRESHOLD = 0.15
+BATCH = 1024  # frames per FFT batch
+SILENCE = -50.0  # dB, frames quieter than the loudest frame minus this are unvoiced
+MEDIAN = 5  # frames, median filter of the semitone track
+MIN_NOTE = 0.15  # s
+
+
+# --- 1. Frame analysis ---
+
+
+def frames(audio: np.ndarray) -> np.ndarray:
+    """Frames of FRAME_SIZE every HOP samples, as a read-only view."""
+    if len(audio) < FRAME_SIZE:
+        audio = np.pad(audio, (0, FRAME_SIZE - len(audio)))
+    return np.lib.stride_tricks.sliding_window_view(audio, FRAME_SIZE)[::HOP]
+
+
+def yin(frames: np.ndarray, sr: int = SR) -> np.ndarray:
+    """
+    YIN fundamental frequency of a batch of frames.
+
+    The difference function d(tau) = E(0) + E(tau) - 2 r(tau) is computed for
+    all frames at once, r from one FFT per frame and E from cumulative sums,
+    on YIN_WINDOW samples centred in the frame.
+
+    Args:
+        frames: (n_frames, FRAME_SIZE) audio frames.
+        sr: Sampling rate.
+
+    Returns:
+        f0 of every frame in Hz, NaN when unvoiced.
+    """
+    tau_min, tau_max = int(sr / FMAX), int(np.ceil(sr / FMIN))
+    start = (frames.shape[1] - YIN_WINDOW - tau_max) // 2
+    x = frames[:, start : start + YIN_WINDOW + tau_max].astype(np.float64)
+
+    n_fft = 1 << int(np.ceil(np.log2(2 * x.shape[1])))
+    spectrum = np.fft.rfft(x, n_fft)
+    window = np.fft.rfft(x[:, :YIN_WINDOW], n_fft)
+    r = np.fft.irfft(np.conj(window) * spectrum, n_fft)[:, : tau_max + 1]
+    energy = np.cumsum(np.pad(x**2, ((0, 0), (1, 0))), axis=1)
+    e = energy[:, YIN_WINDOW : YIN_WINDOW + tau_max + 1] - energy[:, : tau_max + 1]
+    d = np.maximum(e[:, :1] + e - 2 * r, 0)
+
+    # Cumulative mean normalised difference
+    cumulative = np.cumsum(d[:, 1:], axis=1)
+    taus = np.arange(1, tau_max + 1)
+    cmnd = np.ones_like(d)
+    np.divide(d[:, 1:] * taus, cumulative, out=cmnd[:, 1:], where=cumulative > 0)
+
+    # First local minimum under the threshold, global minimum otherwise
+    search = cmnd[:, tau_min:]
+    dip = (search[:, :-1] < YIN_THRESHOLD) & (search[:, :-1] <= search[:, 1:])
+    tau = np.where(dip.any(axis=1), dip.argmax(axis=1), search[:, :-1].argmin(axis=1))
+    tau = np.clip(tau + tau_min, 1, tau_max - 1)
+    rows = np.arange(len(tau))
+    voiced = cmnd[rows, tau] < YIN_THRESHOLD
+
+    # Parabolic interpolation
+    a, b, c = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, tau + 1]
+    curvature = a - 2 * b + c
+    shift = np.divide(a - c, 2 * curvature, out=np.zeros_like(b), where=curvature > 0)
+    f0 = sr / (tau + np.clip(shift, -1, 1))
+    return np.where(voiced, f0, np.nan)
+
+
+def power_spectra(frames: np.ndarray) -> np.ndarray:
+    """Hann-windowed power spectra, (n_frames, FRAME_SIZE // 2 + 1)."""
+    window = np.hanning(FRAME_SIZE)
+    return np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 / np.sum(window**2)
+
+
+def segment(f0: np.ndarray, level: np.ndarray) -> np.ndarray:
+    """
+    Semitone of every frame that belongs to a note.
+
+    Args:
+        f0: Pitch of every frame in Hz (NaN when unvoiced).
+        level: Level of every frame in dB.
+
+    Returns:
+        MIDI number of every frame, -1 outside notes.
+    """
+    voiced = np.isfinite(f0) & (level > level.max() + SILENCE)
+    midi = np.where(voiced, np.round(69 + 12 * np.log2(np.where(voiced, f0, 440) / 440)), -1)
+    midi = scipy.ndimage.median_filter(midi, size=MEDIAN, mode="nearest").astype(int)
+
+    # Runs of the same semitone, too short ones dropped
+    change = np.flatnonzero(np.diff(midi)) + 1
+    starts, stops = np.r_[0, change], np.r_[change, len(midi)]
+    short = (stops - starts) * HOP / SR < MIN_NOTE
+    for start, stop in zip(starts[short], stops[short]):
+        midi[start:stop] = -1
+    return midi
+
+
+def analyse(flac: pathlib.Path) -> Dict:
+    """
+    Note envelopes and LTAS of one take, from a single decoding.
+
+    Returns:
+        note: semitones played, envelope: (note, frequency) dB, n_frames and
+        f0 (median pitch) of every note, ltas: (frequency,) dB.
+    """
+    audio, sr = sf.read(flac, dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if sr != SR:
+        gcd = np.gcd(sr, SR)
+        audio = scipy.signal.resample_poly(audio, SR // gcd, sr // gcd).astype(np.float32)
+    framed = frames(audio)
+
+    f0 = np.empty(len(framed))
+    power = np.empty((len(framed), FRAME_SIZE // 2 + 1), dtype=np.float32)
+    for start in range(0, len(framed), BATCH):
+        batch = framed[start : start + BATCH]
+        f0[start : start + BATCH] = yin(batch)
+        power[start : start + BATCH] = power_spectra(batch)
+
+    with np.errstate(divide="ignore"):
+        level = 10 * np.log10(power.sum(axis=1))
+    midi = segment(f0, level)
+    notes = np.unique(midi[midi >= 0])
+    if len(notes) == 0:
+        warnings.warn(f"{flac}: no note found")
+
+    envelope = np.empty((len(notes), power.shape[1]), dtype=np.float32)
+    n_frames = np.empty(len(notes), dtype=np.int32)
+    pitch = np.empty(len(notes), dtype=np.float32)
+    for i, note in enumerate(notes):
+        mask = midi == note
+        envelope[i] = 10 * np.log10(power[mask].mean(axis=0))
+        n_frames[i] = mask.sum()
+        pitch[i] = np.median(f0[mask])
+    return {
+        "note": notes,
+        "envelope": envelope,
+        "n_frames": n_frames,
+        "f0": pitch,
+        "ltas": 10 * np.log10(power.mean(axis=0)),
+    }
+
+
+# --- 2. Dataset ---
+
+
+def build_dataset(
+    raw_data_dir: pathlib.Path = RAW_DATA_DIR,
+    recordings_path: pathlib.Path = RECORDINGS_PATH,
+    n_jobs: Optional[int] = None,
+) -> xr.Dataset:
+    """
+    Analyse every take in parallel and align the notes across takes.
+
+    Returns:
+        Dataset with envelope (take, note, frequency), n_frames and f0 (take,
+        note), ltas (take, frequency) and the coordinates of recordings.nc.
+    """
+    sources = list_sources(raw_data_dir, recordings_path)
+    with xr.open_dataset(recordings_path) as recordings:
+        scope, phase = recordings["scope"].values, recordings["phase"].values
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # Memoised: only new or modified takes are analysed again
+        results = list(executor.map(loaders.note_analysis, sources["flac"], chunksize=4))
+
+    notes = np.unique(np.concatenate([r["note"] for r in results]))
+    frequency = np.fft.rfftfreq(FRAME_SIZE, 1 / SR)
+    envelope = np.full((len(results), len(notes), len(frequency)), np.nan, dtype=np.float32)
+    n_frames = np.zeros((len(results), len(notes)), dtype=np.int32)
+    f0 = np.full((len(results), len(notes)), np.nan, dtype=np.float32)
+    for take, result in enumerate(results):
+        columns = np.searchsorted(notes, result["note"])
+        envelope[take, columns] = result["envelope"]
+        n_frames[take, columns] = result["n_frames"]
+        f0[take, columns] = result["f0"]
+
+    return xr.Dataset(
+        data_vars={
+            "envelope": (["take", "note", "frequency"], envelope),
+            "n_frames": (["take", "note"], n_frames),
+            "f0": (["take", "note"], f0),
+            "ltas": (["take", "frequency"], np.stack([r["ltas"] for r in results])),
+        },
+        coords={
+            "take": np.arange(len(results)),
+            "note": notes,
+            "frequency": frequency,
+            "violin": (["take"], sources["violin"].to_numpy()),
+            "violinist": (["take"], sources["player"].to_numpy()),
+            "scope": (["take"], scope),
+            "phase": (["take"], phase),
+            "filepath": (["take"], sources["flac"].astype(str).to_numpy()),
+        },
+    )
+
+
+def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path, compact: bool = False):
+    """
+    Args:
+        compact: Store the envelopes and LTAS (dB) as int16 (see compact.py).
+    """
+    encoding = {}
+    if compact:
+        for name in ["envelope", "ltas"]:
+            encoding[name] = compact_storage.db_encoding(dataset[name])
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    dataset.to_netcdf(output_path, encoding=encoding)
+    print(f"Dataset saved to {output_path}")
+
+
+# --- 3. Plot ---
+
+
+def plot(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+
+    # --- 1. Load Data ---
+    ds = xr.open_dataset(dataset_path)
+    # Notes of the scale, not the odd note of a few takes
+    common = (ds["n_frames"] > 0).mean("take") >= 0.5
+    envelope = ds["envelope"].sel(frequency=slice(200, 5000), note=common)
+
+    # --- 2. Phase 2 - phase 1, per violin and note ---
+    # Level of every note relative to the mean of its take (playing dynamics
+    # differ across takes), averaged per violin, violinist and phase
+    level = 10 * np.log10((10 ** (envelope / 10)).mean("frequency"))
+    level = level - level.mean("note")
+    keys = ["violin", "violinist", "phase"]
+    means = level.set_index(take=keys).groupby("take").mean().unstack("take")
+    delta = means.sel(phase=2) - means.sel(phase=1)
+
+    # --- 3. Plot ---
+    fig, ax = plt.subplots()
+    for violin in delta["violin"].values:
+        values = delta.sel(violin=violin).transpose("note", "violinist").values
+        m, low, high = mean_ci(values, axis=1)
+        notes = delta["note"].values
+        ax.plot(notes, m, color=colors[violin], label=VIOLIN_MAP.get(violin, violin))
+        ax.fill_between(notes, low, high, color=colors[violin], alpha=0.2, linewidth=0)
+    ax.axhline(0, color="grey", linewidth=0.5)
+    ax.set_xlabel("Note (MIDI)")
+    ax.set_ylabel("Level change (dB)")
+    ax.legend()
+
+    # --- 4. Save ---
+    output_dir = pathlib.Path("reports/figures")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_png = output_dir / "notes.png"
+    output_svg = output_dir / "notes.svg"
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
+    print(f"Plot saved to {output_png} and {output_svg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Note-level analysis of the scale recordings.")
+    parser.add_argument("--process", action="store_true", help="Analyse the raw FLACs")
+    parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument(
+        "--compact", action="store_true", help="Store the spectra as int16 dB"
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # If no args provided, run both
+    if not args.process and not args.plot:
+        args.process = True
+        args.plot = True
+
+    if args.process:
+        with profiling.stage("process"):
+            ds = build_dataset(n_jobs=args.jobs)
+            save_dataset(ds, PROCESSED_DATA_PATH, args.compact)
+
+    if args.plot:
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
+
+
+if __name__ == "__main__":
+    main()
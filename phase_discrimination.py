@@ -0,0 +1,297 @@
+"""
+Phase discriminability of the recordings: can the phase 1 and phase 2 takes of
+a violin be told apart from their LTAS, beyond the violinist playing them?
+
+For every violin, a shrinkage LDA on the principal components of the LTAS
+(normalised as in recordings.py: 200 Hz - 5 kHz, each take divided by its
+mean) is evaluated by leave-one-violinist-out cross-validation, so a take is
+always classified by a model that never heard its violinist. The score is the
+balanced accuracy of the pooled held-out predictions (chance level: 0.5).
+
+Its significance is a permutation test: the phase labels are shuffled within
+each violinist, which keeps how many takes of each phase every violinist
+played, and the whole cross-validation is rerun. The principal components do
+not depend on the labels, so a fold is fitted once for a whole chunk of
+permutations, classified at once. (fold, chunk) tasks run in parallel on the
+LTAS matrix, loaded once into shared memory that the workers attach to.
+"""
+
+import argparse
+import os
+import pathlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import loaders
+import profiling
+from ratings_stats import holm
+
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/recordings.nc")
+OUTPUT_PATH = pathlib.Path("reports/phase_discrimination.csv")
+
+VIOLINS = ["klimke", "levaggi", "stoppani"]
+# Frequency range of the LTAS, as recordings.py
+BAND = (200, 5000)
+N_COMPONENTS = 10
+# Weight of the scaled identity in the within-class covariance
+SHRINKAGE = 0.2
+CHUNK_SIZE = 1000
+
+# LTAS matrix of a worker, attached to the shared memory block
+_memory: Optional[shared_memory.SharedMemory] = None
+_features: Optional[np.ndarray] = None
+
+
+# --- 1. Data ---
+
+
+def load_features(dataset_path: pathlib.Path) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Normalised LTAS of every take.
+
+    Returns:
+        Tuple of (features, takes): features has shape (take, frequency), in
+        dB, takes holds the violin, violinist and phase of every take.
+    """
+    ds = loaders.recordings(dataset_path).sel(frequency=slice(*BAND))
+    lin = 10 ** (ds["features"].values.astype(np.float64) / 20)
+    features = 20 * np.log10(lin / lin.mean(axis=1, keepdims=True))
+    takes = pd.DataFrame(
+        {name: ds[name].values for name in ["violin", "violinist", "phase"]}
+    )
+    return features, takes
+
+
+def folds(groups: np.ndarray, labels: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Leave-one-group-out splits.
+
+    Returns:
+        List of (train, test) positions. Splits whose training set lacks a
+        class are left out, with a warning.
+    """
+    splits = []
+    for group in np.unique(groups):
+        train, test = np.flatnonzero(groups != group), np.flatnonzero(groups == group)
+        if len(np.unique(labels[train])) < 2:
+            warnings.warn(f"Without {group}, a single phase is left: fold skipped")
+            continue
+        splits.append((train, test))
+    return splits
+
+
+def permutations(
+    labels: np.ndarray, groups: np.ndarray, n_permutations: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Labels shuffled within each group.
+
+    Returns:
+        (1 + n_permutations, take) array, the first row being the labels.
+    """
+    permuted = np.tile(labels, (n_permutations + 1, 1))
+    for group in np.unique(groups):
+        positions = np.flatnonzero(groups == group)
+        permuted[1:, positions] = rng.permuted(permuted[1:, positions], axis=1)
+    return permuted
+
+
+# --- 2. Classifier ---
+
+
+def components(X: np.ndarray, n_components: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Standardisation and principal axes of a training set.
+
+    Returns:
+        Tuple of (mean, scale, basis), basis having shape (feature, component).
+    """
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1
+    _, _, vt = np.linalg.svd((X - mean) / scale, full_matrices=False)
+    return mean, scale, vt[: min(n_components, len(X) - 2)].T
+
+
+def lda_predict(Z: np.ndarray, labels: np.ndarray, Z_test: np.ndarray) -> np.ndarray:
+    """
+    Shrinkage LDA with equal priors, for many labellings of a training set.
+
+    Args:
+        Z: (take, component) training set, centred.
+        labels: (labelling, take) boolean classes of the training set.
+        Z_test: (take, component) test set.
+
+    Returns:
+        (labelling, test take) boolean predictions.
+    """
+    n, k = Z.shape
+    Y = labels.astype(np.float64)
+    n1 = Y.sum(axis=1)[:, None]
+    sum1 = Y @ Z
+    mean1 = sum1 / n1
+    mean0 = (Z.sum(axis=0) - sum1) / (n - n1)
+
+    # Pooled within-class covariance of every labelling
+    scatter = Z.T @ Z
+    within = (
+        scatter
+        - n1[..., None] * np.einsum("pi,pj->pij", mean1, mean1)
+        - (n - n1)[..., None] * np.einsum("pi,pj->pij", mean0, mean0)
+    ) / (n - 2)
+    trace = np.trace(within, axis1=1, axis2=2)[:, None, None]
+    within = (1 - SHRINKAGE) * within + SHRINKAGE * trace / k * np.eye(k)
+
+    w = np.linalg.solve(within, (mean1 - mean0)[..., None])[..., 0]
+    threshold = np.sum(w * (mean1 + mean0) / 2, axis=1)
+    return (Z_test @ w.T).T > threshold[:, None]
+
+
+def balanced_accuracy(labels: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """Mean recall of both classes, along the last axis."""
+    recall1 = np.sum(labels & predictions, axis=-1) / np.sum(labels, axis=-1)
+    recall0 = np.sum(~labels & ~predictions, axis=-1) / np.sum(~labels, axis=-1)
+    return (recall1 + recall0) / 2
+
+
+# --- 3. Parallel evaluation ---
+
+
+def _attach(name: str, shape: Tuple[int, ...], dtype: str):
+    """Worker initializer: map the shared LTAS matrix."""
+    global _memory, _features
+    _memory = shared_memory.SharedMemory(name=name)
+    _features = np.ndarray(shape, dtype=dtype, buffer=_memory.buf)
+
+
+def _fold_chunk(
+    train: np.ndarray, test: np.ndarray, labels: np.ndarray, n_components: int
+) -> np.ndarray:
+    """
+    Predictions of one fold for a chunk of labellings.
+
+    Args:
+        train, test: Rows of the shared LTAS matrix.
+        labels: (labelling, train take) boolean classes.
+    """
+    mean, scale, basis = components(_features[train], n_components)
+    Z = (_features[train] - mean) / scale @ basis
+    Z_test = (_features[test] - mean) / scale @ basis
+    return lda_predict(Z, labels, Z_test)
+
+
+def discriminability(
+    features: np.ndarray,
+    takes: pd.DataFrame,
+    n_permutations: int = 10_000,
+    n_components: int = N_COMPONENTS,
+    n_jobs: Optional[int] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Cross-validated phase discriminability of every violin.
+
+    Returns:
+        DataFrame with one row per violin: balanced accuracy, mean and 95th
+        percentile of its permutation distribution, permutation p-value and
+        its Holm correction across violins.
+    """
+    rng = np.random.default_rng(seed)
+    memory = shared_memory.SharedMemory(create=True, size=features.nbytes)
+    try:
+        shared = np.ndarray(features.shape, dtype=features.dtype, buffer=memory.buf)
+        shared[:] = features
+        # The block cannot be closed while a view of it is alive
+        del shared
+
+        # --- Tasks: every fold of every violin, by chunk of labellings ---
+        jobs = {}
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_attach,
+            initargs=(memory.name, features.shape, features.dtype.str),
+        ) as executor:
+            for violin in VIOLINS:
+                rows = np.flatnonzero(takes["violin"] == violin)
+                groups = takes["violinist"].to_numpy()[rows]
+                labels = takes["phase"].to_numpy()[rows] == 2
+                permuted = permutations(labels, groups, n_permutations, rng)
+                splits = folds(groups, labels)
+                futures = []
+                for train, test in splits:
+                    for start in range(0, len(permuted), CHUNK_SIZE):
+                        future = executor.submit(
+                            _fold_chunk,
+                            rows[train],
+                            rows[test],
+                            permuted[start : start + CHUNK_SIZE, train],
+                            n_components,
+                        )
+                        futures.append((test, start, future))
+                jobs[violin] = (groups, permuted, splits, futures)
+
+            # --- Pooled held-out predictions of every labelling ---
+            records = []
+            for violin, (groups, permuted, splits, futures) in jobs.items():
+                predictions = np.zeros_like(permuted)
+                tested = np.zeros(permuted.shape[1], dtype=bool)
+                for test, start, future in futures:
+                    predictions[start : start + CHUNK_SIZE, test] = future.result()
+                    tested[test] = True
+                scores = balanced_accuracy(permuted[:, tested], predictions[:, tested])
+                observed, null = scores[0], scores[1:]
+                records.append(
+                    {
+                        "violin": violin,
+                        "n_takes": len(groups),
+                        "n_violinists": len(np.unique(groups)),
+                        "n_folds": len(splits),
+                        "balanced_accuracy": observed,
+                        "null_mean": null.mean() if len(null) else np.nan,
+                        "null_95": np.quantile(null, 0.95) if len(null) else np.nan,
+                        "p_perm": (np.sum(null >= observed - 1e-12) + 1) / (len(null) + 1),
+                    }
+                )
+    finally:
+        memory.close()
+        memory.unlink()
+
+    results = pd.DataFrame(records)
+    results["p_holm"] = holm(results["p_perm"].to_numpy())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cross-validated phase discriminability of the recordings."
+    )
+    parser.add_argument("--permutations", type=int, default=10_000)
+    parser.add_argument("--components", type=int, default=N_COMPONENTS)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, default=OUTPUT_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    with profiling.stage("load"):
+        features, takes = load_features(PROCESSED_DATA_PATH)
+    with profiling.stage("cross-validation"):
+        results = discriminability(
+            features, takes, args.permutations, args.components, args.jobs, args.seed
+        )
+    print(results.round(4).to_string(index=False))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
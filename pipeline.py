@@ -0,0 +1,469 @@
+"""
+Pipeline runner: raw data -> processed datasets -> figures and reports.
+
+Every stage is one entry point of the repository run with fixed arguments, and
+declares the files it reads (inputs, and optional inputs that may not exist)
+and writes. A stage depends on the stages whose
+outputs match its inputs. A stage is stale when its outputs are missing or when
+the content hash of its inputs, of its code (the script and the repository
+modules it imports) or of its arguments changed since its last successful run.
+
+Stale stages run in a process pool as soon as their upstream stages are done,
+so independent branches are rebuilt concurrently and a new measurement only
+rebuilds its own branch. Stages whose raw inputs are not on this machine keep
+their existing outputs.
+"""
+
+import argparse
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import pathlib
+import runpy
+import sys
+import traceback
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Set
+
+import profiling
+from hashing import expand, file_hash
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent
+STATE_PATH = pathlib.Path(".pipeline.json")
+
+STAGES = {
+    # --- Admittances ---
+    "admittances": {
+        "script": "admittances.py",
+        "args": ["--process"],
+        "inputs": ["data/raw/phase_*/*/admittances/*.mat"],
+        "outputs": ["data/processed/admittances.nc"],
+    },
+    "admittances-figure": {
+        "script": "admittances.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/admittances.nc"],
+        "outputs": ["reports/figures/admittances.png", "reports/figures/admittances.svg"],
+    },
+    # --- Recordings ---
+    "recordings": {
+        "script": "recordings.py",
+        "args": ["--process"],
+        "inputs": ["/home/hugo/Thèse/identification/data/processed/dataset_cnsm.pkl"],
+        "outputs": ["data/processed/recordings.nc"],
+    },
+    "recordings-export": {
+        "script": "recordings.py",
+        "args": ["--export"],
+        "inputs": ["/home/hugo/Thèse/identification/data/processed/dataset_cnsm.pkl"],
+        "outputs": [
+            f"data/raw/phase_{phase}/{violin}/recordings"
+            for phase in (1, 2)
+            for violin in ("klimke", "levaggi", "stoppani")
+        ],
+    },
+    "recordings-figure": {
+        "script": "recordings.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/recordings.nc"],
+        "outputs": ["reports/figures/recordings.png", "reports/figures/recordings.svg"],
+    },
+    "notes": {
+        "script": "notes.py",
+        "args": ["--process"],
+        "inputs": ["data/raw/phase_*/*/recordings/*.flac", "data/processed/recordings.nc"],
+        "outputs": ["data/processed/notes.nc"],
+    },
+    "notes-figure": {
+        "script": "notes.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/notes.nc"],
+        "outputs": ["reports/figures/notes.png", "reports/figures/notes.svg"],
+    },
+    "phase-discrimination": {
+        "script": "phase_discrimination.py",
+        "args": [],
+        "inputs": ["data/processed/recordings.nc"],
+        "outputs": ["reports/phase_discrimination.csv"],
+    },
+    "stimuli": {
+        "script": "stimuli.py",
+        "args": [],
+        "inputs": [
+            "data/raw/test.json",
+            "data/raw/phase_*/*/recordings/*.flac",
+            "data/processed/recordings.nc",
+        ],
+        "outputs": ["data/processed/stimuli"],
+    },
+    # --- Motion capture ---
+    "mocap": {
+        "script": "mocap.py",
+        "args": ["--process"],
+        "inputs": ["data/raw/mocap/phase_*/*/*/*.csv"],
+        "outputs": ["data/processed/mocap.nc"],
+    },
+    "mocap-figure": {
+        "script": "mocap.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/mocap.nc"],
+        "outputs": ["reports/figures/mocap_beta.png", "reports/figures/mocap_beta.svg"],
+    },
+    # --- Ratings ---
+    "ratings": {
+        "script": "ratings_data.py",
+        "args": ["--process"],
+        "inputs": ["data/raw/ratings/*.csv"],
+        "outputs": ["data/processed/ratings.parquet"],
+    },
+    "ratings-figure": {
+        "script": "ratings.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/ratings.parquet"],
+        "outputs": ["reports/figures/ratings.png", "reports/figures/ratings.svg"],
+    },
+    "ratings-2-figure": {
+        "script": "ratings2.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/ratings.parquet"],
+        "outputs": ["reports/figures/ratings-2.png", "reports/figures/ratings-2.svg"],
+    },
+    "ratings-variability-figure": {
+        "script": "ratings-variability.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/ratings.parquet"],
+        "outputs": [
+            "reports/figures/ratings-variability.png",
+            "reports/figures/ratings-variability.svg",
+        ],
+    },
+    "ratings-tests": {
+        "script": "ratings_stats.py",
+        "args": [],
+        "inputs": ["data/processed/ratings.parquet"],
+        "outputs": ["reports/ratings_tests.csv"],
+    },
+    "ratings-clmm": {
+        "script": "ratings_clmm.py",
+        "args": [],
+        "inputs": ["data/processed/ratings.parquet"],
+        "outputs": ["reports/ratings_clmm.csv"],
+    },
+    # --- Listening test ---
+    "listening-test": {
+        "script": "listening_test.py",
+        "args": [],
+        "inputs": ["data/raw/listening_test/*.json"],
+        "outputs": ["data/processed/listening_test.parquet"],
+    },
+    "listening-test-figure": {
+        "script": "test.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/listening_test.parquet"],
+        "outputs": ["reports/figures/tests.png", "reports/figures/tests.svg"],
+    },
+    "listening-mds": {
+        "script": "listening_mds.py",
+        "args": ["--process"],
+        "inputs": ["data/raw/listening_test/*.json"],
+        "outputs": ["data/processed/listening_mds.nc"],
+    },
+    "listening-mds-figure": {
+        "script": "listening_mds.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/listening_mds.nc"],
+        "outputs": ["reports/figures/listening-mds.png", "reports/figures/listening-mds.svg"],
+    },
+    # --- Admittance vs radiated sound ---
+    "crossmodal": {
+        "script": "crossmodal.py",
+        "args": ["--process"],
+        "inputs": ["data/processed/admittances.nc", "data/processed/recordings.nc"],
+        "outputs": ["data/processed/crossmodal.nc", "reports/crossmodal.csv"],
+    },
+    "crossmodal-figure": {
+        "script": "crossmodal.py",
+        "args": ["--plot"],
+        "inputs": ["data/processed/crossmodal.nc"],
+        "outputs": ["reports/figures/crossmodal.png", "reports/figures/crossmodal.svg"],
+    },
+    # --- Consolidated store ---
+    "store": {
+        "script": "store.py",
+        "args": ["--process"],
+        "inputs": [],
+        # Stored when available
+        "optional": [
+            "data/processed/admittances.nc",
+            "data/processed/recordings.nc",
+            "data/processed/mocap.nc",
+            "data/processed/ratings.parquet",
+            "data/processed/listening_test.parquet",
+        ],
+        "outputs": ["data/processed/store.nc"],
+    },
+}
+
+
+# --- 1. Graph ---
+
+
+def _produces(output: str, pattern: str) -> bool:
+    """Whether an output path satisfies an input pattern (or contains it)."""
+    # Leading components of the pattern, as deep as the output (a directory
+    # holding some of the matched files)
+    parts = pattern.rstrip("/").split("/")
+    depth = output.rstrip("/").count("/") + 1
+    return (
+        fnmatch.fnmatch(output, pattern)
+        or pattern.startswith(output.rstrip("/") + "/")
+        or output.startswith(pattern.rstrip("/") + "/")
+        or (len(parts) > depth and fnmatch.fnmatch(output.rstrip("/"), "/".join(parts[:depth])))
+    )
+
+
+def dependencies(stages: Dict = STAGES) -> Dict[str, Set[str]]:
+    """
+    Upstream stages of every stage.
+
+    Raises:
+        ValueError: If two stages write the same output, or on a cycle.
+    """
+    producers = {}
+    for name, stage in stages.items():
+        for output in stage["outputs"]:
+            if output in producers:
+                raise ValueError(f"{output} is written by {producers[output]} and {name}")
+            producers[output] = name
+
+    upstream = {
+        name: {
+            producers[output]
+            for pattern in stage["inputs"] + stage.get("optional", [])
+            for output in producers
+            if _produces(output, pattern) and producers[output] != name
+        }
+        for name, stage in stages.items()
+    }
+
+    # Cycle check (depth-first)
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through {name}")
+        if name not in visited:
+            visiting.add(name)
+            for u in upstream[name]:
+                visit(u)
+            visiting.remove(name)
+            visited.add(name)
+
+    for name in stages:
+        visit(name)
+    return upstream
+
+
+def select(targets: List[str], upstream: Dict[str, Set[str]]) -> Set[str]:
+    """Targets and everything they depend on (all stages if no target)."""
+    if not targets:
+        return set(upstream)
+    unknown = set(targets) - set(upstream)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo += upstream[name]
+    return selected
+
+
+# --- 2. Hashing ---
+
+
+def code_files(script: str) -> List[pathlib.Path]:
+    """The script and the repository modules it imports, recursively."""
+    found, todo = set(), [REPO_DIR / script]
+    while todo:
+        path = todo.pop()
+        if path in found or not path.exists():
+            continue
+        found.add(path)
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            todo += [REPO_DIR / f"{name.split('.')[0]}.py" for name in names]
+    return sorted(found)
+
+
+def stage_key(stage: Dict, cache: Dict) -> Optional[str]:
+    """
+    Content hash of a stage's inputs, code and arguments.
+
+    Returns:
+        None when an input pattern matches no file.
+    """
+    digest = hashlib.sha1(json.dumps([stage["script"], stage["args"]]).encode())
+    for pattern in stage["inputs"] + stage.get("optional", []):
+        files = expand(pattern)
+        if not files and pattern in stage["inputs"]:
+            return None
+        for path in files:
+            digest.update(f"{path}:{file_hash(path, cache)}".encode())
+    for path in code_files(stage["script"]):
+        digest.update(f"{path.name}:{file_hash(path, cache)}".encode())
+    return digest.hexdigest()
+
+
+# --- 3. Running ---
+
+
+def run_stage(script: str, args: List[str]):
+    """Run a script's entry point, as `python script args`."""
+    sys.argv = [script] + args
+    try:
+        runpy.run_path(str(REPO_DIR / script), run_name="__main__")
+    except SystemExit as e:
+        if e.code:
+            raise RuntimeError(f"{script} exited with {e.code}")
+    except Exception:
+        # Keep the traceback of the worker
+        raise RuntimeError(traceback.format_exc())
+    finally:
+        # Workers exit without running atexit handlers
+        profiling.finish()
+
+
+def load_state(path: pathlib.Path = STATE_PATH) -> Dict:
+    if path.exists():
+        with open(path, "r") as file:
+            return json.load(file)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state: Dict, path: pathlib.Path = STATE_PATH):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def run(
+    targets: List[str] = [],
+    n_jobs: Optional[int] = None,
+    force: bool = False,
+    dry_run: bool = False,
+    stages: Dict = STAGES,
+) -> Dict[str, str]:
+    """
+    Bring the selected stages up to date.
+
+    Args:
+        targets: Stages to update with their upstream stages, all if empty.
+        n_jobs: Number of worker processes.
+        force: Run every selected stage.
+        dry_run: Only report what would run.
+        stages: Stage declarations.
+
+    Returns:
+        Status of every selected stage: fresh, done, failed, stale (dry run),
+        missing (inputs absent, outputs kept), unavailable (inputs and outputs
+        absent) or skipped (upstream failed or unavailable).
+    """
+    upstream = dependencies(stages)
+    # Upstream stages of the required inputs, the others may fail
+    required = {
+        name: {
+            u
+            for u in upstream[name]
+            if any(_produces(o, p) for o in stages[u]["outputs"] for p in stages[name]["inputs"])
+        }
+        for name in stages
+    }
+    pending = select(targets, upstream)
+    state = load_state()
+    status, running = {}, {}
+
+    with ProcessPoolExecutor(max_workers=n_jobs, max_tasks_per_child=1) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                if not upstream[name] <= status.keys():
+                    continue
+                pending.remove(name)
+                stage = stages[name]
+                if any(status[u] in ("failed", "skipped", "unavailable") for u in required[name]):
+                    status[name] = "skipped"
+                    continue
+                if dry_run and any(status[u] == "stale" for u in upstream[name]):
+                    status[name] = "stale"
+                    continue
+
+                key = stage_key(stage, state["files"])
+                outputs_exist = all(pathlib.Path(o).exists() for o in stage["outputs"])
+                if key is None:
+                    if outputs_exist:
+                        status[name] = "missing"
+                    else:
+                        warnings.warn(f"{name}: no inputs and no outputs, skipped")
+                        status[name] = "unavailable"
+                elif not force and outputs_exist and state["stages"].get(name) == key:
+                    status[name] = "fresh"
+                elif dry_run:
+                    status[name] = "stale"
+                else:
+                    print(f"[{name}] running {stage['script']} {' '.join(stage['args'])}")
+                    future = executor.submit(run_stage, stage["script"], stage["args"])
+                    running[future] = (name, key)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key = running.pop(future)
+                if future.exception() is None:
+                    status[name] = "done"
+                    state["stages"][name] = key
+                else:
+                    status[name] = "failed"
+                    state["stages"].pop(name, None)
+                    print(f"[{name}] failed:\n{future.exception()}")
+                save_state(state)
+
+    save_state(state)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild stale datasets and figures.")
+    parser.add_argument("targets", nargs="*", help="Stages to update (default: all)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="Run every selected stage")
+    parser.add_argument("--dry-run", action="store_true", help="Only list stale stages")
+    parser.add_argument("--list", action="store_true", help="List stages and dependencies")
+
+    args = parser.parse_args()
+
+    if args.list:
+        for name, deps in dependencies().items():
+            print(f"{name}: {', '.join(sorted(deps)) or '-'}")
+        return
+
+    status = run(args.targets, args.jobs, args.force, args.dry_run)
+    for name in STAGES:
+        if name in status:
+            print(f"{name:28} {status[name]}")
+    if "failed" in status.values():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
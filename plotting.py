@@ -0,0 +1,198 @@
+"""
+Plotting layer, imported lazily by the plot functions.
+
+Processing entry points never import matplotlib or seaborn: plot functions call
+`pyplot()`, which configures matplotlib on first use:
+
+- a headless backend (Agg), unless MPLBACKEND is set
+- the repository styles, resolved relative to this file, then any extra style
+  listed in the PLAYING_IN_MPLSTYLE environment variable (os.pathsep-separated)
+- the figure size of config.py
+
+Dense figures cost their size rather than their data length. Lines with more
+points than pixel columns are reduced to the first, lowest, highest and last
+point of every pixel column (M4 decimation, identical once rasterised):
+
+- `decimate(fig, x, *ys)` reduces the arrays before they are handed to
+  ax.plot / fill_between, for the figures that compute their own statistics
+  (mocap.py);
+- `lean(fig)`, just before saving, rewrites the artists already drawn. Seaborn
+  figures (admittances.py, recordings.py) need it: their estimator and CI are
+  computed by lineplot from every row, so the data cannot be reduced before the
+  call, only the aggregated lines after it. It also rasterises the filled
+  bands (confidence intervals) inside the otherwise vector SVG.
+
+Set PLAYING_IN_FULL_RESOLUTION=1 to draw every point.
+"""
+
+import os
+import pathlib
+from typing import Tuple
+
+import numpy as np
+
+from config import HEIGHT, WIDTH
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent
+STYLES = [REPO_DIR / "acta-acustica.mplstyle"]
+EXTRA_STYLES_ENV = "PLAYING_IN_MPLSTYLE"
+BACKEND = "Agg"
+FULL_RESOLUTION_ENV = "PLAYING_IN_FULL_RESOLUTION"
+
+_configured = False
+
+
+def setup():
+    """
+    Configure matplotlib once: backend, styles and figure size.
+    """
+    global _configured
+    if _configured:
+        return
+
+    import matplotlib as mpl
+    import matplotlib.style
+
+    if "MPLBACKEND" not in os.environ:
+        mpl.use(BACKEND)
+
+    extra = [p for p in os.environ.get(EXTRA_STYLES_ENV, "").split(os.pathsep) if p]
+    mpl.style.use([str(p) for p in STYLES] + extra)
+    mpl.rcParams["figure.figsize"] = (WIDTH, HEIGHT)
+    _configured = True
+
+
+def pyplot():
+    """
+    Configured matplotlib.pyplot.
+    """
+    setup()
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def m4_indices(columns: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Vertices of a path to keep so that it is drawn identically at this resolution.
+
+    The path is split into runs going left or right (a filled band goes right
+    along one edge and back along the other), and every pixel column of a run
+    keeps its first, last, lowest and highest vertex.
+
+    Args:
+        columns: Pixel column of every vertex.
+        y: Values of the vertices, NaN for gaps.
+
+    Returns:
+        Sorted indices of the vertices to keep, every NaN included.
+    """
+    # Direction of every step, steps within a column following the previous one
+    step = np.sign(np.diff(columns))
+    moving = np.maximum.accumulate(np.where(step != 0, np.arange(len(step)), 0))
+    step = step[moving]
+    run = np.r_[0, np.cumsum(step[1:] != step[:-1]), 0]
+    run[-1] = run[-2]
+    # Runs going left become non-decreasing
+    key = columns * np.r_[np.where(step < 0, -1, 1), 1]
+
+    # Groups of consecutive vertices in the same run and column
+    starts = np.flatnonzero(np.r_[True, (run[1:] != run[:-1]) | (key[1:] != key[:-1])])
+    ends = np.r_[starts[1:], len(y)] - 1
+    sizes = ends - starts + 1
+    group = np.repeat(np.arange(len(starts)), sizes)
+
+    keep = np.isnan(y)
+    keep[starts] = keep[ends] = True
+    # First lowest and first highest finite value of every group
+    for ufunc, fill in [(np.minimum, np.inf), (np.maximum, -np.inf)]:
+        filled = np.where(np.isnan(y), fill, y)
+        extreme = np.flatnonzero(filled == np.repeat(ufunc.reduceat(filled, starts), sizes))
+        first = np.r_[True, group[extreme][1:] != group[extreme][:-1]]
+        keep[extreme[first]] = True
+    return np.flatnonzero(keep)
+
+
+def decimate(fig, x: np.ndarray, *ys: np.ndarray, log: bool = False) -> Tuple[np.ndarray, ...]:
+    """
+    Reduce lines sharing an x axis to the points drawn at the figure's resolution.
+
+    Every y is M4-decimated over as many columns as the figure is wide at
+    savefig.dpi, at least as many as its axes span, and all are kept at the
+    union of their indices so that a mean and its CI edges stay aligned.
+
+    Args:
+        fig: Figure the lines are drawn into.
+        x: Finite x values spanning the axes (its view limits).
+        ys: Values over x, NaN for gaps.
+        log: The x axis is logarithmic.
+
+    Returns:
+        Tuple of (x, *ys), unchanged when there are at most 4 points per column
+        or PLAYING_IN_FULL_RESOLUTION is set.
+    """
+    import matplotlib as mpl
+
+    dpi = mpl.rcParams["savefig.dpi"]
+    width = fig.get_figwidth() * (fig.dpi if dpi == "figure" else dpi)
+    x = np.asarray(x, dtype=float)
+    if os.environ.get(FULL_RESOLUTION_ENV) or len(x) <= 4 * width:
+        return (x, *ys)
+    u = np.log10(x) if log else x
+    columns = np.floor((u - u.min()) / (u.max() - u.min()) * width)
+    keep = np.unique(
+        np.concatenate([m4_indices(columns, np.asarray(y, dtype=float)) for y in ys])
+    )
+    return (x[keep], *(np.asarray(y)[keep] for y in ys))
+
+
+def _columns(ax, xy: np.ndarray, scale: float) -> np.ndarray:
+    return np.floor(ax.transData.transform(xy)[:, 0] * scale)
+
+
+def lean(fig, dpi: float = None):
+    """
+    Decimate the dense lines and bands of a figure and rasterise the bands.
+
+    Call after the layout is final (tight_layout), just before saving. Lines
+    already reduced by `decimate` are left as they are.
+
+    Args:
+        fig: Figure to modify in place.
+        dpi: Resolution of the output, defaults to savefig.dpi.
+    """
+    if os.environ.get(FULL_RESOLUTION_ENV):
+        return
+    import matplotlib as mpl
+    from matplotlib.collections import PolyCollection
+
+    if dpi is None:
+        dpi = mpl.rcParams["savefig.dpi"]
+    scale = (fig.dpi if dpi == "figure" else dpi) / fig.dpi
+
+    for ax in fig.axes:
+        # Beyond 4 points per pixel column
+        budget = 4 * ax.bbox.width * scale
+
+        for line in ax.lines:
+            xy = np.column_stack([np.asarray(v, dtype=float) for v in line.get_data()])
+            if len(xy) > budget and np.isfinite(xy[:, 0]).all():
+                keep = m4_indices(_columns(ax, xy, scale), xy[:, 1])
+                line.set_data(xy[keep, 0], xy[keep, 1])
+
+        for collection in ax.collections:
+            if not isinstance(collection, PolyCollection):
+                continue
+            paths = collection.get_paths()
+            if any(len(p.vertices) > 2 * budget for p in paths):
+                # Closed polygons, the closing vertex is added back by set_verts
+                verts = [p.vertices[:-1] for p in paths]
+                collection.set_verts(
+                    [
+                        xy[m4_indices(_columns(ax, xy, scale), xy[:, 1])]
+                        if len(xy) > 2 * budget
+                        else xy
+                        for xy in verts
+                    ]
+                )
+            collection.set_rasterized(True)
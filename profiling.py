@@ -0,0 +1,148 @@
+"""
+Stage instrumentation of the entry points.
+
+The `main()` of every script wraps its steps in `stage(name)` blocks, which can
+be nested and carry the file they work on. When profiling is enabled, with the
+--profile DIR option or the PLAYING_IN_PROFILE environment variable, every
+stage records:
+
+- wall time and CPU time of the process (worker pools count as wall time only)
+- peak traced memory (tracemalloc, numpy buffers included) and maximum RSS
+
+and at exit the script writes to DIR:
+
+- <script>-<time>.json and .csv: one record per stage (and per file)
+- <script>-<time>.folded: self wall time per stack in microseconds, for
+  flamegraph.pl, speedscope or inferno
+
+When profiling is off, `stage` does nothing but enter and leave the block.
+"""
+
+import atexit
+import contextlib
+import csv
+import json
+import os
+import pathlib
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+ENV = "PLAYING_IN_PROFILE"
+
+_profile = None
+
+
+class Profile:
+    def __init__(self, output_dir: pathlib.Path, name: str):
+        self.output_dir = output_dir
+        self.name = name
+        self.records: List[Dict] = []
+        # Open stages: [name, wall start, cpu start, peak of closed children, wall of children]
+        self.stack: List[List] = []
+
+    def enter(self, name: str):
+        if self.stack:
+            # Keep the parent's peak before measuring the child's own
+            self.stack[-1][3] = max(self.stack[-1][3], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), time.process_time(), 0, 0.0])
+
+    def exit(self, file: Optional[str], fields: Dict):
+        name, wall_start, cpu_start, child_peak, child_wall = self.stack.pop()
+        wall = time.perf_counter() - wall_start
+        peak = max(child_peak, tracemalloc.get_traced_memory()[1])
+        if self.stack:
+            self.stack[-1][3] = max(self.stack[-1][3], peak)
+            self.stack[-1][4] += wall
+        self.records.append(
+            {
+                "stack": ";".join([self.name] + [s[0] for s in self.stack] + [name]),
+                "stage": name,
+                "file": file,
+                **fields,
+                "wall_s": wall,
+                "self_s": wall - child_wall,
+                "cpu_s": time.process_time() - cpu_start,
+                "peak_mb": peak / 1e6,
+                # kilobytes on Linux
+                "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3,
+            }
+        )
+
+    def write(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.output_dir / f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+        with open(stem.with_suffix(".json"), "w") as file:
+            json.dump({"script": self.name, "argv": sys.argv, "stages": self.records}, file, indent=1)
+
+        columns = list(dict.fromkeys(k for r in self.records for k in r))
+        with open(stem.with_suffix(".csv"), "w", newline="") as file:
+            writer = csv.DictWriter(file, columns)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+        folded = defaultdict(float)
+        for record in self.records:
+            folded[record["stack"]] += record["self_s"]
+        with open(stem.with_suffix(".folded"), "w") as file:
+            for stack, seconds in folded.items():
+                file.write(f"{stack} {round(seconds * 1e6)}\n")
+        print(f"Profile saved to {stem}.json/.csv/.folded")
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "--profile",
+        type=pathlib.Path,
+        metavar="DIR",
+        help=f"Write a time and memory profile of every stage to DIR (or set {ENV})",
+    )
+
+
+def enable(output_dir: Optional[pathlib.Path] = None, name: Optional[str] = None):
+    """
+    Start profiling if an output directory is given or set in the environment.
+
+    Args:
+        output_dir: Directory of the reports, defaults to $PLAYING_IN_PROFILE.
+        name: Name of the reports, defaults to the script name.
+    """
+    global _profile
+    output_dir = output_dir or os.environ.get(ENV)
+    if not output_dir or _profile is not None:
+        return
+    _profile = Profile(pathlib.Path(output_dir), name or pathlib.Path(sys.argv[0]).stem)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    atexit.register(finish)
+
+
+def finish():
+    """
+    Write the reports and stop profiling (at exit, or when a worker is done).
+    """
+    global _profile
+    if _profile is not None:
+        _profile.write()
+        _profile = None
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name: str, file=None, **fields):
+    """
+    Record a named stage (optionally the file it processes) when profiling.
+    """
+    if _profile is None:
+        yield
+        return
+    _profile.enter(name)
+    try:
+        yield
+    finally:
+        _profile.exit(None if file is None else str(file), fields)
@@ -3,21 +3,19 @@ import pathlib
 import warnings
 from typing import Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import xarray as xr
-import pandas as pd
-import seaborn as sns
 
-from config import mm, colors, ci, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import plotting
+import profiling
+from config import mm, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import ratings_data
+from ratings_cube import PROCESSED_DATA_PATH, dodge, draw_points, load_cube, summary
+from ratings_noise import N_RESAMPLES, noise_floor
 
-VIOLINS = ["klimke", "levaggi", "stoppani"]
+VIOLINS = ["Klimke", "Levaggi", "Stoppani"]
 SCOPES = ["control", "test"]
 CRITERION = ["P", "F", "T"]
 
-PROCESSED_DATA_PATH = pathlib.Path("data/processed/ratings.csv")
-
 colors = {
     1: "#9EcAE1",
     2: "#4292C6",
@@ -38,33 +36,28 @@ colors = [
 ]
 
 
-def plot(dataset_path: pathlib.Path):
-    # --- 1. Load Data (Pandas) ---
-    df = pd.read_csv(dataset_path)
+def plot(dataset_path: pathlib.Path, n_resamples: int = N_RESAMPLES):
+    plt = plotting.pyplot()
+    import matplotlib as mpl
 
-    # --- 2. Compute difference ---
-    pivoted = df.pivot_table(
-        index=["scope", "violin", "player", "criterion"],
-        columns="session",
-        values="rating",
-        aggfunc="mean",  # Handles duplicate ratings if any
-    )
-    pivoted["2-1"] = pivoted[2] - pivoted[1]
-    pivoted["3-1"] = pivoted[3] - pivoted[1]
-    df_flat = pivoted[["2-1", "3-1"]].reset_index()
-    df_flat = df_flat.dropna(subset=["2-1", "3-1"])
-    df_diff = df_flat.melt(
-        id_vars=["scope", "violin", "player", "criterion"],  # Identifiers to keep
-        value_vars=["2-1", "3-1"],  # Columns to unpivot
-        var_name="difference_type",  # Name for the new categorical column
-        value_name="difference",  # Name for the new value column
-    )
-    df_diff["difference_abs"] = np.abs(df_diff["difference"])
+    # --- 1. Load Data (ratings cube) ---
+    cube = load_cube(dataset_path)
+    floor = noise_floor(cube, n_resamples)
+
+    # --- 2. Select differences ---
+    # Keep players who have both a 2-1 and a 3-1 difference
+    diff = cube["diff"].sel(difference="2-1")
+    diff = diff.where(cube["diff"].sel(difference="3-1").notnull())
+    valid = diff.notnull().any(["violin", "criterion"])
 
-    control_players = sorted(df_diff[df_diff["scope"] == "control"]["player"].unique())
-    test_players = df_diff[df_diff["scope"] == "test"]["player"].unique()
+    control_players = sorted(cube["player"].where(valid.sel(scope="control"), drop=True).values)
+    test_players = list(cube["player"].where(valid.sel(scope="test"), drop=True).values)
     player_order = list(control_players) + list(test_players)
 
+    # One scope per player: collapse the scope dimension
+    diff_by_player = diff.mean("scope").sel(player=player_order)
+    abs_stats = summary(np.abs(diff), ["scope", "player", "violin"])
+
     # --- 3. Plotting ---
     fig, axes = plt.subplots(
         nrows=len(CRITERION),
@@ -74,50 +67,32 @@ def plot(dataset_path: pathlib.Path):
         width_ratios=[len(player_order), 1],
     )
 
+    x = np.arange(len(player_order))
+
     # A. Main Grid (Violin vs Violinist)
     for i, criterion in enumerate(CRITERION):
         ax = axes[i, 0]
 
-        # Filter data for this specific cell
-        subset = df_diff[
-            (df_diff["criterion"] == criterion) & (df_diff["difference_type"] == "2-1")
-        ]
-
-        # Stripplot
-        sns.pointplot(
-            data=subset,
-            x="player",
-            y="difference",
-            hue="violin",
-            order=player_order,
-            # alpha=0.2,
-            palette=colors[::2],
-            # order=["control", "test"],
-            hue_order=["Klimke", "Levaggi", "Stoppani"],
-            # legend=False,
-            ax=ax,
-            dodge=0.3,
-            linestyle="none",
+        # Test-retest noise floor of the control group
+        low, high = floor["band"].sel(criterion=criterion).to_numpy()
+        ax.axhspan(low, high, color="gray", alpha=0.1, linewidth=0, label="Noise floor")
+        axes[i, 1].axhspan(
+            0, floor["abs_band"].sel(criterion=criterion), color="gray", alpha=0.1, linewidth=0
         )
 
-        sns.pointplot(
-            data=subset,
-            # x="violin",
-            y="difference_abs",
-            # hue="violin",
-            # order=player_order,
-            # alpha=0.2,
-            palette=colors[::2],
-            # order=["control", "test"],
-            # order=["Klimke", "Levaggi", "Stoppani"],
-            # hue_order=["Klimke", "Levaggi", "Stoppani"],
-            # legend=False,
-            ax=axes[i, 1],
-            # dodge=0.3,
-            linestyle="none",
-        )
+        # Pointplot, one value per player and violin
+        for k, violin in enumerate(VIOLINS):
+            ax.plot(
+                x + dodge(len(VIOLINS), 0.3)[k],
+                diff_by_player.sel(violin=violin, criterion=criterion),
+                "o",
+                color=colors[::2][k],
+                label=violin,
+            )
+
+        draw_points(axes[i, 1], [0], abs_stats.sel(criterion=criterion), "C0")
+        axes[i, 1].set_xticks([])
 
-        ax.get_legend().remove()
         ax.set_ylabel(f"{CRITERION_MAP[criterion]}\nRating difference")
 
     xtick_labels = [str(i) for i in range(1, len(control_players) + 1)] + ["Test"]
@@ -130,14 +105,22 @@ def plot(dataset_path: pathlib.Path):
     # --- 3.4 Legends ---
     target_ax_top = axes[0, 0]
     handles_top, labels_top = target_ax_top.get_legend_handles_labels()
+    entries = dict(zip(labels_top, handles_top))
     axes[1, 1].legend(
-        handles_top[:3],
-        labels_top[:3],
+        [entries[violin] for violin in VIOLINS],
+        VIOLINS,
         title="Violin",
         loc="center left",
         bbox_to_anchor=(1.3, 0.5),
         borderaxespad=0,
     )
+    axes[-1, 1].legend(
+        [entries["Noise floor"]],
+        ["Noise floor"],
+        loc="center left",
+        bbox_to_anchor=(1.3, 0.5),
+        borderaxespad=0,
+    )
 
     plt.tight_layout()
 
@@ -145,29 +128,36 @@ def plot(dataset_path: pathlib.Path):
     output_png = pathlib.Path("reports/figures/ratings-variability.png")
     output_svg = pathlib.Path("reports/figures/ratings-variability.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process and plot violin recordings.")
-    parser.add_argument("--process", action="store_true", help="Process raw .mat files")
+    parser.add_argument("--process", action="store_true", help="Process new rating sheets")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument(
+        "--resamples", type=int, default=N_RESAMPLES, help="Noise floor resamples"
+    )
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
 
     # If no args provided, run both
     if not args.process and not args.plot:
         args.process = True
         args.plot = True
 
-    # if args.process:
-    # ds = build_dataset()
-    # save_dataset(ds, PROCESSED_DATA_PATH)
+    if args.process:
+        with profiling.stage("process"):
+            ratings_data.process()
 
     if args.plot:
-        plot(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH, args.resamples)
 
 
 if __name__ == "__main__":
@@ -3,34 +3,33 @@ import pathlib
 import warnings
 from typing import Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import xarray as xr
-import pandas as pd
-import seaborn as sns
 
-from config import mm, colors, ci, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import plotting
+import profiling
+from config import mm, colors, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import ratings_data
+from ratings_cube import (
+    PHASE_SESSIONS,
+    PROCESSED_DATA_PATH,
+    dodge,
+    draw_points,
+    draw_strip,
+    load_cube,
+)
 
 VIOLINS = ["klimke", "levaggi", "stoppani"]
 SCOPES = ["control", "test"]
 CRITERION = ["P", "F", "T"]
-
-PROCESSED_DATA_PATH = pathlib.Path("data/processed/ratings.csv")
+PHASES = [1, 2]
 
 
 def plot(dataset_path: pathlib.Path):
-    # --- 1. Load Data (Pandas) ---
-    df = pd.read_csv(dataset_path)
-
-    # --- 2. Compute difference ---
-    pivoted = df.pivot_table(
-        index=["scope", "violin", "player", "criterion"],
-        columns="phase",
-        values="rating",
-        aggfunc="mean",  # Handles duplicate ratings if any
-    )
-    df_diff = (pivoted[2] - pivoted[1]).reset_index(name="difference")
+    plt = plotting.pyplot()
+
+    # --- 1. Load Data (ratings cube) ---
+    cube = load_cube(dataset_path)
+    x = np.arange(len(SCOPES))
 
     # --- 3. Plotting ---
     fig, axes = plt.subplots(
@@ -45,47 +44,32 @@ def plot(dataset_path: pathlib.Path):
         for j, criterion in enumerate(CRITERION):
             ax = axes[i, j]
 
-            # Filter data for this specific cell
-            subset = df[
-                (df["violin"] == violin.capitalize()) & (df["criterion"] == criterion)
-            ]
-
-            # Stripplot
-            sns.stripplot(
-                data=subset,
-                x="scope",
-                y="rating",
-                hue="phase",
-                dodge=True,
-                alpha=0.2,
-                palette=[colors[1], colors[2]],
-                order=["control", "test"],
-                hue_order=[1, 2],
-                legend=False,
-                ax=ax,
-            )
-
-            # Pointplot
-            sns.pointplot(
-                data=subset,
-                x="scope",
-                y="rating",
-                hue="phase",
-                errorbar=ci,
-                estimator="mean",
-                dodge=0.2,
-                linestyle="none",
-                palette=[colors[1], colors[2]],
-                order=["control", "test"],
-                hue_order=[1, 2],
-                ax=ax,
-                # legend=False,
-            )
-
+            # Select data for this specific cell
+            cell = {"violin": violin.capitalize(), "criterion": criterion}
+
+            for k, (phase, sessions) in enumerate(PHASE_SESSIONS.items()):
+                # Stripplot
+                for l, scope in enumerate(SCOPES):
+                    draw_strip(
+                        ax,
+                        x[l] + (k - 0.5) * 0.4,
+                        cube["rating"].sel(scope=scope, session=sessions, **cell),
+                        colors[phase],
+                    )
+
+                # Pointplot
+                draw_points(
+                    ax,
+                    x + dodge(len(PHASES), 0.2)[k],
+                    cube["phase_stats"].sel(phase=phase, **cell),
+                    colors[phase],
+                    label=phase,
+                )
+
+            ax.set_xticks(x)
             ax.set_xticklabels(["Control Group", "Test Violinist"])
 
             ax.set_xlabel("")
-            ax.get_legend().remove()
 
             if j == 0:
                 ax.sharey(axes[0, 0])
@@ -100,19 +84,18 @@ def plot(dataset_path: pathlib.Path):
     # --- 3.2 Row 4 : Differences ---
     for col, criteria in enumerate(CRITERION):
         ax = axes[-1, col]
-        subset = df_diff[(df_diff["criterion"] == criteria)]
-        sns.pointplot(
-            data=subset,
-            x="scope",
-            y="difference",
-            hue="violin",
-            palette=[colors["klimke"], colors["levaggi"], colors["stoppani"]],
-            ax=ax,
-            linestyle="none",
-            errorbar=ci,
-            dodge=0.4,
-        )
-        ax.get_legend().remove()
+        for k, violin in enumerate(VIOLINS):
+            draw_points(
+                ax,
+                x + dodge(len(VIOLINS), 0.4)[k],
+                cube["diff_stats"].sel(
+                    difference="P2-P1", violin=violin.capitalize(), criterion=criteria
+                ),
+                colors[violin],
+                label=violin.capitalize(),
+            )
+        ax.set_xticks(x)
+        ax.set_xticklabels(SCOPES)
         if col == 0:
             ax.set_ylabel("Rating difference")
         else:
@@ -149,29 +132,33 @@ def plot(dataset_path: pathlib.Path):
     output_png = pathlib.Path("reports/figures/ratings.png")
     output_svg = pathlib.Path("reports/figures/ratings.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process and plot violin recordings.")
-    parser.add_argument("--process", action="store_true", help="Process raw .mat files")
+    parser.add_argument("--process", action="store_true", help="Process new rating sheets")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
 
     # If no args provided, run both
     if not args.process and not args.plot:
         args.process = True
         args.plot = True
 
-    # if args.process:
-    # ds = build_dataset()
-    # save_dataset(ds, PROCESSED_DATA_PATH)
+    if args.process:
+        with profiling.stage("process"):
+            ratings_data.process()
 
     if args.plot:
-        plot(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":
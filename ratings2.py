@@ -3,20 +3,18 @@ import pathlib
 import warnings
 from typing import Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import xarray as xr
-import pandas as pd
-import seaborn as sns
 
-from config import mm, colors, ci, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import plotting
+import profiling
+from config import mm, VIOLIN_MAP, SCOPES_MAP, CRITERION_MAP
+import ratings_data
+from ratings_cube import PROCESSED_DATA_PATH, dodge, draw_points, draw_strip, load_cube
 
 VIOLINS = ["klimke", "levaggi", "stoppani"]
 SCOPES = ["control", "test"]
 CRITERION = ["P", "F", "T"]
-
-PROCESSED_DATA_PATH = pathlib.Path("data/processed/ratings.csv")
+SESSIONS = [1, 2, 3]
 
 colors = {
     1: "#9EcAE1",
@@ -30,18 +28,12 @@ colors = {
 
 
 def plot(dataset_path: pathlib.Path):
-    # --- 1. Load Data (Pandas) ---
-    df = pd.read_csv(dataset_path)
-    df = df[df.condition == "blind"].reset_index()
-
-    # --- 2. Compute difference ---
-    pivoted = df.pivot_table(
-        index=["scope", "violin", "player", "criterion"],
-        columns="session",
-        values="rating",
-        aggfunc="mean",  # Handles duplicate ratings if any
-    )
-    df_diff = (pivoted[3] - pivoted[1]).reset_index(name="difference")
+    plt = plotting.pyplot()
+    import matplotlib as mpl
+
+    # --- 1. Load Data (ratings cube, blind ratings only) ---
+    cube = load_cube(dataset_path, conditions=["blind"])
+    x = np.arange(len(SCOPES))
 
     # --- 3. Plotting ---
     fig, axes = plt.subplots(
@@ -51,52 +43,40 @@ def plot(dataset_path: pathlib.Path):
         sharey="row",
     )
 
+    strip_offsets = (np.arange(len(SESSIONS)) - 1) * 0.8 / len(SESSIONS)
+    strip_colors = [colors[1], colors[2], colors[2]]
+
     # A. Main Grid (Violin vs Violinist)
     for i, violin in enumerate(VIOLINS):
         for j, criterion in enumerate(CRITERION):
             ax = axes[i, j]
 
-            # Filter data for this specific cell
-            subset = df[
-                (df["violin"] == violin.capitalize()) & (df["criterion"] == criterion)
-            ]
-
-            # Stripplot
-            sns.stripplot(
-                data=subset,
-                x="scope",
-                y="rating",
-                hue="session",
-                alpha=0.2,
-                palette=[colors[1], colors[2], colors[2]],
-                order=["control", "test"],
-                hue_order=[1, 2, 3],
-                legend=False,
-                ax=ax,
-                dodge=0.5,
-            )
-
-            # Pointplot
-            sns.pointplot(
-                data=subset,
-                x="scope",
-                y="rating",
-                hue="session",
-                errorbar=ci,
-                estimator="mean",
-                linestyle="none",
-                palette=[colors[1], colors[2], colors[3]],
-                order=["control", "test"],
-                hue_order=[1, 2, 3],
-                ax=ax,
-                # legend=False,
-                dodge=0.5,
-            )
-
+            # Select data for this specific cell
+            cell = {"violin": violin.capitalize(), "criterion": criterion}
+
+            for k, session in enumerate(SESSIONS):
+                # Stripplot
+                for l, scope in enumerate(SCOPES):
+                    draw_strip(
+                        ax,
+                        x[l] + strip_offsets[k],
+                        cube["rating"].sel(scope=scope, session=session, **cell),
+                        strip_colors[k],
+                    )
+
+                # Pointplot
+                draw_points(
+                    ax,
+                    x + dodge(len(SESSIONS), 0.5)[k],
+                    cube["session_stats"].sel(session=session, **cell),
+                    colors[session],
+                    label=session,
+                )
+
+            ax.set_xticks(x)
             ax.set_xticklabels(["Control Group", "Test Violinist"])
 
             ax.set_xlabel("")
-            ax.get_legend().remove()
 
             if j == 0:
                 ax.sharey(axes[0, 0])
@@ -111,19 +91,18 @@ def plot(dataset_path: pathlib.Path):
     # --- 3.2 Row 4 : Differences ---
     for col, criteria in enumerate(CRITERION):
         ax = axes[-1, col]
-        subset = df_diff[(df_diff["criterion"] == criteria)]
-        sns.pointplot(
-            data=subset,
-            x="scope",
-            y="difference",
-            hue="violin",
-            palette=[colors["klimke"], colors["levaggi"], colors["stoppani"]],
-            ax=ax,
-            linestyle="none",
-            errorbar=ci,
-            dodge=0.4,
-        )
-        ax.get_legend().remove()
+        for k, violin in enumerate(VIOLINS):
+            draw_points(
+                ax,
+                x + dodge(len(VIOLINS), 0.4)[k],
+                cube["diff_stats"].sel(
+                    difference="3-1", violin=violin.capitalize(), criterion=criteria
+                ),
+                colors[violin],
+                label=violin.capitalize(),
+            )
+        ax.set_xticks(x)
+        ax.set_xticklabels(SCOPES)
         if col == 0:
             ax.set_ylabel("Rating difference")
         else:
@@ -163,29 +142,33 @@ def plot(dataset_path: pathlib.Path):
     output_png = pathlib.Path("reports/figures/ratings-2.png")
     output_svg = pathlib.Path("reports/figures/ratings-2.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process and plot violin recordings.")
-    parser.add_argument("--process", action="store_true", help="Process raw .mat files")
+    parser.add_argument("--process", action="store_true", help="Process new rating sheets")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
 
     # If no args provided, run both
     if not args.process and not args.plot:
         args.process = True
         args.plot = True
 
-    # if args.process:
-    # ds = build_dataset()
-    # save_dataset(ds, PROCESSED_DATA_PATH)
+    if args.process:
+        with profiling.stage("process"):
+            ratings_data.process()
 
     if args.plot:
-        plot(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,299 @@
+"""
+Cumulative link mixed models of the blind ratings, as in notebooks/ratings.r.
+
+For every (criterion, scope) subset, fit
+
+    rating ~ violin * session + (1|player)
+
+with a logit link: P(rating <= j) = F(theta_j - x'beta - u_player), with
+u_player ~ N(0, sigma^2). The random intercept is integrated out with
+Gauss-Hermite quadrature (nAGQ in ordinal::clmm). The likelihood and its
+gradient are evaluated on a whole (observation, node) array. Subsets with a
+single player are fitted without a random effect (ordinal::clm).
+
+Contrasts are emmeans-style, on the latent scale, with asymptotic z tests.
+"""
+
+import argparse
+import os
+import pathlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.optimize
+import scipy.special
+import scipy.stats
+
+import profiling
+from ratings_cube import CRITERION, PROCESSED_DATA_PATH, SCOPES, SESSIONS, VIOLINS
+from ratings_data import load_ratings
+
+OUTPUT_PATH = pathlib.Path("reports/ratings_clmm.csv")
+N_NODES = 15
+
+# Session weights of each contrast, within a violin
+CONTRASTS = {
+    "3 - 1": {1: -1, 3: 1},
+    "3 - (1, 2)": {1: -0.5, 2: -0.5, 3: 1},
+}
+
+
+def design(violin: np.ndarray, session: np.ndarray) -> Tuple[np.ndarray, list]:
+    """
+    Treatment-coded violin * session design, without intercept.
+
+    Returns:
+        Tuple of (X, names).
+    """
+    violins = [(v == np.asarray(violin)).astype(float) for v in VIOLINS[1:]]
+    sessions = [(s == np.asarray(session)).astype(float) for s in SESSIONS[1:]]
+    columns = violins + sessions + [v * s for v in violins for s in sessions]
+    names = (
+        [f"violin{v}" for v in VIOLINS[1:]]
+        + [f"session{s}" for s in SESSIONS[1:]]
+        + [f"violin{v}:session{s}" for v in VIOLINS[1:] for s in SESSIONS[1:]]
+    )
+    return np.column_stack(columns), names
+
+
+def thresholds(tau: np.ndarray) -> np.ndarray:
+    """Increasing thresholds from unconstrained parameters."""
+    return np.cumsum(np.concatenate([tau[:1], np.exp(tau[1:])]))
+
+
+def negative_log_likelihood(
+    params: np.ndarray,
+    X: np.ndarray,
+    y: np.ndarray,
+    group: np.ndarray,
+    n_levels: int,
+    nodes: np.ndarray,
+    weights: np.ndarray,
+) -> Tuple[float, np.ndarray]:
+    """
+    Negative marginal log-likelihood and its gradient.
+
+    Args:
+        params: Threshold parameters (n_levels - 1), then beta, then log(sigma)
+            when there is more than one quadrature node.
+        X: (observation, coefficient) design matrix.
+        y: Level index of each observation.
+        group: Player index of each observation.
+        n_levels: Number of rating levels.
+        nodes, weights: Gauss-Hermite nodes and weights, normalised for N(0, 1).
+
+    Returns:
+        Tuple of (value, gradient).
+    """
+    n_thresholds = n_levels - 1
+    n_coefs = X.shape[1]
+    tau = params[:n_thresholds]
+    beta = params[n_thresholds : n_thresholds + n_coefs]
+    sigma = np.exp(params[-1]) if len(nodes) > 1 else 0.0
+
+    theta = np.concatenate([[-np.inf], thresholds(tau), [np.inf]])
+    u = sigma * nodes  # (node,)
+    eta = (X @ beta)[:, None] + u[None, :]  # (observation, node)
+
+    # --- Category probabilities at every node ---
+    upper = scipy.special.expit(theta[y + 1][:, None] - eta)
+    lower = scipy.special.expit(theta[y][:, None] - eta)
+    p = np.maximum(upper - lower, 1e-300)
+    d_upper = upper * (1 - upper) / p
+    d_lower = lower * (1 - lower) / p
+
+    # --- Integrate the random intercept out, per player ---
+    n_groups = group.max() + 1
+    log_p = np.log(p)
+    log_joint = np.zeros((n_groups, len(nodes)))
+    np.add.at(log_joint, group, log_p)
+    log_joint += np.log(weights)
+    log_marginal = scipy.special.logsumexp(log_joint, axis=1)
+    posterior = np.exp(log_joint - log_marginal[:, None])[group]  # (observation, node)
+
+    # --- Gradient ---
+    d_eta = -(posterior * (d_upper - d_lower))
+    grad_beta = X.T @ d_eta.sum(axis=1)
+    grad_theta = np.bincount(
+        y, weights=(posterior * d_upper).sum(axis=1), minlength=n_levels
+    )[:n_thresholds] - np.bincount(
+        y, weights=(posterior * d_lower).sum(axis=1), minlength=n_levels
+    )[1:]
+    # theta_k = tau_0 + sum_{m <= k, m > 0} exp(tau_m)
+    grad_tau = np.cumsum(grad_theta[::-1])[::-1] * np.concatenate([[1], np.exp(tau[1:])])
+
+    grad = [grad_tau, grad_beta]
+    if len(nodes) > 1:
+        grad.append([np.sum(d_eta * u[None, :])])
+    return -log_marginal.sum(), -np.concatenate(grad)
+
+
+def fit(subset: pd.DataFrame, n_nodes: int = N_NODES) -> Optional[Dict]:
+    """
+    Fit the model to one subset of the ratings.
+
+    Args:
+        subset: Ratings with rating, violin, session and player columns.
+        n_nodes: Number of quadrature nodes for the random intercept.
+
+    Returns:
+        Dict with levels, coefficient names, params, beta and its covariance
+        (inverse Hessian of the negative log-likelihood), sigma and the
+        log-likelihood. None when there are not more ratings than parameters.
+        Missing ratings are left out.
+    """
+    subset = subset.dropna(subset=["rating"])
+    levels = np.sort(subset["rating"].unique())
+    y = np.searchsorted(levels, subset["rating"].to_numpy())
+    group = pd.factorize(subset["player"])[0]
+    X, names = design(subset["violin"].to_numpy(), subset["session"].to_numpy())
+
+    if group.max() == 0:
+        # A single player: no random effect
+        nodes, weights = np.zeros(1), np.ones(1)
+    else:
+        nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+        weights = weights / weights.sum()
+
+    # Thresholds at the logits of the cumulative proportions
+    cumulative = np.cumsum(np.bincount(y, minlength=len(levels)))[:-1] / len(y)
+    theta = scipy.special.logit(cumulative)
+    start = np.concatenate(
+        [theta[:1], np.log(np.maximum(np.diff(theta), 1e-3)), np.zeros(X.shape[1])]
+    )
+    if len(nodes) > 1:
+        start = np.append(start, 0.0)
+    if len(y) <= len(start):
+        warnings.warn(f"{len(y)} ratings for {len(start)} parameters, model not fitted")
+        return None
+
+    args = (X, y, group, len(levels), nodes, weights)
+    result = scipy.optimize.minimize(
+        negative_log_likelihood, start, args=args, jac=True, method="BFGS"
+    )
+    if not result.success:
+        warnings.warn(f"CLMM fit did not converge: {result.message}")
+
+    # --- Covariance from the finite-difference Hessian of the analytic gradient ---
+    h = 1e-5
+    eye = np.eye(len(result.x))
+    hessian = np.array(
+        [
+            negative_log_likelihood(result.x + h * e, *args)[1]
+            - negative_log_likelihood(result.x - h * e, *args)[1]
+            for e in eye
+        ]
+    ) / (2 * h)
+    cov = np.linalg.pinv((hessian + hessian.T) / 2)
+
+    n_thresholds = len(levels) - 1
+    coefs = slice(n_thresholds, n_thresholds + X.shape[1])
+    return {
+        "levels": levels,
+        "names": names,
+        "params": result.x,
+        "beta": result.x[coefs],
+        "beta_cov": cov[coefs, coefs],
+        "sigma": np.exp(result.x[-1]) if len(nodes) > 1 else 0.0,
+        "log_likelihood": -result.fun,
+        "n_players": group.max() + 1,
+    }
+
+
+def contrasts(model: Dict) -> pd.DataFrame:
+    """
+    Session contrasts within each violin, on the latent scale.
+
+    Returns:
+        DataFrame with one row per (violin, contrast): estimate, SE, z and p.
+    """
+    rows = []
+    for violin in VIOLINS:
+        for name, session_weights in CONTRASTS.items():
+            sessions = np.array(list(session_weights))
+            X, _ = design(np.repeat(violin, len(sessions)), sessions)
+            c = np.array(list(session_weights.values())) @ X
+            estimate = c @ model["beta"]
+            se = np.sqrt(c @ model["beta_cov"] @ c)
+            z = estimate / se
+            rows.append(
+                {
+                    "violin": violin,
+                    "contrast": name,
+                    "estimate": estimate,
+                    "se": se,
+                    "z": z,
+                    "p_value": 2 * scipy.stats.norm.sf(np.abs(z)),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def _fit_contrasts(key: Tuple[str, str], subset: pd.DataFrame, n_nodes: int) -> pd.DataFrame:
+    model = fit(subset, n_nodes)
+    if model is None:
+        return pd.DataFrame()
+    table = contrasts(model)
+    table.insert(0, "scope", key[1])
+    table.insert(0, "criterion", key[0])
+    table["sigma"] = model["sigma"]
+    table["n_players"] = model["n_players"]
+    return table
+
+
+def fit_subsets(
+    df: pd.DataFrame, n_nodes: int = N_NODES, n_jobs: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Fit every (criterion, scope) subset in parallel.
+
+    Args:
+        df: Blind ratings.
+        n_nodes: Number of quadrature nodes.
+        n_jobs: Number of worker processes.
+
+    Returns:
+        Contrasts of all subsets, in CRITERION x SCOPES order.
+    """
+    subsets = {
+        key: df[(df["criterion"] == key[0]) & (df["scope"] == key[1])]
+        for key in [(c, s) for c in CRITERION for s in SCOPES]
+    }
+    subsets = {key: subset for key, subset in subsets.items() if subset["rating"].notna().any()}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        tables = executor.map(
+            _fit_contrasts,
+            subsets.keys(),
+            subsets.values(),
+            [n_nodes] * len(subsets),
+        )
+        return pd.concat(list(tables), ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ordinal mixed models of the ratings.")
+    parser.add_argument("--nodes", type=int, default=N_NODES, help="Quadrature nodes")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--output", type=pathlib.Path, default=OUTPUT_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    with profiling.stage("load"):
+        df = load_ratings(PROCESSED_DATA_PATH)
+        df = df[df["condition"] == "blind"]
+    with profiling.stage("fit"):
+        results = fit_subsets(df, args.nodes, args.jobs)
+    print(results.round(4).to_string(index=False))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Ratings loaded once into a dense labelled array.
+
+The long ratings table becomes a (scope, player, violin, criterion, session,
+condition) array, NaN where a rating is missing. Session/phase differences and
+the mean/CI of every plotted cell are computed once, so figures only index into
+the cube.
+"""
+
+import pathlib
+import warnings
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ratings_data import PROCESSED_DATA_PATH, load_ratings
+
+SCOPES = ["control", "test"]
+VIOLINS = ["Klimke", "Levaggi", "Stoppani"]
+CRITERION = ["P", "F", "T"]
+SESSIONS = [1, 2, 3]
+CONDITIONS = ["blind", "non-blind"]
+PHASE_SESSIONS = {1: [1, 2], 2: [3]}
+DIFFERENCES = ["2-1", "3-1", "P2-P1"]
+
+DIMS = ["scope", "player", "violin", "criterion", "session", "condition"]
+
+
+def summary(da: xr.DataArray, dims: Sequence[str]) -> xr.DataArray:
+    """
+    Mean and 95% CI (as in config.ci) over `dims`, ignoring missing values.
+
+    Returns:
+        Array with a "stat" dimension: mean, low, high.
+    """
+    with warnings.catch_warnings():
+        # Empty cells
+        warnings.simplefilter("ignore", RuntimeWarning)
+        m = da.mean(dims)
+        s = 1.96 * da.std(dims) / np.sqrt(da.count(dims))
+    return xr.concat([m, m - s, m + s], dim=pd.Index(["mean", "low", "high"], name="stat"))
+
+
+def load_cube(
+    dataset_path: pathlib.Path = PROCESSED_DATA_PATH,
+    conditions: List[str] = CONDITIONS,
+) -> xr.Dataset:
+    """
+    Load the ratings table into a dense cube.
+
+    Duplicate ratings of a cell are averaged. Derived variables:
+        - rating: (scope, player, violin, criterion, session, condition)
+        - observed: mask of non-missing ratings
+        - session_mean: rating averaged over conditions
+        - diff: per-player 2-1, 3-1 and P2-P1 differences, where phase means
+          pool all ratings of the phase's sessions
+        - session_stats, phase_stats: mean/CI of the raw ratings of each
+          (scope, violin, criterion, session/phase) cell
+        - diff_stats: mean/CI over players of each difference
+
+    Args:
+        dataset_path: Path to the processed ratings table.
+        conditions: Conditions to keep.
+
+    Returns:
+        The cube as an xarray Dataset.
+    """
+    df = load_ratings(dataset_path)
+    df = df[df["condition"].isin(conditions)]
+
+    rating = (
+        df.groupby(DIMS, observed=True)["rating"]
+        .mean()
+        .astype(np.float32)
+        .to_xarray()
+        .reindex(
+            scope=SCOPES,
+            violin=VIOLINS,
+            criterion=CRITERION,
+            session=SESSIONS,
+            condition=conditions,
+        )
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        session_mean = rating.mean("condition")
+        phase_mean = xr.concat(
+            [
+                rating.sel(session=sessions).mean(["session", "condition"])
+                for sessions in PHASE_SESSIONS.values()
+            ],
+            dim=pd.Index(list(PHASE_SESSIONS), name="phase"),
+        )
+
+    diff = xr.concat(
+        [
+            session_mean.sel(session=2) - session_mean.sel(session=1),
+            session_mean.sel(session=3) - session_mean.sel(session=1),
+            phase_mean.sel(phase=2) - phase_mean.sel(phase=1),
+        ],
+        dim=pd.Index(DIFFERENCES, name="difference"),
+    ).drop_vars(["session", "phase"], errors="ignore")
+
+    phase_stats = xr.concat(
+        [
+            summary(rating.sel(session=sessions), ["player", "session", "condition"])
+            for sessions in PHASE_SESSIONS.values()
+        ],
+        dim=pd.Index(list(PHASE_SESSIONS), name="phase"),
+    )
+
+    return xr.Dataset(
+        {
+            "rating": rating,
+            "observed": rating.notnull(),
+            "session_mean": session_mean,
+            "diff": diff,
+            "session_stats": summary(rating, ["player", "condition"]),
+            "phase_stats": phase_stats,
+            "diff_stats": summary(diff, ["player"]),
+        }
+    )
+
+
+def dodge(n: int, width: float) -> np.ndarray:
+    """Offsets of n hue levels spread over `width`, as in seaborn's pointplot."""
+    if n == 1:
+        return np.zeros(1)
+    return np.linspace(-width / 2, width / 2, n)
+
+
+def draw_points(ax, x, stats: xr.DataArray, color, label=None):
+    """
+    Draw means with CI bars from an array with a "stat" dimension (see summary).
+    """
+    m, low, high = (
+        np.atleast_1d(stats.sel(stat=s).to_numpy()) for s in ["mean", "low", "high"]
+    )
+    ax.errorbar(
+        x,
+        m,
+        yerr=[m - low, high - m],
+        fmt="o",
+        color=color,
+        label=label,
+    )
+
+
+def draw_strip(ax, x: float, values: xr.DataArray, color, alpha=0.2, jitter=0.08, seed=0):
+    """
+    Draw the non-missing values of a cell as jittered points around x.
+    """
+    values = values.to_numpy().ravel()
+    values = values[~np.isnan(values)]
+    rng = np.random.default_rng(seed)
+    x = x + rng.uniform(-jitter, jitter, len(values))
+    ax.scatter(x, values, color=color, alpha=alpha, linewidths=0)
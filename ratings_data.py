@@ -0,0 +1,241 @@
+"""
+Ratings ingestion: raw per-session mark sheets -> typed columnar table.
+
+Each mark sheet has one row per player ("Nom") and one column per violin and
+criterion ("A.P", "A.F", ..., "E.T"). Violins D and E are the non-blind
+repetitions of A and C. Every session is written to its own Parquet file, so a
+new session is appended without reprocessing the earlier ones, and the whole
+table is read back at once with categorical dtypes. The content hash of the
+sheet behind every session is kept in SOURCES, next to the session files, so a
+session is reprocessed whenever its sheet changes, whatever its mtime.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from hashing import file_hash
+
+RAW_DATA_DIR = pathlib.Path("data/raw/ratings")
+PROCESSED_DATA_PATH = pathlib.Path("data/processed/ratings.parquet")
+SOURCES = "sources.json"
+SHEET_PATTERN = re.compile(r"Session (\d+)\.csv$")
+
+VIOLIN_NAMES = {"A": "Klimke", "B": "Levaggi", "C": "Stoppani"}
+# Non-blind repetitions -> blind violin
+NON_BLIND = {"D": "A", "E": "C"}
+TEST_PLAYER = "SMD"
+
+CATEGORIES = {
+    "violin": ["Klimke", "Levaggi", "Stoppani"],
+    "criterion": ["P", "F", "T"],
+    "condition": ["blind", "non-blind"],
+    "scope": ["control", "test"],
+}
+COLUMNS = ["violin", "criterion", "rating", "condition", "player", "session", "phase", "scope"]
+
+
+def list_sheets(raw_data_dir: pathlib.Path = RAW_DATA_DIR) -> Dict[int, pathlib.Path]:
+    """
+    Find the mark sheets of every session.
+
+    Returns:
+        Dict of session -> sheet path, sorted by session.
+    """
+    sheets = {}
+    for filepath in raw_data_dir.glob("*.csv"):
+        match = SHEET_PATTERN.search(filepath.name)
+        if match:
+            sheets[int(match.group(1))] = filepath
+    return dict(sorted(sheets.items()))
+
+
+def player_id(names: pd.Series) -> np.ndarray:
+    """Stable pseudonymous player ids (unlike hash(), identical across runs)."""
+    return pd.util.hash_pandas_object(names, index=False).to_numpy().view(np.int64)
+
+
+def typed(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast a long ratings table to its storage dtypes."""
+    df = df[COLUMNS].astype(
+        {
+            "rating": np.float32,
+            "player": np.int64,
+            "session": np.int8,
+            "phase": np.int8,
+        }
+    )
+    for column, categories in CATEGORIES.items():
+        df[column] = pd.Categorical(df[column], categories=categories)
+    return df.reset_index(drop=True)
+
+
+def read_sheet(filepath: pathlib.Path, session: int) -> pd.DataFrame:
+    """
+    Read one mark sheet into the long ratings table.
+
+    Args:
+        filepath: Path to the session's mark sheet.
+        session: Session number.
+
+    Returns:
+        One row per (player, violin, criterion, condition) rating.
+    """
+    sheet = pd.read_csv(filepath)
+    marks = sheet.filter(regex=r"^[A-E]\.[PFT]$")
+    columns = marks.columns.str.split(".", expand=True)  # (violin, criterion)
+    n_players, n_columns = marks.shape
+
+    violin = np.tile(columns.get_level_values(0).to_numpy(dtype=object), n_players)
+    non_blind = np.isin(violin, list(NON_BLIND))
+    violin = pd.Series(violin).replace(NON_BLIND).map(VIOLIN_NAMES)
+
+    names = sheet["Nom"].astype(str)
+    df = pd.DataFrame(
+        {
+            "violin": violin,
+            "criterion": np.tile(columns.get_level_values(1).to_numpy(dtype=object), n_players),
+            "rating": pd.to_numeric(marks.to_numpy().ravel(), errors="coerce"),
+            "condition": np.where(non_blind, "non-blind", "blind"),
+            "player": np.repeat(player_id(names), n_columns),
+            "session": session,
+            "phase": 2 if session == 3 else 1,
+            "scope": np.repeat(np.where(names == TEST_PLAYER, "test", "control"), n_columns),
+        }
+    )
+    return typed(df)
+
+
+def session_path(output_path: pathlib.Path, session: int) -> pathlib.Path:
+    return output_path / f"session-{session}.parquet"
+
+
+def save_session(df: pd.DataFrame, output_path: pathlib.Path, session: int):
+    """
+    Write one session's ratings, replacing a previous version of that session.
+    """
+    output_path.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(session_path(output_path, session), index=False)
+    print(f"Session {session} saved to {session_path(output_path, session)}")
+
+
+def read_sources(output_path: pathlib.Path) -> Dict[str, str]:
+    """Session -> SHA-1 of the sheet it was processed from."""
+    path = output_path / SOURCES
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def process(
+    raw_data_dir: pathlib.Path = RAW_DATA_DIR,
+    output_path: pathlib.Path = PROCESSED_DATA_PATH,
+    force: bool = False,
+) -> List[int]:
+    """
+    Process the sheets of new or modified sessions.
+
+    A session is skipped when its Parquet file was written from a sheet with
+    the same content.
+
+    Returns:
+        The sessions that were (re)processed.
+    """
+    sources = read_sources(output_path)
+    processed = []
+    for session, filepath in list_sheets(raw_data_dir).items():
+        digest = file_hash(filepath, {})
+        target = session_path(output_path, session)
+        if not force and target.exists() and sources.get(str(session)) == digest:
+            continue
+        with profiling.stage("session", file=filepath):
+            save_session(read_sheet(filepath, session), output_path, session)
+        sources[str(session)] = digest
+        (output_path / SOURCES).write_text(json.dumps(sources, indent=2))
+        processed.append(session)
+    if not processed:
+        print(f"No new session in {raw_data_dir}")
+    return processed
+
+
+def import_csv(csv_path: pathlib.Path, output_path: pathlib.Path = PROCESSED_DATA_PATH):
+    """
+    Split a legacy ratings.csv (from notebooks/ratings.qmd) into session files.
+
+    When the table has the player names (a "Nom" column), player ids are
+    recomputed from them with player_id, so that they match the sessions
+    processed from the sheets. Otherwise its player column is kept as it is,
+    with a warning: those ids do not match the ones of processed sheets.
+    """
+    df = pd.read_csv(csv_path)
+    if "Nom" in df:
+        df["player"] = player_id(df["Nom"].astype(str))
+    else:
+        warnings.warn(
+            f"{csv_path} has no player names ('Nom' column): its player ids are "
+            "kept and do not match those of sessions processed from the sheets"
+        )
+    df = typed(df)
+
+    sources = read_sources(output_path)
+    for session, group in df.groupby("session"):
+        save_session(group, output_path, int(session))
+        # Not from a sheet: reprocessed as soon as one is found
+        sources.pop(str(session), None)
+    if output_path.exists():
+        (output_path / SOURCES).write_text(json.dumps(sources, indent=2))
+
+
+def load_ratings(dataset_path: pathlib.Path = PROCESSED_DATA_PATH) -> pd.DataFrame:
+    """
+    Load the long ratings table of all sessions.
+
+    Args:
+        dataset_path: Directory of per-session Parquet files, or a CSV table.
+
+    Returns:
+        The ratings, with categorical violin, criterion, condition and scope.
+    """
+    dataset_path = pathlib.Path(dataset_path)
+    if dataset_path.suffix == ".csv":
+        return typed(pd.read_csv(dataset_path))
+    files = sorted(dataset_path.glob("session-*.parquet"))
+    if not files:
+        raise FileNotFoundError(f"No processed session in {dataset_path}")
+    return typed(pd.concat([pd.read_parquet(f) for f in files], ignore_index=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process the raw rating sheets.")
+    parser.add_argument("--process", action="store_true", help="Process new sessions")
+    parser.add_argument("--force", action="store_true", help="Reprocess every session")
+    parser.add_argument(
+        "--from-csv", type=pathlib.Path, help="Import a legacy processed ratings.csv"
+    )
+    parser.add_argument("--raw", type=pathlib.Path, default=RAW_DATA_DIR)
+    parser.add_argument("--output", type=pathlib.Path, default=PROCESSED_DATA_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # If no args provided, process
+    if not args.from_csv:
+        args.process = True
+
+    if args.from_csv:
+        with profiling.stage("import_csv"):
+            import_csv(args.from_csv, args.output)
+
+    if args.process:
+        with profiling.stage("process"):
+            process(args.raw, args.output, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Test-retest noise floor of the ratings, estimated from the control group.
+
+Control players had no intervention between sessions, so their session-to-session
+rating changes within a phase sample the null distribution of a change. The
+bootstrap draws players with replacement and, for every drawn player, an ordered
+pair of distinct sessions of the same phase (PHASE_SESSIONS). Only phase 1 has
+two sessions, so this amounts to a random sign flip of each drawn player's
+session 2 - session 1 change. All resamples are drawn and evaluated as one
+(resample, player, violin, criterion) array.
+
+- band: limits within which 95% of single-rating changes fall
+- abs_band: upper limit of the mean absolute change over players
+"""
+
+import argparse
+import warnings
+
+import numpy as np
+import xarray as xr
+
+import profiling
+from ratings_cube import CRITERION, PHASE_SESSIONS, PROCESSED_DATA_PATH, load_cube
+
+N_RESAMPLES = 5_000
+LEVEL = 0.95
+
+
+def resample_changes(
+    cube: xr.Dataset, n_resamples: int = N_RESAMPLES, seed: int = 0
+) -> xr.DataArray:
+    """
+    Bootstrap session-to-session rating changes of the control group.
+
+    Pairs are drawn within a phase only: phase 2 sessions follow the playing-in
+    of the Klimke, so pairs across phases would put the very effect the noise
+    floor is compared with into its null distribution.
+
+    Args:
+        cube: Ratings cube (see ratings_cube.load_cube).
+        n_resamples: Number of bootstrap resamples.
+        seed: Seed of the random generator.
+
+    Returns:
+        Array of shape (resample, player, violin, criterion), NaN where one of
+        the two drawn sessions was not rated.
+    """
+    values = (
+        cube["session_mean"]
+        .sel(scope="control")
+        .dropna("player", how="all")
+        .transpose("player", "violin", "criterion", "session")
+    )
+    n_players = values.sizes["player"]
+    array = values.to_numpy()
+
+    # Ordered pairs of distinct sessions of a phase, as positions on "session"
+    sessions = list(values["session"].values)
+    pairs = np.array(
+        [
+            (sessions.index(a), sessions.index(b))
+            for phase_sessions in PHASE_SESSIONS.values()
+            for a in phase_sessions
+            for b in phase_sessions
+            if a != b and a in sessions and b in sessions
+        ]
+    )
+    if len(pairs) == 0:
+        raise ValueError("No phase has two rated sessions")
+
+    rng = np.random.default_rng(seed)
+    players = rng.integers(n_players, size=(n_resamples, n_players))
+    drawn = pairs[rng.integers(len(pairs), size=(n_resamples, n_players))]
+    first, second = drawn[..., 0], drawn[..., 1]
+
+    # (resample, player, violin, criterion)
+    changes = array[players, ..., second] - array[players, ..., first]
+    return xr.DataArray(
+        changes,
+        dims=["resample", "player", "violin", "criterion"],
+        coords={"violin": values["violin"], "criterion": values["criterion"]},
+    )
+
+
+def noise_floor(
+    cube: xr.Dataset,
+    n_resamples: int = N_RESAMPLES,
+    level: float = LEVEL,
+    seed: int = 0,
+) -> xr.Dataset:
+    """
+    Noise bands of rating changes, per criterion.
+
+    Args:
+        cube: Ratings cube (see ratings_cube.load_cube).
+        n_resamples: Number of bootstrap resamples.
+        level: Coverage of the bands.
+        seed: Seed of the random generator.
+
+    Returns:
+        Dataset with, per criterion:
+            - band: (bound) low/high quantiles of a single change, averaged
+              over resamples
+            - abs_band: upper quantile over resamples of the mean absolute
+              change over players and violins
+    """
+    changes = resample_changes(cube, n_resamples, seed)
+    alpha = (1 - level) / 2
+
+    with warnings.catch_warnings():
+        # Resamples where a criterion has no complete pair
+        warnings.simplefilter("ignore", RuntimeWarning)
+        quantiles = changes.quantile([alpha, 1 - alpha], dim=["player", "violin"])
+        band = quantiles.mean("resample")
+        abs_band = np.abs(changes).mean(["player", "violin"]).quantile(level, "resample")
+
+    return xr.Dataset(
+        {
+            "band": band.rename(quantile="bound").assign_coords(bound=["low", "high"]),
+            "abs_band": abs_band.drop_vars("quantile"),
+        }
+    ).reindex(criterion=CRITERION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test-retest noise floor of the ratings.")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--level", type=float, default=LEVEL)
+    parser.add_argument("--seed", type=int, default=0)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    with profiling.stage("load"):
+        cube = load_cube(PROCESSED_DATA_PATH)
+    with profiling.stage("noise_floor"):
+        floor = noise_floor(cube, args.resamples, args.level, args.seed)
+    table = floor["band"].transpose("criterion", "bound").to_pandas()
+    table["abs_high"] = floor["abs_band"].to_pandas()
+    print(table.round(3))
+
+
+if __name__ == "__main__":
+    main()
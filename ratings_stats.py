@@ -0,0 +1,304 @@
+"""
+Paired tests on the blind ratings, for every (scope, violin, criterion) cell at once.
+
+- ttest: paired t-test, session 3 vs session 1
+- wilcoxon: Wilcoxon signed-rank test, session 3 vs session 1
+- friedman: Friedman test over sessions 1, 2 and 3
+
+Each test also gets a permutation p-value: sign flips of the paired differences
+(exact when every sign pattern fits in the resampling budget) and within-player
+shuffles of the session labels for Friedman. Resamples are shared by all cells,
+so a resample is one matrix product, and chunks of resamples run in parallel.
+Only players rated in all three sessions are kept, as in ratings-explore.qmd.
+"""
+
+import argparse
+import itertools
+import os
+import pathlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+import xarray as xr
+
+import profiling
+from ratings_cube import PROCESSED_DATA_PATH, load_cube
+
+OUTPUT_PATH = pathlib.Path("reports/ratings_tests.csv")
+CELL = ["scope", "violin", "criterion"]
+TESTS = ["ttest", "wilcoxon", "friedman"]
+CHUNK_SIZE = 10_000
+
+# The 6 orderings of 3 sessions, as permutation matrices
+PERMUTATIONS = np.array(
+    [np.eye(3)[list(p)] for p in itertools.permutations(range(3))], dtype=np.float32
+)
+
+
+def paired_sessions(cube: xr.Dataset) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Stack cells and keep complete players.
+
+    Returns:
+        Tuple of (values, cells): values has shape (cell, player, session) and is
+        NaN for players missing a session, cells describes each cell.
+    """
+    stacked = (
+        cube["session_mean"].stack(cell=CELL).transpose("cell", "player", "session")
+    )
+    values = stacked.to_numpy().astype(np.float64)
+    values[np.isnan(values).any(axis=-1)] = np.nan
+    cells = stacked["cell"].to_index().to_frame(index=False)
+    return values, cells
+
+
+def friedman_ranks(values: np.ndarray) -> np.ndarray:
+    """Ranks across sessions within each player, 0 for incomplete players."""
+    ranks = scipy.stats.rankdata(values, axis=-1)
+    return np.where(np.isnan(values), 0, ranks)
+
+
+def friedman(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Friedman chi-square statistic (tie-corrected) and p-value for every cell.
+    """
+    k = values.shape[-1]
+    ranks = friedman_ranks(values)
+    n = np.sum(~np.isnan(values[..., 0]), axis=-1)
+    rank_sums = ranks.sum(axis=1)
+    q = 12 / (n * k * (k + 1)) * np.sum(rank_sums**2, axis=-1) - 3 * n * (k + 1)
+
+    # Tie correction
+    ties = np.zeros(len(values))
+    for c, player in zip(*np.nonzero(~np.isnan(values[..., 0]))):
+        _, counts = np.unique(values[c, player], return_counts=True)
+        ties[c] += np.sum(counts**3 - counts)
+    q = q / (1 - ties / (n * k * (k**2 - 1)))
+    return q, scipy.stats.chi2.sf(q, k - 1)
+
+
+def signed_ranks(d: np.ndarray) -> np.ndarray:
+    """Signed ranks of |d| among non-zero differences, 0 for zeros and NaN."""
+    d = np.where(d == 0, np.nan, d)
+    ranks = scipy.stats.rankdata(np.abs(d), axis=-1, nan_policy="omit")
+    return np.nan_to_num(np.sign(d) * ranks)
+
+
+def parametric_tests(values: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Statistics and p-values of the three tests for every cell.
+
+    Returns:
+        Tuple of (statistic, p_value) DataFrames, one column per test. Cells
+        with fewer than two complete players are NaN.
+    """
+    statistic = pd.DataFrame(np.nan, index=range(len(values)), columns=TESTS)
+    p_value = statistic.copy()
+
+    valid = np.sum(~np.isnan(values[..., 0]), axis=-1) >= 2
+    s1, s3 = values[valid, :, 0], values[valid, :, 2]
+    with warnings.catch_warnings():
+        # Constant differences
+        warnings.simplefilter("ignore", RuntimeWarning)
+        results = {
+            "ttest": scipy.stats.ttest_rel(s3, s1, axis=-1, nan_policy="omit"),
+            "wilcoxon": scipy.stats.wilcoxon(s3, s1, axis=-1, nan_policy="omit"),
+            "friedman": friedman(values[valid]),
+        }
+    for test, (stat, p) in results.items():
+        statistic.loc[valid, test] = np.asarray(stat)
+        p_value.loc[valid, test] = np.asarray(p)
+    return statistic, p_value
+
+
+def _sign_flip_counts(columns: np.ndarray, signs: np.ndarray) -> np.ndarray:
+    """
+    Count resampled |sum(sign * column)| at least as large as the observed one.
+
+    Args:
+        columns: (player, k) paired statistics, 0 for missing players.
+        signs: (resample, player) array of +1/-1.
+    """
+    observed = np.abs(columns.sum(axis=0))
+    resampled = np.abs(signs @ columns)
+    return np.sum(resampled >= observed - 1e-9, axis=0)
+
+
+def _permutation_chunk(
+    columns: np.ndarray,
+    ranks: np.ndarray,
+    n_resamples: int,
+    seed: np.random.SeedSequence,
+    flips: bool = True,
+) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    Monte-Carlo counts for one chunk of resamples.
+
+    Args:
+        columns: (player, k) columns for sign flips.
+        ranks: (cell, player, session) Friedman ranks.
+        flips: Whether to draw sign flips, False when they are enumerated
+            exactly (the flip counts are then None).
+    """
+    rng = np.random.default_rng(seed)
+    n_players = columns.shape[0]
+
+    flip_counts = None
+    if flips:
+        signs = rng.choice(
+            np.array([-1, 1], dtype=np.float64), size=(n_resamples, n_players)
+        )
+        flip_counts = _sign_flip_counts(columns, signs)
+
+    # Permuting sessions within a player permutes that player's ranks
+    observed = np.sum(ranks.sum(axis=1) ** 2, axis=-1)
+    orders = PERMUTATIONS[rng.integers(len(PERMUTATIONS), size=(n_resamples, n_players))]
+    rank_sums = np.einsum("cpi,rpij->crj", ranks.astype(np.float32), orders)
+    friedman_counts = np.sum(
+        np.sum(rank_sums**2, axis=-1) >= observed[:, None] - 1e-6, axis=1
+    )
+    return flip_counts, friedman_counts
+
+
+def permutation_tests(
+    values: np.ndarray,
+    n_resamples: int = 100_000,
+    n_jobs: Optional[int] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Permutation p-values of the three tests for every cell.
+
+    Returns:
+        DataFrame with one column per test and one row per cell.
+    """
+    n_cells, n_players, _ = values.shape
+    d = values[..., 2] - values[..., 0]
+    columns = np.concatenate([np.nan_to_num(d), signed_ranks(d)]).T  # (player, 2 * cell)
+    ranks = friedman_ranks(values)
+
+    # --- Sign flips: exact enumeration when it fits in the budget ---
+    exact = 2**n_players <= n_resamples
+    if exact:
+        signs = np.array(list(itertools.product([-1.0, 1.0], repeat=n_players)))
+        flip_p = _sign_flip_counts(columns, signs) / len(signs)
+
+    # --- Monte-Carlo chunks, in parallel (Friedman, and sign flips if not exact) ---
+    sizes = [CHUNK_SIZE] * (n_resamples // CHUNK_SIZE)
+    if n_resamples % CHUNK_SIZE:
+        sizes.append(n_resamples % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(
+            executor.map(
+                _permutation_chunk,
+                itertools.repeat(columns),
+                itertools.repeat(ranks),
+                sizes,
+                seeds,
+                itertools.repeat(not exact),
+            )
+        )
+    friedman_counts = sum(r[1] for r in results)
+
+    if not exact:
+        flip_counts = sum(r[0] for r in results)
+        flip_p = (flip_counts + 1) / (n_resamples + 1)
+    friedman_p = (friedman_counts + 1) / (n_resamples + 1)
+
+    n = np.sum(~np.isnan(d), axis=-1)
+    p = pd.DataFrame(
+        {
+            "ttest": flip_p[:n_cells],
+            "wilcoxon": flip_p[n_cells:],
+            "friedman": friedman_p,
+        }
+    )
+    # No permutation distribution with fewer than two players
+    p[n < 2] = np.nan
+    return p
+
+
+def holm(p: np.ndarray) -> np.ndarray:
+    """Holm-Bonferroni adjusted p-values, NaN entries are left out."""
+    adjusted = np.full_like(p, np.nan, dtype=np.float64)
+    valid = ~np.isnan(p)
+    m = valid.sum()
+    order = np.argsort(p[valid])
+    steps = np.maximum.accumulate((m - np.arange(m)) * p[valid][order])
+    adjusted[np.flatnonzero(valid)[order]] = np.minimum(steps, 1)
+    return adjusted
+
+
+def fdr(p: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg adjusted p-values, NaN entries are left out."""
+    adjusted = np.full_like(p, np.nan, dtype=np.float64)
+    valid = ~np.isnan(p)
+    m = valid.sum()
+    order = np.argsort(p[valid])[::-1]
+    steps = np.minimum.accumulate(p[valid][order] * m / np.arange(m, 0, -1))
+    adjusted[np.flatnonzero(valid)[order]] = np.minimum(steps, 1)
+    return adjusted
+
+
+def run_tests(
+    cube: xr.Dataset,
+    n_resamples: int = 100_000,
+    n_jobs: Optional[int] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Run every test on every cell.
+
+    Returns:
+        Tidy DataFrame with one row per (scope, violin, criterion, test).
+        Holm and Benjamini-Hochberg corrections are applied to the permutation
+        p-values, within each test.
+    """
+    values, cells = paired_sessions(cube)
+    statistic, p_value = parametric_tests(values)
+    p_perm = permutation_tests(values, n_resamples, n_jobs, seed)
+    n = np.sum(~np.isnan(values[..., 0]), axis=-1)
+
+    tables = []
+    for test in TESTS:
+        table = cells.copy()
+        table["test"] = test
+        table["n"] = n
+        table["statistic"] = statistic[test]
+        table["p_value"] = p_value[test]
+        table["p_perm"] = p_perm[test]
+        table["p_holm"] = holm(p_perm[test].to_numpy())
+        table["p_fdr"] = fdr(p_perm[test].to_numpy())
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paired tests on the blind ratings.")
+    parser.add_argument("--resamples", type=int, default=100_000)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, default=OUTPUT_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    with profiling.stage("load"):
+        cube = load_cube(PROCESSED_DATA_PATH, conditions=["blind"])
+    with profiling.stage("tests"):
+        results = run_tests(cube, args.resamples, args.jobs, args.seed)
+    print(results.round(4).to_string(index=False))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
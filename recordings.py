@@ -3,15 +3,15 @@ import pathlib
 import warnings
 from typing import Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
 import pandas as pd
-import seaborn as sns
-
-import identification.dataset
+import soundfile as sf
 
+import compact as compact_storage
+import plotting
+import profiling
+import streaming
 from config import mm, colors, ci, VIOLIN_MAP
 
 # Constants
@@ -25,19 +25,20 @@ VIOLINS = ["klimke", "levaggi", "stoppani"]
 SCOPES = ["control", "test"]
 
 
-def build_dataset() -> xr.Dataset:
+FEATURE_CONFIG = {
+    "frame_size": 2048,
+    "hop_ratio": 4,
+    "n_coeff": 40,
+    "sr": 16000,
+    "sample_duration": 60,
+    "feature": "LTAS_welch_db",
+}
+
+
+def load_sources() -> pd.DataFrame:
     """
-    Iterate over raw files and build an xarray Dataset.
+    Scale recordings of the three violins, sessions 1 and 3.
     """
-    config = {
-        "frame_size": 2048,
-        "hop_ratio": 4,
-        "n_coeff": 40,
-        "sr": 16000,
-        "sample_duration": 60,
-        "feature": "LTAS_welch_db",
-    }
-
     data = pd.read_pickle(
         "/home/hugo/Thèse/identification/data/processed/dataset_cnsm.pkl"
     )
@@ -45,18 +46,81 @@ def build_dataset() -> xr.Dataset:
     data = data[data.session.isin([1, 3])]
     data = data[data.extract == "gamme"]
     data.violin = data.violin.map({"A": "klimke", "B": "levaggi", "C": "stoppani"})
+    return data
 
-    df = identification.dataset.get_dataset(config, data)
 
-    feature_matrix = np.stack(df["features"].values)
-    n_features = feature_matrix.shape[1]
-    f = np.linspace(0, config["sr"] // 2, n_features)
+def export_takes(
+    data: pd.DataFrame, raw_data_dir: pathlib.Path = RAW_DATA_DIR, force: bool = False
+) -> int:
+    """
+    Cut the scale takes out of the session recordings as 16-bit mono FLACs.
+
+    A take is written to <raw_data_dir>/phase_<phase>/<violin>/recordings/
+    gamme-<row>.flac, <row> being its index in the source table, at the rate
+    of its session recording. These are the files read by notes.py and
+    stimuli.py.
+
+    Args:
+        data: Rows of the source table, from load_sources.
+        raw_data_dir: Root of the raw data.
+        force: Rewrite the takes already exported.
+
+    Returns:
+        Number of files written.
+    """
+    written = 0
+    for row in data.itertuples():
+        phase = 2 if row.session == 3 else 1
+        dst = (
+            raw_data_dir
+            / f"phase_{phase}"
+            / row.violin
+            / "recordings"
+            / f"{row.extract}-{row.Index}.flac"
+        )
+        if dst.exists() and not force:
+            continue
+        sr = sf.info(row.file).samplerate
+        y, sr = sf.read(
+            row.file, start=round(row.start * sr), stop=round(row.end * sr), always_2d=True
+        )
+        y = (y.mean(axis=1) * 32767).astype(np.int16)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        sf.write(dst, y, sr)
+        written += 1
+    return written
+
+
+def compute_features(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Features of some rows of the source table, with phase and scope.
+    """
+    # Only processing needs the external identification package
+    import identification.dataset
+
+    df = identification.dataset.get_dataset(FEATURE_CONFIG, data)
 
     df["phase"] = df.apply(lambda row: 2 if row["session"] == 3 else 1, axis=1)
     df["scope"] = df.apply(
         lambda row: "test" if row["player"] == "SMD" else "control", axis=1
     )
     # df["player"] = df["player"].apply(hash)
+    return df
+
+
+def frequencies(n_features: int) -> np.ndarray:
+    return np.linspace(0, FEATURE_CONFIG["sr"] // 2, n_features)
+
+
+def build_dataset() -> xr.Dataset:
+    """
+    Iterate over raw files and build an xarray Dataset.
+    """
+    df = compute_features(load_sources())
+
+    feature_matrix = np.stack(df["features"].values)
+    n_features = feature_matrix.shape[1]
+    f = frequencies(n_features)
 
     ds = xr.Dataset(
         data_vars={
@@ -70,24 +134,97 @@ def build_dataset() -> xr.Dataset:
             "scope": (["measurement"], df["scope"]),
             "phase": (["measurement"], df["phase"]),
             "condition": (["measurement"], df["condition"]),
-            # "extract": (["measurement"], df["extract"]),
-            # "start_time": (["measurement"], df["start"]),
-            # "end_time": (["measurement"], df["end"]),
-            # "filepath": (["measurement"], df["file"]),
+            # Source of every take, read by stimuli.py and notes.py
+            "extract": (["measurement"], df["extract"]),
+            "start_time": (["measurement"], df["start"]),
+            "end_time": (["measurement"], df["end"]),
+            "filepath": (["measurement"], df["file"]),
         },
     )
     return ds
 
 
-def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path):
+def build_dataset_streaming(
+    output_path: pathlib.Path,
+    resume: bool = False,
+    batch_size: int = streaming.BATCH_SIZE,
+) -> int:
+    """
+    Compute the features batch by batch and write them as they come.
+
+    Same layout as build_dataset + save_dataset, in constant memory: only
+    `batch_size` rows of the source table are analysed at a time.
+
+    Args:
+        output_path: Dataset path.
+        resume: Continue an interrupted run, after the measurements already
+            written.
+        batch_size: Rows per batch, and records per write.
+
+    Returns:
+        Number of measurements in the dataset.
+    """
+    data = load_sources()
+    # One measurement per row of the source table, so resuming starts at the
+    # first row not written
+    done = streaming.n_records(output_path) if resume and streaming.is_partial(output_path) else 0
+    if done:
+        print(f"Resuming after {done} measurements")
+
+    with streaming.AppendWriter(output_path, resume=resume, batch_size=batch_size) as writer:
+        for start in range(done, len(data), batch_size):
+            rows = data.iloc[start : start + batch_size]
+            with profiling.stage("batch", start=start):
+                df = compute_features(rows)
+            if len(df) != len(rows):
+                raise ValueError(f"{len(df)} measurements for {len(rows)} recordings")
+            if not writer.layouts:
+                f = frequencies(len(df["features"].iloc[0]))
+                writer.define(None, {"features": ("frequency",)}, {"frequency": f})
+            for i, (_, row) in enumerate(df.iterrows()):
+                writer.append(
+                    None,
+                    features=row["features"],
+                    measurement=start + i,
+                    violin=row["violin"],
+                    violinist=row["player"],
+                    scope=row["scope"],
+                    phase=row["phase"],
+                    condition=row["condition"],
+                    extract=row["extract"],
+                    start_time=row["start"],
+                    end_time=row["end"],
+                    filepath=row["file"],
+                )
+        n_records = writer.n_records(None) if writer.layouts else done
+
+    print(f"Dataset saved to {output_path}")
+    return n_records
+
+
+def save_dataset(dataset: xr.Dataset, output_path: pathlib.Path, compact: bool = False):
+    """
+    Args:
+        compact: Store the features (dB) as int16 (see compact.py), decoded
+            transparently by xr.open_dataset.
+    """
+    encoding = {}
+    if compact:
+        encoding["features"] = compact_storage.db_encoding(dataset["features"])
+        error = compact_storage.max_error(encoding["features"])
+        print(f"features: int16 dB, error <= {error:.4f} dB")
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    dataset.to_netcdf(output_path)
+    dataset.to_netcdf(output_path, encoding=encoding)
     print(f"Dataset saved to {output_path}")
 
 
 def plot(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+    import matplotlib as mpl
+    import seaborn as sns
+
     # --- 1. Load Data (Xarray) ---
-    ds = xr.open_dataset(dataset_path)
+    ds = streaming.trim(xr.open_dataset(dataset_path))
     features = ds["features"].sel(frequency=slice(200, 5000))
 
     features_lin = 10 ** (features / 20)
@@ -125,17 +262,18 @@ def plot(dataset_path: pathlib.Path):
         for col, scope in enumerate(SCOPES):
             ax = axes[row, col]
 
-            sns.lineplot(
-                data=df[(df["violin"] == violin) & (df["scope"] == scope)],
-                x="frequency",
-                y="amplitude",
-                hue="phase",
-                errorbar=ci,
-                estimator="mean",
-                palette=[colors[1], colors[2]],
-                ax=ax,
-                err_kws={"linewidth": 0},
-            )
+            with profiling.stage("lineplot"):
+                sns.lineplot(
+                    data=df[(df["violin"] == violin) & (df["scope"] == scope)],
+                    x="frequency",
+                    y="amplitude",
+                    hue="phase",
+                    errorbar=ci,
+                    estimator="mean",
+                    palette=[colors[1], colors[2]],
+                    ax=ax,
+                    err_kws={"linewidth": 0},
+                )
 
             if col == 0:
                 ax.set_ylabel(f"{VIOLIN_MAP[violin]}\nAmplitude (dB)")
@@ -147,16 +285,17 @@ def plot(dataset_path: pathlib.Path):
     for col, scope in enumerate(SCOPES):
         ax = axes[-1, col]
 
-        sns.lineplot(
-            data=df_diff[df_diff["scope"] == scope],
-            x="frequency",
-            y="difference",
-            hue="violin",
-            errorbar=ci,
-            estimator="mean",
-            ax=ax,
-            err_kws={"linewidth": 0},
-        )
+        with profiling.stage("lineplot"):
+            sns.lineplot(
+                data=df_diff[df_diff["scope"] == scope],
+                x="frequency",
+                y="difference",
+                hue="violin",
+                errorbar=ci,
+                estimator="mean",
+                ax=ax,
+                err_kws={"linewidth": 0},
+            )
         ax.set_xlabel("Frequency")
         ax.set_ylabel("Difference (dB)" if col == 0 else "")
         ax.grid(True, alpha=0.3)
@@ -200,8 +339,10 @@ def plot(dataset_path: pathlib.Path):
     output_png = pathlib.Path("reports/figures/recordings.png")
     output_svg = pathlib.Path("reports/figures/recordings.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    plotting.lean(fig)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
@@ -209,20 +350,56 @@ def main():
     parser = argparse.ArgumentParser(description="Process and plot violin recordings.")
     parser.add_argument("--process", action="store_true", help="Process raw .mat files")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="Write the scale takes as FLACs in data/raw/phase_*/*/recordings",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="With --export, rewrite existing FLACs"
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Store the spectra as int16 dB"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write the measurements in batches as they are processed",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue an interrupted --stream run"
+    )
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
+    if args.resume:
+        args.stream = True
+    if args.stream and args.compact:
+        # The int16 scaling needs the range of the whole dataset
+        parser.error("--compact cannot be used with --stream")
 
     # If no args provided, run both
-    if not args.process and not args.plot:
+    if not args.process and not args.plot and not args.export:
         args.process = True
         args.plot = True
 
+    if args.export:
+        with profiling.stage("export"):
+            written = export_takes(load_sources(), RAW_DATA_DIR, args.force)
+        print(f"{written} takes exported to {RAW_DATA_DIR}")
+
     if args.process:
-        ds = build_dataset()
-        save_dataset(ds, PROCESSED_DATA_PATH)
+        with profiling.stage("process"):
+            if args.stream:
+                build_dataset_streaming(PROCESSED_DATA_PATH, args.resume)
+            else:
+                ds = build_dataset()
+                save_dataset(ds, PROCESSED_DATA_PATH, args.compact)
 
     if args.plot:
-        plot(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":
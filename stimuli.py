@@ -0,0 +1,335 @@
+"""
+Listening test stimuli rendered from the raw scale recordings.
+
+Every stimulus of data/raw/test.json ("A-SMD-1.wav": violin, player, session) is
+cut out of the matching gamme-N.flac, loudness-normalised and written as a WAV.
+Measurement k of data/processed/recordings.nc is the k-th FLAC ordered by N. Its
+session follows from its phase (phase 1: session 1, phase 2: session 3, as
+recordings.load_sources), and takes are ordered by their start in the session
+recording, or by measurement when recordings.nc does not store it.
+
+Loudness is the BS.1770 integrated loudness (K-weighting, 400 ms blocks with
+75% overlap, absolute and relative gates), measured block by block while
+streaming the segment, so only one block of audio is in memory at a time.
+Stimuli are rendered in a process pool. A manifest stores the source and
+parameters of every WAV so unchanged stimuli are skipped.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import re
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.signal
+import soundfile as sf
+import xarray as xr
+
+import profiling
+
+RAW_DATA_DIR = pathlib.Path("data/raw/")
+TEST_PATH = pathlib.Path("data/raw/test.json")
+RECORDINGS_PATH = pathlib.Path("data/processed/recordings.nc")
+OUTPUT_DIR = pathlib.Path("data/processed/stimuli")
+MANIFEST = "manifest.json"
+
+VIOLIN_LETTERS = {"A": "klimke", "B": "levaggi", "C": "stoppani"}
+# Session of the recordings of each phase (recordings.load_sources)
+PHASE_SESSIONS = {1: 1, 2: 3}
+
+# Rendering parameters
+PARAMS = {
+    "take": 0,  # index of the take among the matching recordings
+    "offset": 0.0,  # s, from the start of the recording
+    "duration": 8.0,  # s
+    "fade": 0.05,  # s, raised-cosine fade in and out
+    "target_lufs": -23.0,
+    "block": 0.1,  # s, hop of the loudness meter (a quarter of a 400 ms block)
+}
+
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU
+
+
+# --- 1. Sources ---
+
+
+def flac_index(filepath: pathlib.Path) -> int:
+    return int(re.search(r"(\d+)", filepath.stem).group(1))
+
+
+def list_sources(
+    raw_data_dir: pathlib.Path = RAW_DATA_DIR,
+    recordings_path: pathlib.Path = RECORDINGS_PATH,
+) -> pd.DataFrame:
+    """
+    Match the raw FLACs with the measurements of recordings.nc.
+
+    Returns:
+        One row per measurement: flac, violin, player, session, start_time (s,
+        or the measurement when recordings.nc does not store it).
+    """
+    flacs = sorted(raw_data_dir.glob("phase_*/*/recordings/*.flac"), key=flac_index)
+    ds = xr.open_dataset(recordings_path)
+    if len(flacs) != ds.sizes["measurement"]:
+        raise ValueError(
+            f"{len(flacs)} FLACs in {raw_data_dir} for "
+            f"{ds.sizes['measurement']} measurements in {recordings_path}"
+        )
+    # Measurements are stored in the order of the source table
+    start_time = ds["start_time"] if "start_time" in ds.coords else ds["measurement"]
+    return pd.DataFrame(
+        {
+            "flac": flacs,
+            "violin": ds["violin"].values,
+            "player": ds["violinist"].values,
+            "session": pd.Series(ds["phase"].values).map(PHASE_SESSIONS).to_numpy(),
+            "start_time": start_time.values,
+        }
+    )
+
+
+def list_stimuli(test_path: pathlib.Path = TEST_PATH) -> pd.DataFrame:
+    """
+    Unique stimuli of the test design.
+
+    Returns:
+        One row per stimulus: name, violin, player, session (as in test.json,
+        e.g. 1 or "1na").
+    """
+    with open(test_path, "r") as file:
+        test = json.load(file)
+    stimuli = pd.DataFrame([s for pair in test for s in pair]).drop_duplicates()
+    stimuli["name"] = (
+        stimuli["violin"] + "-" + stimuli["player"] + "-" + stimuli["session"].astype(str)
+    )
+    return stimuli.reset_index(drop=True)
+
+
+def plan(
+    stimuli: pd.DataFrame, sources: pd.DataFrame, params: Dict = PARAMS
+) -> List[Dict]:
+    """
+    Pick the source recording of every stimulus.
+
+    Stimuli without a recording (non-blind repetitions, session 2) are skipped
+    with a warning.
+
+    Returns:
+        List of jobs: name, flac path and rendering parameters.
+    """
+    jobs = []
+    for stimulus in stimuli.itertuples():
+        matching = sources[
+            (sources["violin"] == VIOLIN_LETTERS.get(stimulus.violin))
+            & (sources["player"] == stimulus.player)
+            & (sources["session"].astype(str) == str(stimulus.session))
+        ].sort_values("start_time")
+        if len(matching) <= params["take"]:
+            warnings.warn(f"No recording for {stimulus.name}, skipped")
+            continue
+        flac = matching["flac"].iloc[params["take"]]
+        jobs.append({"name": stimulus.name, "flac": str(flac), "params": params})
+    return jobs
+
+
+def job_key(job: Dict) -> str:
+    """Hash of a job's source file (path, size, mtime) and parameters."""
+    stat = os.stat(job["flac"])
+    content = json.dumps(
+        [job["flac"], stat.st_size, stat.st_mtime_ns, job["params"]], sort_keys=True
+    )
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+# --- 2. Loudness ---
+
+
+def k_weighting(sr: float) -> np.ndarray:
+    """
+    BS.1770 K-weighting (high shelf then high pass) for any sample rate.
+
+    Returns:
+        Second-order sections.
+    """
+    # High shelf: +4 dB above ~1.5 kHz
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500 / sr
+    alpha = np.sin(w0) / (2 / np.sqrt(2))
+    cos = np.cos(w0)
+    shelf = [
+        A * ((A + 1) + (A - 1) * cos + 2 * np.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * cos),
+        A * ((A + 1) + (A - 1) * cos - 2 * np.sqrt(A) * alpha),
+        (A + 1) - (A - 1) * cos + 2 * np.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * cos),
+        (A + 1) - (A - 1) * cos - 2 * np.sqrt(A) * alpha,
+    ]
+
+    # High pass at 38 Hz, with the unit numerator of BS.1770
+    w0 = 2 * np.pi * 38 / sr
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos = np.cos(w0)
+    high_pass = np.array([1, -2, 1, 1 + alpha, -2 * cos, 1 - alpha])
+    high_pass[:3] *= 1 + alpha
+
+    sos = np.array([shelf, high_pass])
+    return sos / sos[:, 3:4]
+
+
+def integrated_loudness(hop_energies: np.ndarray) -> float:
+    """
+    Gated loudness from the mean-square energies of consecutive 100 ms hops.
+
+    Args:
+        hop_energies: (hop, channel) mean squares of the K-weighted signal.
+
+    Returns:
+        Integrated loudness in LUFS, -inf for silence.
+    """
+    # 400 ms blocks with 75% overlap = 4 consecutive hops
+    kernel = np.ones(4) / 4
+    blocks = np.stack(
+        [np.convolve(e, kernel, mode="valid") for e in np.atleast_2d(hop_energies.T)]
+    ).sum(axis=0)
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(blocks)
+
+    gated = blocks[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return -np.inf
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+    return -0.691 + 10 * np.log10(gated.mean())
+
+
+# --- 3. Rendering ---
+
+
+def render(job: Dict, output_dir: pathlib.Path) -> Optional[str]:
+    """
+    Cut, normalise and write one stimulus.
+
+    Returns:
+        The job key, or None when the segment is silent.
+    """
+    params = job["params"]
+    info = sf.info(job["flac"])
+    sr = info.samplerate
+    start = int(params["offset"] * sr)
+    frames = min(int(params["duration"] * sr), info.frames - start)
+    hop = int(params["block"] * sr)
+    if frames < params["duration"] * sr:
+        warnings.warn(f"{job['name']}: recording shorter than the stimulus duration")
+
+    # --- First pass: K-weighted energy of every hop ---
+    sos = k_weighting(sr)
+    zi = np.zeros((sos.shape[0], 2, info.channels))
+    energies, peak = [], 0.0
+    for block in sf.blocks(job["flac"], blocksize=hop, start=start, frames=frames, always_2d=True):
+        peak = max(peak, np.abs(block).max())
+        weighted, zi = scipy.signal.sosfilt(sos, block, axis=0, zi=zi)
+        if len(block) == hop:
+            energies.append(np.mean(weighted**2, axis=0))
+    loudness = integrated_loudness(np.array(energies))
+    if not np.isfinite(loudness):
+        warnings.warn(f"{job['name']}: silent segment, skipped")
+        return None
+
+    gain = 10 ** ((params["target_lufs"] - loudness) / 20)
+    if peak * gain > 1:
+        warnings.warn(f"{job['name']}: clipping ({20 * np.log10(peak * gain):.1f} dBFS)")
+
+    # --- Second pass: gain, fades and writing ---
+    n_fade = int(params["fade"] * sr)
+    fade = 0.5 - 0.5 * np.cos(np.pi * np.arange(n_fade) / n_fade)
+    envelope = np.ones(frames)
+    envelope[:n_fade] = fade
+    envelope[frames - n_fade :] = fade[::-1]
+
+    output_path = output_dir / f"{job['name']}.wav"
+    tmp_path = output_path.with_suffix(".tmp.wav")
+    with sf.SoundFile(tmp_path, "w", sr, info.channels, subtype="PCM_16") as out:
+        position = 0
+        for block in sf.blocks(job["flac"], blocksize=hop, start=start, frames=frames, always_2d=True):
+            n = len(block)
+            out.write(np.clip(block * gain * envelope[position : position + n, None], -1, 1))
+            position += n
+    os.replace(tmp_path, output_path)
+    return job_key(job)
+
+
+def build_stimuli(
+    output_dir: pathlib.Path = OUTPUT_DIR,
+    params: Dict = PARAMS,
+    force: bool = False,
+    n_jobs: Optional[int] = None,
+) -> List[str]:
+    """
+    Render every stimulus of the test design whose source or parameters changed.
+
+    Returns:
+        Names of the rendered stimuli.
+    """
+    jobs = plan(list_stimuli(), list_sources(), params)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST
+    manifest = {}
+    if manifest_path.exists() and not force:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+    todo = [
+        job
+        for job in jobs
+        if manifest.get(job["name"]) != job_key(job)
+        or not (output_dir / f"{job['name']}.wav").exists()
+    ]
+    print(f"{len(todo)} stimuli to render, {len(jobs) - len(todo)} unchanged")
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        keys = list(executor.map(render, todo, [output_dir] * len(todo)))
+    for job, key in zip(todo, keys):
+        if key is not None:
+            manifest[job["name"]] = key
+
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return [job["name"] for job, key in zip(todo, keys) if key is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the listening test stimuli.")
+    parser.add_argument("--output", type=pathlib.Path, default=OUTPUT_DIR)
+    parser.add_argument("--duration", type=float, default=PARAMS["duration"])
+    parser.add_argument("--offset", type=float, default=PARAMS["offset"])
+    parser.add_argument("--take", type=int, default=PARAMS["take"])
+    parser.add_argument("--target-lufs", type=float, default=PARAMS["target_lufs"])
+    parser.add_argument("--force", action="store_true", help="Render every stimulus")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    params = {
+        **PARAMS,
+        "duration": args.duration,
+        "offset": args.offset,
+        "take": args.take,
+        "target_lufs": args.target_lufs,
+    }
+    with profiling.stage("build_stimuli"):
+        rendered = build_stimuli(args.output, params, args.force, args.jobs)
+    print(f"{len(rendered)} stimuli written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
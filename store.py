@@ -0,0 +1,321 @@
+"""
+Consolidated store of the processed datasets, indexed by violin and phase.
+
+Every modality is a group of one netCDF4 (HDF5) file, data/processed/store.nc:
+
+- admittances: H (record, frequency), from admittances.nc
+- recordings: features (record, frequency), from recordings.nc
+- mocap: one variable per descriptor (excerpt, record, time), from mocap.nc,
+  one record per take
+- ratings: rating, criterion, condition... (record), from ratings.parquet
+- listening_test: distance (record), from listening_test.parquet, one record
+  per compared pair of phases: phase_a and phase_b (1 and 1, or 1 and 2)
+  instead of phase
+
+All groups share the same vocabulary: violin is one of VIOLINS (lowercase, as in
+admittances.nc, whatever the source calls it: "Klimke", "A"...), phase is 1 or
+2 and player is the pseudonymous id of ratings_data.player_id, computed from
+the names of the other sources (kept as player_name), so modalities join on
+player. Records are sorted by (violin, phase) and chunked along the record
+dimension, and the root group holds an index of the record ranges of every
+(group, violin, phase), a record comparing two phases being listed under both,
+so a query such as "phase 2, Klimke, everything" reads only the matching
+chunks of every group.
+"""
+
+import argparse
+import os
+import pathlib
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import profiling
+import streaming
+
+STORE_PATH = pathlib.Path("data/processed/store.nc")
+SOURCES = {
+    "admittances": pathlib.Path("data/processed/admittances.nc"),
+    "recordings": pathlib.Path("data/processed/recordings.nc"),
+    "mocap": pathlib.Path("data/processed/mocap.nc"),
+    "ratings": pathlib.Path("data/processed/ratings.parquet"),
+    "listening_test": pathlib.Path("data/processed/listening_test.parquet"),
+}
+
+VIOLINS = ["klimke", "levaggi", "stoppani", "own"]
+PHASES = [1, 2]
+# Letters of the rating sheets and of the listening test stimuli
+VIOLIN_LETTERS = {"A": "klimke", "B": "levaggi", "C": "stoppani"}
+
+# Target size of a chunk along the record dimension
+CHUNK_BYTES = 1 << 16
+
+
+def canonical_violin(names) -> np.ndarray:
+    """Map violin names of any source ("Klimke", "A", "klimke") to VIOLINS."""
+    names = pd.Series(np.asarray(names, dtype=str))
+    violins = names.map(VIOLIN_LETTERS).fillna(names.str.lower())
+    unknown = ~violins.isin(VIOLINS)
+    if unknown.any():
+        raise ValueError(f"Unknown violins: {names[unknown].unique()}")
+    return violins.to_numpy()
+
+
+# --- 1. Modalities as record datasets ---
+
+
+def _players(names) -> xr.Variable:
+    """Player ids of player names, as in the ratings."""
+    from ratings_data import player_id
+
+    names = pd.Series(np.asarray(names, dtype=str), dtype=object)
+    return xr.Variable("record", player_id(names))
+
+
+def _records(ds: xr.Dataset, dim: str) -> xr.Dataset:
+    """
+    Rename the record dimension and sort the records by (violin, phase), or by
+    (violin, phase_a, phase_b) for compared pairs of phases.
+    """
+    ds = ds.rename({dim: "record"}) if dim != "record" else ds
+    ds = ds.assign_coords(violin=("record", canonical_violin(ds["violin"].values)))
+    phases = [ds[name].values for name in ["phase_b", "phase_a", "phase"] if name in ds]
+    order = np.lexsort((*phases, pd.Categorical(ds["violin"].values, VIOLINS).codes))
+    ds = ds.isel(record=order)
+    return ds.drop_vars("record", errors="ignore")
+
+
+def admittances(path: pathlib.Path) -> xr.Dataset:
+    from admittances import load_dataset
+
+    ds = load_dataset(path).drop_vars("H_db", errors="ignore")
+    return _records(ds.load(), "measurement")
+
+
+def recordings(path: pathlib.Path) -> xr.Dataset:
+    ds = streaming.trim(xr.load_dataset(path)).rename({"violinist": "player_name"})
+    ds = ds.assign_coords(player=_players(ds["player_name"].values))
+    return _records(ds, "measurement")
+
+
+def mocap(path: pathlib.Path) -> xr.Dataset:
+    """One record per take, without the padding takes."""
+    ds = xr.load_dataset(path).stack(record=["violin", "phase", "take"])
+    ds = ds.isel(record=(ds["filename"] != "").any("excerpt").values)
+    ds = ds.reset_index("record").reset_coords(["violin", "phase", "take"])
+    ds = ds.set_coords(["violin", "phase", "take"]).transpose("excerpt", "record", ...)
+    return _records(ds, "record")
+
+
+def _table(df: pd.DataFrame) -> xr.Dataset:
+    """One record per row, categorical and string columns as strings."""
+    return xr.Dataset(
+        {
+            name: (
+                "record",
+                column.to_numpy()
+                if column.dtype.kind in "biuf"
+                else column.astype(str).to_numpy(dtype=object),
+            )
+            for name, column in df.items()
+        }
+    )
+
+
+def ratings(path: pathlib.Path) -> xr.Dataset:
+    from ratings_data import load_ratings
+
+    ds = _table(load_ratings(path)).set_coords(["violin", "phase", "session", "player"])
+    return _records(ds, "record")
+
+
+def listening_test(path: pathlib.Path) -> xr.Dataset:
+    """One record per (listener, violin, player) and compared pair of phases."""
+    from listening_test import PAIRS, load_dataset
+
+    df = load_dataset(path).melt(
+        id_vars=["listener", "violin", "player"],
+        value_vars=PAIRS,
+        var_name="pair",
+        value_name="distance",
+    )
+    df["phase_a"] = df["pair"].str[0].astype(np.int8)
+    df["phase_b"] = df["pair"].str[1].astype(np.int8)
+    df = df.drop(columns="pair").rename(columns={"player": "player_name"})
+    df["player"] = _players(df["player_name"]).values
+    ds = _table(df).set_coords(
+        ["listener", "violin", "player", "player_name", "phase_a", "phase_b"]
+    )
+    return _records(ds, "record")
+
+
+LOADERS = {
+    "admittances": admittances,
+    "recordings": recordings,
+    "mocap": mocap,
+    "ratings": ratings,
+    "listening_test": listening_test,
+}
+
+
+# --- 2. Writing ---
+
+
+def index_table(group: str, ds: xr.Dataset) -> pd.DataFrame:
+    """
+    Record ranges of every (violin, phase) of a group. A record comparing two
+    phases (phase_a, phase_b) is listed under both.
+    """
+    violins = ds["violin"].values
+    if "phase" in ds:
+        involved = {p: ds["phase"].values == p for p in PHASES}
+    else:
+        involved = {
+            p: (ds["phase_a"].values == p) | (ds["phase_b"].values == p) for p in PHASES
+        }
+
+    entries = []
+    for violin in VIOLINS:
+        for phase in PHASES:
+            records = np.flatnonzero((violins == violin) & involved[phase])
+            # One entry per run of consecutive records
+            for run in np.split(records, np.flatnonzero(np.diff(records) > 1) + 1):
+                if len(run):
+                    entries.append((group, violin, phase, run[0], run[-1] + 1))
+    return pd.DataFrame(entries, columns=["group", "violin", "phase", "start", "stop"])
+
+
+def encoding(ds: xr.Dataset) -> Dict:
+    """Chunks along the record dimension of about CHUNK_BYTES, compressed."""
+    encodings = {}
+    for name, da in ds.variables.items():
+        if "record" not in da.dims or da.dtype.kind in "OU":
+            continue
+        row_bytes = da.dtype.itemsize * int(np.prod([da.sizes[d] for d in da.dims if d != "record"]))
+        chunks = [
+            max(1, min(da.sizes[d], CHUNK_BYTES // row_bytes)) if d == "record" else da.sizes[d]
+            for d in da.dims
+        ]
+        encodings[name] = {"zlib": True, "complevel": 4, "chunksizes": tuple(chunks)}
+    return encodings
+
+
+def build_store(
+    output_path: pathlib.Path = STORE_PATH, sources: Dict = SOURCES
+) -> pd.DataFrame:
+    """
+    Write every available processed dataset to one file.
+
+    Returns:
+        The index: group, violin, phase, start, stop.
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_suffix(".tmp.nc")
+    tmp_path.unlink(missing_ok=True)
+
+    tables = []
+    for group, source in sources.items():
+        if not source.exists():
+            warnings.warn(f"{source} not found, {group} not stored")
+            continue
+        with profiling.stage(group, file=source):
+            ds = LOADERS[group](source)
+            ds.attrs["source"] = str(source)
+            ds.to_netcdf(tmp_path, group=group, mode="a", encoding=encoding(ds))
+        tables.append(index_table(group, ds))
+        print(f"{group}: {ds.sizes['record']} records")
+    if not tables:
+        raise ValueError("No processed dataset found.")
+
+    index = pd.concat(tables, ignore_index=True)
+    root = xr.Dataset(
+        {name: ("entry", index[name].to_numpy()) for name in index.columns},
+        coords={"violin_category": VIOLINS, "phase_category": PHASES},
+    )
+    root.to_netcdf(tmp_path, mode="a")
+    os.replace(tmp_path, output_path)
+    print(f"Store saved to {output_path}")
+    return index
+
+
+# --- 3. Reading ---
+
+
+def load_index(path: pathlib.Path = STORE_PATH) -> pd.DataFrame:
+    with xr.open_dataset(path) as root:
+        names = [n for n, v in root.data_vars.items() if v.dims == ("entry",)]
+        return root[names].to_dataframe().reset_index(drop=True)
+
+
+def select(
+    violin: Optional[str] = None,
+    phase: Optional[int] = None,
+    groups: Optional[List[str]] = None,
+    path: pathlib.Path = STORE_PATH,
+) -> Dict[str, xr.Dataset]:
+    """
+    Records of one violin and/or phase across modalities.
+
+    Only the chunks holding the matching records are read. Records comparing
+    two phases (the listening test) match either of them.
+
+    Args:
+        violin: Violin, in any naming ("Klimke", "A", "klimke"), None for all.
+        phase: 1 or 2, None for all.
+        groups: Groups to read, None for all.
+        path: Store path.
+
+    Returns:
+        Dict of group -> Dataset of the matching records.
+    """
+    index = load_index(path)
+    if violin is not None:
+        index = index[index["violin"] == canonical_violin([violin])[0]]
+    if phase is not None:
+        index = index[index["phase"] == phase]
+    if groups is not None:
+        index = index[index["group"].isin(groups)]
+
+    selection = {}
+    for group, entries in index.groupby("group", sort=False):
+        # A record comparing both phases is listed twice
+        records = np.unique(
+            np.concatenate([np.arange(e.start, e.stop) for e in entries.itertuples()])
+        )
+        with xr.open_dataset(path, group=group) as ds:
+            selection[group] = ds.isel(record=records).load()
+    return selection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidated multi-modal store.")
+    parser.add_argument("--process", action="store_true", help="Build the store")
+    parser.add_argument("--violin", help="Show the records of a violin")
+    parser.add_argument("--phase", type=int, choices=PHASES, help="Show the records of a phase")
+    parser.add_argument("--output", type=pathlib.Path, default=STORE_PATH)
+    profiling.add_argument(parser)
+
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # If no args provided, build
+    if not args.violin and not args.phase:
+        args.process = True
+
+    if args.process:
+        with profiling.stage("process"):
+            build_store(args.output)
+
+    if args.violin or args.phase:
+        with profiling.stage("select"):
+            selection = select(args.violin, args.phase, path=args.output)
+        for group, ds in selection.items():
+            print(f"--- {group}: {ds.sizes['record']} records ---")
+            print(ds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Append-oriented netCDF4 writer, for processing in constant memory.
+
+Records (one measurement: its data variables and its coordinates) are buffered
+and flushed every `batch_size` records along an unlimited dimension, so the
+memory in use is one batch whatever the size of the campaign. The file is
+opened for every flush and closed after, and every group records in its
+`n_records` attribute how many records are complete, updated once the batch is
+written. The root `complete` attribute is set when the writer is closed.
+
+A run that crashes thus leaves a readable file holding every flushed batch:
+`trim` drops a batch that was being written, and a writer opened with
+resume=True on an incomplete file appends after the records already written,
+which `written` lists so the caller can skip them.
+"""
+
+import pathlib
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+BATCH_SIZE = 64
+# Target size of a chunk along the record dimension
+CHUNK_BYTES = 1 << 16
+
+
+def is_partial(path: pathlib.Path) -> bool:
+    """Whether a file was left incomplete by an interrupted writer."""
+    if not path.exists():
+        return False
+    with netCDF4.Dataset(path) as nc:
+        return "complete" in nc.ncattrs() and not nc.getncattr("complete")
+
+
+def n_records(path: pathlib.Path, group: Optional[str] = None) -> int:
+    """Number of complete records of a group, 0 if it does not exist."""
+    if not path.exists():
+        return 0
+    with netCDF4.Dataset(path) as nc:
+        if group is not None and group not in nc.groups:
+            return 0
+        g = nc if group is None else nc[group]
+        return int(g.getncattr("n_records")) if "n_records" in g.ncattrs() else 0
+
+
+def trim(ds: xr.Dataset, dim: str = "measurement") -> xr.Dataset:
+    """Drop the records of a batch whose writing was interrupted."""
+    if "n_records" not in ds.attrs or dim not in ds.dims:
+        return ds
+    return ds.isel({dim: slice(0, int(ds.attrs["n_records"]))})
+
+
+class AppendWriter:
+    """
+    Write records along an unlimited dimension, in batches.
+
+    Every group (None for the root) is declared with `define`, then records
+    are added with `append`:
+
+        with AppendWriter(path) as writer:
+            writer.define(None, {"H": ("frequency",)}, {"frequency": f})
+            for ...:
+                writer.append(None, H=H, violin=violin, phase=phase)
+
+    Keyword arguments of `append` declared as variables are data variables of
+    shape (dim, *fixed dims); the others are scalar coordinates along dim.
+
+    A record of the root group closes a measurement: the records that other
+    groups hold for it are appended before it, and batches are only flushed
+    after a root record, so a measurement is never written in part.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        dim: str = "measurement",
+        resume: bool = False,
+        batch_size: int = BATCH_SIZE,
+        complevel: int = 4,
+    ):
+        self.path = path
+        self.dim = dim
+        self.batch_size = batch_size
+        self.complevel = complevel
+        self.layouts: Dict[Optional[str], Tuple[Dict, Dict, Dict]] = {}
+        self.buffers: Dict[Optional[str], List[Dict]] = {}
+        self.counts: Dict[Optional[str], int] = {}
+
+        if path.exists() and not (resume and is_partial(path)):
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists():
+            with netCDF4.Dataset(path, "w") as nc:
+                nc.setncattr("complete", 0)
+
+    def define(
+        self,
+        group: Optional[str],
+        variables: Dict[str, Sequence[str]],
+        coords: Dict[str, np.ndarray] = {},
+        attrs: Dict = {},
+    ):
+        """
+        Declare a group.
+
+        Args:
+            group: Group name, None for the root group.
+            variables: Fixed dimensions of every data variable, after dim.
+            coords: Values of the fixed dimensions.
+            attrs: Attributes of the group.
+        """
+        self.layouts[group] = (dict(variables), dict(coords), dict(attrs))
+        self.buffers[group] = []
+        self.counts[group] = n_records(self.path, group)
+
+    def n_records(self, group: Optional[str] = None) -> int:
+        """Number of records of a group, flushed or not."""
+        return self.counts[group] + len(self.buffers[group])
+
+    def written(self, group: Optional[str], name: str) -> List[Hashable]:
+        """Values of a coordinate in the records already in the file."""
+        n = self.counts[group]
+        if n == 0:
+            return []
+        with netCDF4.Dataset(self.path) as nc:
+            g = nc if group is None else nc[group]
+            return list(g[name][:n])
+
+    def append(self, group: Optional[str] = None, **record):
+        self.buffers[group].append(record)
+        if group is None and sum(len(b) for b in self.buffers.values()) >= self.batch_size:
+            self.flush()
+
+    def _create(self, g, name: str, values: np.ndarray, fixed: Sequence[str]):
+        dims = (self.dim, *fixed)
+        if values.dtype.kind in "OU":
+            g.createVariable(name, str, dims)
+            return
+        if values.dtype.kind == "b":
+            # netCDF has no boolean type: int8, decoded as bool by xarray
+            g.createVariable(name, np.int8, dims).setncattr("dtype", "bool")
+            return
+        row_bytes = values.dtype.itemsize * int(np.prod(values.shape[1:]))
+        rows = max(1, CHUNK_BYTES // row_bytes)
+        g.createVariable(
+            name,
+            values.dtype,
+            dims,
+            zlib=True,
+            complevel=self.complevel,
+            chunksizes=(rows, *values.shape[1:]),
+        )
+
+    def _write_group(self, nc, group: Optional[str]):
+        records = self.buffers[group]
+        variables, coords, attrs = self.layouts[group]
+        g = nc if group is None else (nc[group] if group in nc.groups else nc.createGroup(group))
+
+        if self.dim not in g.dimensions:
+            g.createDimension(self.dim, None)
+            for name, values in coords.items():
+                values = np.asarray(values)
+                g.createDimension(name, len(values))
+                g.createVariable(name, values.dtype, (name,))[:] = values
+            g.setncatts(attrs)
+
+        start, stop = self.counts[group], self.counts[group] + len(records)
+        scalars = [name for name in records[0] if name not in variables and name != self.dim]
+        for name in records[0]:
+            values = np.array([record[name] for record in records])
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+            if name not in g.variables:
+                self._create(g, name, values, variables.get(name, ()))
+                if name in variables:
+                    g[name].setncattr("coordinates", " ".join(scalars))
+            g[name][start:stop] = values.astype(np.int8) if values.dtype.kind == "b" else values
+
+    def flush(self):
+        """Write the buffered records, then mark them as complete."""
+        groups = [group for group, records in self.buffers.items() if records]
+        if not groups:
+            return
+        with netCDF4.Dataset(self.path, "a") as nc:
+            for group in groups:
+                self._write_group(nc, group)
+            for group in groups:
+                self.counts[group] += len(self.buffers[group])
+                self.buffers[group] = []
+                (nc if group is None else nc[group]).setncattr("n_records", self.counts[group])
+
+    def close(self):
+        """Flush and mark the file as complete."""
+        self.flush()
+        with netCDF4.Dataset(self.path, "a") as nc:
+            nc.setncattr("complete", 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Keep the finished records of an interrupted run, for resuming
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
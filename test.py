@@ -3,24 +3,25 @@ import pathlib
 import warnings
 from typing import Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 import pandas as pd
 
+import plotting
+import profiling
 from config import mm, colors, ci, VIOLIN_MAP, SCOPES_MAP
 import json
-
-PROCESSED_DATA_PATH = pathlib.Path("data/processed/listening_test.csv")
+from listening_test import PROCESSED_DATA_PATH, build_dataset, load_dataset, save_dataset
 
 VIOLINS = ["Klimke", "Levaggi", "Stoppani"]
 PLAYERS = ["Norimi", "SMD"]
 
 
 def plot(dataset_path: pathlib.Path):
+    plt = plotting.pyplot()
+    import seaborn as sns
+
     # --- 1. Load Data (Pandas) ---
-    df_diff = pd.read_csv(dataset_path)
+    df_diff = load_dataset(dataset_path)
     # TODO : fix "scope" column in the dataset creation
     df_diff["scope"] = "Control"
 
@@ -129,32 +130,37 @@ def plot(dataset_path: pathlib.Path):
     plt.tight_layout()
 
     # --- 4. Saving Figure ---
-    output_png = pathlib.Path("reports/figures/recordings.png")
-    output_svg = pathlib.Path("reports/figures/recordings.svg")
+    output_png = pathlib.Path("reports/figures/tests.png")
+    output_svg = pathlib.Path("reports/figures/tests.svg")
     output_png.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(output_png)
-    plt.savefig(output_svg)
+    for output_path in [output_png, output_svg]:
+        with profiling.stage("savefig", file=output_path):
+            plt.savefig(output_path)
     print(f"Figures saved to {output_png} and {output_svg}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process and plot violin recordings.")
-    parser.add_argument("--process", action="store_true", help="Process raw .mat files")
+    parser.add_argument("--process", action="store_true", help="Process raw answers")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    profiling.add_argument(parser)
 
     args = parser.parse_args()
+    profiling.enable(args.profile)
 
     # If no args provided, run both
     if not args.process and not args.plot:
         args.process = True
         args.plot = True
 
-    # if args.process:
-    # ds = build_dataset()
-    # save_dataset(ds, PROCESSED_DATA_PATH)
+    if args.process:
+        with profiling.stage("process"):
+            df = build_dataset()
+            save_dataset(df, PROCESSED_DATA_PATH)
 
     if args.plot:
-        plot(PROCESSED_DATA_PATH)
+        with profiling.stage("plot"):
+            plot(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":